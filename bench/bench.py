@@ -0,0 +1,312 @@
+# ./bench/bench.py
+#   the benchmarks of the scan, the hashing and the reconciliation of a
+#   filesystem task, on synthetic trees. for each file count, a tree is
+#   generated (the same for the same seed), pushed to a bucket of the local
+#   oss provider, and then churned, and the following runs are timed:
+#
+#     push            the first push, with the cold scan hashing every file
+#     diff (warm)     the warm scan, taking the unchanged files from the
+#                     last local catalog, with nothing changed
+#     diff            after the churn
+#     plan push       after the churn, up to the confirmations
+#     plan fetch      after the churn, up to the confirmations
+#
+#   each run is a sync process of its own in a copy of the application, so
+#   the tasks of the benchmark never touch conf/targets here. the wall time
+#   and the peak resident memory of the process are recorded with the time
+#   of each phase and the bytes hashed, read from the metrics the run writes
+#   (see shared/metrics.py). the results are saved as json, and two of them
+#   are compared by `python bench/bench.py compare old.json new.json`.
+#
+#   'cold' only means that no file is known from a last catalog. the files
+#   are still in the page cache after generating the tree, unless
+#   --drop-caches is given (linux, as root) to drop it before the first push.
+#
+#   usage: python bench/bench.py [--files 10k,100k,1m] [--sizes lognormal:2K,1.5]
+#                                [--depth 3] [--fanout 8] [--churn 0.01]
+#                                [--seed 0] [--work DIR] [--out FILE]
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__))).replace('\\', '/')
+sys.path.insert(0, root)
+
+from shared.configuration import parse_file_size
+from shared.ansi import error, info, format_file_size
+
+task = 'bench'
+
+# synthetic trees ------------------------------------------------------------
+
+# parse the size distribution into a function of the random generator giving
+# the size of a file. one of 'fixed:<size>', 'uniform:<min>-<max>', or
+# 'lognormal:<median>,<sigma>'.
+def parse_sizes(spec: str):
+    kind, _, params = spec.partition(':')
+    if kind == 'fixed':
+        size = parse_file_size(params)
+        return lambda rng: size
+    elif kind == 'uniform':
+        low, _, high = params.partition('-')
+        low, high = parse_file_size(low), parse_file_size(high)
+        return lambda rng: rng.randint(low, high)
+    elif kind == 'lognormal':
+        median, _, sigma = params.partition(',')
+        mu, sigma = math.log(max(parse_file_size(median), 1)), float(sigma or '1')
+        return lambda rng: int(rng.lognormvariate(mu, sigma))
+
+    error('invalid size distribution `{0}`. use fixed:<size>, uniform:<min>-<max> or '
+          'lognormal:<median>,<sigma>.'.format(spec))
+
+# parse the file count like '10k' or '1m'.
+def parse_count(count: str) -> int:
+    units = { 'k': 1000, 'm': 1000 ** 2 }
+    count = count.strip().lower()
+    if count[-1:] in units.keys(): return int(float(count[:-1]) * units[count[-1]])
+    return int(count)
+
+# the directory of the index-th file, spreading the files evenly into the
+# fanout ** depth leaf directories.
+def directory_of(index: int, depth: int, fanout: int) -> str:
+    leaf = index % (fanout ** depth)
+    names = []
+    for level in range(depth):
+        names += ['d{0}-{1}'.format(level, leaf % fanout)]
+        leaf //= fanout
+    return '/'.join(names)
+
+def file_path(tree: str, index: int, depth: int, fanout: int) -> str:
+    return '{0}/{1}/f{2:07d}.dat'.format(tree, directory_of(index, depth, fanout), index)
+
+def write_file(path: str, size: int, rng):
+    with open(path, 'wb') as fp: fp.write(rng.randbytes(size))
+
+# returns the total bytes of the tree.
+def generate_tree(tree: str, files: int, sizes, depth: int, fanout: int, rng) -> int:
+    total = 0
+    for index in range(files):
+        path = file_path(tree, index, depth, fanout)
+        if not os.path.exists(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+        size = sizes(rng)
+        write_file(path, size, rng)
+        total += size
+    return total
+
+# modify (three fifths), add (one fifth) and remove (the rest) the churn rate of
+# the files. returns the counts of them.
+def churn_tree(tree: str, files: int, rate: float, sizes, depth: int, fanout: int,
+               rng) -> dict:
+    churned = int(files * rate)
+    counts = { 'modified': churned * 3 // 5, 'added': churned // 5 }
+    counts['removed'] = churned - counts['modified'] - counts['added']
+    chosen = rng.sample(range(files), counts['modified'] + counts['removed'])
+
+    for index in chosen[:counts['modified']]:
+        write_file(file_path(tree, index, depth, fanout), sizes(rng), rng)
+    for index in chosen[counts['modified']:]:
+        os.remove(file_path(tree, index, depth, fanout))
+    for index in range(files, files + counts['added']):
+        path = file_path(tree, index, depth, fanout)
+        if not os.path.exists(os.path.dirname(path)): os.makedirs(os.path.dirname(path))
+        write_file(path, sizes(rng), rng)
+
+    return counts
+
+def drop_caches():
+    os.sync()
+    try:
+        with open('/proc/sys/vm/drop_caches', 'w') as fp: fp.write('3\n')
+    except OSError as e: error('cannot drop the page cache: {0}'.format(e))
+
+# the runs ---------------------------------------------------------------------
+
+# a copy of the application, with the plugins and without the tasks.
+def make_app(work: str) -> str:
+    app = work + '/app'
+    if os.path.exists(app): shutil.rmtree(app)
+    os.makedirs(app + '/conf')
+    shutil.copy(root + '/sync', app + '/sync')
+    for package in ['shared', 'tasks']:
+        shutil.copytree(root + '/' + package, app + '/' + package,
+                        ignore = shutil.ignore_patterns('__pycache__'))
+    for conf in ['providers', 'tasks']:
+        shutil.copy(root + '/conf/' + conf, app + '/conf/' + conf)
+    return app
+
+# run sync in the application, returns the exit status, the wall time and the
+# peak resident memory (in bytes, none where the platform cannot tell).
+def run_sync(app: str, argv: list) -> tuple:
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, app + '/sync'] + argv, stdin = subprocess.DEVNULL,
+                            stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # kilobytes on linux, bytes on macos.
+        peak = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    else:
+        proc.wait()
+        peak = None
+    return proc.returncode, time.perf_counter() - start, peak
+
+# the figures of the run from the metrics it has written.
+def read_metrics(app: str, command: str) -> dict:
+    figures = { 'phases': {}, 'hashed_files': 0, 'hashed_bytes': 0 }
+    path = '{0}/conf/{1}/{2}.metrics.json'.format(app, task, command)
+    if not os.path.exists(path): return figures
+
+    with open(path, 'r', encoding = 'utf-8') as fp:
+        summary = json.load(fp)
+    for metric in summary['metrics']:
+        if metric['name'] == 'sync_phase_seconds':
+            figures['phases'][metric['labels']['phase']] = metric['value']
+        elif metric['name'] == 'sync_hashed_files': figures['hashed_files'] = metric['value']
+        elif metric['name'] == 'sync_bytes' and metric['labels'].get('stage') == 'hashing':
+            figures['hashed_bytes'] = metric['value']
+
+    scan = figures['phases'].get('scan', 0)
+    figures['hash_throughput'] = figures['hashed_bytes'] / scan if scan > 0 else 0
+    return figures
+
+def run_stage(app: str, name: str, argv: list, command: str) -> dict:
+    metrics = '{0}/conf/{1}/{2}.metrics.json'.format(app, task, command)
+    if os.path.exists(metrics): os.remove(metrics)
+
+    code, seconds, peak = run_sync(app, argv)
+    stage = { 'name': name, 'exit': code, 'seconds': seconds, 'peak_rss': peak }
+    stage.update(read_metrics(app, command))
+
+    info('{0:<14}{1:>9.2f}s  scan {2:.2f}s  reconcile {3:.2f}s  peak {4}{5}'.format(
+         name, seconds, stage['phases'].get('scan', 0), stage['phases'].get('reconcile', 0),
+         format_file_size(peak) if peak is not None else '-',
+         '' if code == 0 else '  (exit {0})'.format(code)))
+    return stage
+
+def bench_files(args, files: int) -> dict:
+    work = args.work + '/{0}'.format(files)
+    if os.path.exists(work): shutil.rmtree(work)
+    tree, bucket = work + '/tree', work + '/bucket'
+    os.makedirs(tree)
+    os.makedirs(bucket)
+    app = make_app(work)
+
+    rng = random.Random(args.seed)
+    sizes = parse_sizes(args.sizes)
+
+    info('Generating {0} files ...'.format(files))
+    start = time.perf_counter()
+    total = generate_tree(tree, files, sizes, args.depth, args.fanout, rng)
+    result = { 'files': files, 'bytes': total, 'generate_seconds': time.perf_counter() - start,
+               'stages': [] }
+
+    code, _, _ = run_sync(app, ['add', task, 'filesystem', '-oss-provider', 'local',
+                                '-root', bucket, '-dest', tree])
+    if code != 0: error('cannot add the benchmark task in {0}.'.format(app))
+
+    if args.drop_caches: drop_caches()
+    result['stages'] += [run_stage(app, 'push', ['-y', 'push', task], 'push')]
+    result['stages'] += [run_stage(app, 'diff (warm)', ['-y', 'diff', task], 'diff')]
+
+    result['churn'] = churn_tree(tree, files, args.churn, sizes, args.depth, args.fanout, rng)
+    result['stages'] += [run_stage(app, 'diff', ['-y', 'diff', task], 'diff')]
+    result['stages'] += [run_stage(app, 'plan push', ['-y', 'plan', 'push', task], 'plan')]
+    result['stages'] += [run_stage(app, 'plan fetch', ['-y', 'plan', 'fetch', task], 'plan')]
+
+    if not args.keep: shutil.rmtree(work)
+    return result
+
+def git_commit() -> str:
+    try:
+        outs = subprocess.run(['git', '-C', root, 'rev-parse', 'HEAD'],
+                              capture_output = True, text = True)
+        return outs.stdout.strip()
+    except OSError: return ''
+
+def run(args):
+    if args.work is None: args.work = tempfile.mkdtemp(prefix = 'sync-bench-')
+    results = {
+        'created': time.time(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': { 'sizes': args.sizes, 'depth': args.depth, 'fanout': args.fanout,
+                      'churn': args.churn, 'seed': args.seed,
+                      'drop_caches': args.drop_caches },
+        'runs': []
+    }
+
+    for count in args.files.split(','):
+        files = parse_count(count)
+        info('Benchmarking {0} files in {1} ...'.format(files, args.work))
+        results['runs'] += [bench_files(args, files)]
+
+    if not args.keep and os.path.exists(args.work) and len(os.listdir(args.work)) == 0:
+        os.rmdir(args.work)
+
+    out = args.out or 'bench-{0}.json'.format(time.strftime('%Y%m%d-%H%M%S'))
+    with open(out, 'w', encoding = 'utf-8') as fp:
+        json.dump(results, fp, indent = 2)
+    info('The results are saved to {0}.'.format(out))
+
+# print the times of the same stages in two results, and their ratio.
+def compare(old_file: str, new_file: str):
+    def stages(path):
+        with open(path, 'r', encoding = 'utf-8') as fp: results = json.load(fp)
+        return dict([((run['files'], stage['name']), stage)
+                     for run in results['runs'] for stage in run['stages']])
+
+    old, new = stages(old_file), stages(new_file)
+    print('{0:>9}  {1:<14}{2:>10}{3:>10}{4:>8}{5:>12}{6:>12}'.format(
+          'files', 'stage', 'old', 'new', 'ratio', 'old peak', 'new peak'))
+    for key in [x for x in old.keys() if x in new.keys()]:
+        a, b = old[key], new[key]
+        print('{0:>9}  {1:<14}{2:>9.2f}s{3:>9.2f}s{4:>8.2f}{5:>12}{6:>12}'.format(
+              key[0], key[1], a['seconds'], b['seconds'], b['seconds'] / max(a['seconds'], 1e-9),
+              format_file_size(a['peak_rss']) if a['peak_rss'] is not None else '-',
+              format_file_size(b['peak_rss']) if b['peak_rss'] is not None else '-'))
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        if len(sys.argv) != 4: error('usage: python bench/bench.py compare old.json new.json')
+        compare(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description = 'benchmarks of the scan, the hashing '
+                                     'and the reconciliation on synthetic trees.')
+    parser.add_argument('--files', type = str, default = '10k,100k',
+        help = 'the file counts to benchmark, comma-separated, like 10k,100k,1m.')
+    parser.add_argument('--sizes', type = str, default = 'lognormal:2K,1.5',
+        help = 'the size distribution of the files: fixed:<size>, uniform:<min>-<max> '
+               'or lognormal:<median>,<sigma>.')
+    parser.add_argument('--depth', type = int, default = 3,
+        help = 'the depth of the directories.')
+    parser.add_argument('--fanout', type = int, default = 8,
+        help = 'the subdirectories of each directory.')
+    parser.add_argument('--churn', type = float, default = 0.01,
+        help = 'the fraction of the files modified, added or removed after the push.')
+    parser.add_argument('--seed', type = int, default = 0,
+        help = 'the seed of the tree generated.')
+    parser.add_argument('--drop-caches', action = 'store_true', dest = 'drop_caches',
+        help = 'drop the page cache before the first push (linux, as root).')
+    parser.add_argument('--work', type = str, default = None,
+        help = 'the directory of the trees, a temporary one by default.')
+    parser.add_argument('--keep', action = 'store_true',
+        help = 'keep the trees and the buckets after the runs.')
+    parser.add_argument('--out', type = str, default = None,
+        help = 'the result file, bench-<time>.json by default.')
+
+    run(parser.parse_args())
@@ -0,0 +1,258 @@
+# ./shared/agent.py
+#   the sync agent, a long-running process that serves push, fetch and diff
+#   to the command line over the unix socket <app>/conf/agent.sock, and runs
+#   the scheduled syncs of the tasks by itself. it keeps warm what every fresh
+#   process would load again: the plugins and the parsed configurations (see
+#   shared/configuration.py) and the remote catalogs read last (see
+#   tasks/filesystem.py).
+#
+#   while an agent is running, `sync push|fetch|diff` sends its arguments to
+#   the agent and prints the output sent back, rather than running by itself.
+#   the requests run one at a time, without a terminal, so the prompts take
+#   their defaults, or the answers given by --on-conflict and the like.
+#
+#   the 'schedule' setting of a task, like 'push 1h' or 'fetch 30m, push 6h',
+#   has the agent run the commands as often, writing their output to
+#   conf/<task>/<command>.agent.log.
+#
+#   the client sends the arguments as a line of json. the agent sends back
+#   the output of the run, and then a zero byte followed by the exit status.
+#
+#   the socket is only open to the user running the agent (mode 0600), and
+#   where the platform tells the peer of a connection (SO_PEERCRED), the
+#   connections of other users are refused as well.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+from shared.configuration import read_targets, get_conf_dir, parse_duration
+from shared.ansi import error, warning, info, route_output
+import shared.governor
+
+optional_args = [
+    'schedule',     # the commands the agent runs regularly, like 'push 1h'
+]
+
+# the commands served by the agent, the others always run by themselves.
+served = ['push', 'fetch', 'diff']
+
+# how often the schedules are checked, in seconds.
+schedule_tick = 5
+
+def socket_path(app: str) -> str:
+    return app + '/conf/agent.sock'
+
+# the user id of the process at the other end of the unix socket, or none if
+# the platform cannot tell.
+def peer_uid(conn):
+    if not hasattr(socket, 'SO_PEERCRED'): return None
+    try: creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    except OSError: return None
+    return struct.unpack('3i', creds)[1]
+
+def connect(app: str):
+    if not hasattr(socket, 'AF_UNIX'): return None
+    if not os.path.exists(socket_path(app)): return None
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try: conn.connect(socket_path(app))
+    except OSError:
+        conn.close()
+        return None
+    return conn
+
+def running(app: str) -> bool:
+    conn = connect(app)
+    if conn is None: return False
+    conn.close()
+    return True
+
+# the client side ------------------------------------------------------------
+
+# send the request to the agent, print the output as it comes, and returns the
+# exit status of the run.
+def request(app: str, message: dict) -> int:
+    conn = connect(app)
+    if conn is None: error('the agent at {0} is not running.'.format(socket_path(app)))
+
+    conn.sendall((json.dumps(message) + '\n').encode('utf-8'))
+    out = sys.stdout.buffer
+    status = b''
+    ended = False
+
+    while True:
+        chunk = conn.recv(65536)
+        if len(chunk) == 0: break
+        if ended:
+            status += chunk
+            continue
+
+        output, mark, rest = chunk.partition(b'\0')
+        out.write(output)
+        out.flush()
+        if mark:
+            ended = True
+            status = rest
+
+    conn.close()
+    if not ended:
+        warning('the agent stopped before the request finished.')
+        return 1
+    return int(status.decode() or '1')
+
+# the agent side -------------------------------------------------------------
+
+# the connection, as the output of the thread serving it.
+class socket_output():
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, text):
+        try: self.conn.sendall(text.encode('utf-8', 'replace'))
+        except OSError: pass # the client has gone, the run goes on.
+        return len(text)
+
+    def flush(self):
+        pass
+
+# parse the schedule setting into a list of (command, interval in seconds).
+def parse_schedule(name: str, schedule: str) -> list:
+    entries = []
+    if schedule == '<not-set>': return entries
+
+    for entry in schedule.split(','):
+        splits = entry.split()
+        if len(splits) != 2 or not splits[0] in served or parse_duration(splits[1]) <= 0:
+            warning('invalid schedule `{0}` of the task `{1}`, skipped. use like `push 1h`.'
+                    .format(entry.strip(), name))
+            continue
+        entries += [(splits[0], parse_duration(splits[1]))]
+
+    return entries
+
+class agent():
+
+    def __init__(self, app: str, run):
+        self.app = app
+        self.run = run
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.server = None
+
+    # run the command line in this process, with the output of this thread
+    # written to fp. returns the exit status.
+    def run_request(self, argv: list, fp) -> int:
+        with self.lock:
+            route_output(fp)
+            code = 0
+            try:
+                # the limits of the tasks are read again for each run.
+                shared.governor.governors.clear()
+                self.run(argv)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception as e:
+                print('[failed] {0}: {1}'.format(type(e).__name__, e))
+                code = 1
+            finally: route_output(None)
+            return code
+
+    def serve_client(self, conn):
+        with conn:
+            uid = peer_uid(conn)
+            if uid is not None and uid != os.getuid():
+                warning('A connection of the user {0} is refused.'.format(uid))
+                try: conn.sendall(b'The agent serves only the user running it.\n\0' + b'1')
+                except OSError: pass
+                return
+
+            try:
+                line = b''
+                while not line.endswith(b'\n'):
+                    chunk = conn.recv(65536)
+                    if len(chunk) == 0: return
+                    line += chunk
+                message = json.loads(line.decode('utf-8'))
+            except (OSError, ValueError): return
+
+            if message.get('stop', False):
+                conn.sendall(b'The agent is stopping.\n\0' + b'0')
+                self.stop()
+                return
+
+            code = self.run_request(message.get('argv', []), socket_output(conn))
+            try: conn.sendall(b'\0' + str(code).encode())
+            except OSError: pass
+
+    def run_schedules(self):
+        last = {}
+        parsed = {}
+        start = time.time()
+
+        while not self.stopping.wait(schedule_tick):
+            for name, conf in read_targets(self.app).items():
+                schedule = (name, conf.get('schedule', '<not-set>'))
+                if not schedule in parsed.keys(): parsed[schedule] = parse_schedule(*schedule)
+
+                for command, interval in parsed[schedule]:
+                    if time.time() - last.get((name, command), start) < interval: continue
+                    last[(name, command)] = time.time()
+
+                    log = get_conf_dir(self.app, name) + '/{0}.agent.log'.format(command)
+                    if not os.path.exists(os.path.dirname(log)):
+                        os.makedirs(os.path.dirname(log))
+                    with open(log, 'w', encoding = 'utf-8') as fp:
+                        code = self.run_request([command, name], fp)
+                    info('Scheduled {0} of {1} finished (exit {2}, see {3}).'
+                         .format(command, name, code, log))
+
+    def stop(self):
+        self.stopping.set()
+        if self.server is not None:
+            try: self.server.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+            self.server.close()
+
+    def serve(self):
+        path = socket_path(self.app)
+        if not hasattr(socket, 'AF_UNIX'):
+            error('the agent needs unix sockets, which this platform does not have.')
+        if running(self.app): error('an agent is already running at {0}.'.format(path))
+        if os.path.exists(path): os.remove(path) # left by an agent killed
+
+        # no one answers the prompts of the runs.
+        sys.stdin = open(os.devnull, 'r')
+
+        # the socket is created as 0600, and never open to others in between.
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try: self.server.bind(path)
+        except OSError as e: error('cannot listen at {0}: {1}'.format(path, e))
+        finally: os.umask(umask)
+        os.chmod(path, 0o600)
+        self.server.listen(16)
+
+        threading.Thread(target = self.run_schedules, daemon = True).start()
+        info('The agent is listening at {0}. Press <ctrl-c> to stop it.'.format(path))
+
+        try:
+            while not self.stopping.is_set():
+                try: conn, _ = self.server.accept()
+                except OSError: break
+                threading.Thread(target = self.serve_client, args = (conn,),
+                                 daemon = True).start()
+
+        except KeyboardInterrupt: pass
+        finally:
+            self.stop()
+            if os.path.exists(path): os.remove(path)
+            info('The agent has stopped.')
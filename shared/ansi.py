@@ -9,6 +9,9 @@
 
 import re
 import os
+import functools
+import sys
+import threading
 
 # foregrounds -----------------------------------------------------------------
 
@@ -83,29 +86,28 @@ def ansi_move_cursor(line: int, col: int) -> None:
 def fill_blank(blanks: int) -> None:
     print(' ' * blanks, end = '', flush = True)
 
+cn_re = re.compile('[\u201c-\u201d\u3001-\u3011\uff08-\uff1f\u4e00-\u9fa5]')
+
 # format strings to a common length. considering two-byte-long characters in
-# display. put the rules into cn_re.
+# display. put the rules into cn_re. the paths repeat a lot in the listings, 
+# so the results are cached.
+@functools.lru_cache(maxsize = 4096)
 def common_length(string: str, limit: int) -> str:
-    cn_re = '[\u201c-\u201d\u3001-\u3011\uff08-\uff1f\u4e00-\u9fa5]'
-
-    cn = re.findall(cn_re, string)
-    cn_length = len(cn)
-    
-    if limit <= 5:
-        x_str = string[-limit:]
-        cn = len(re.findall(cn_re, x_str))
-        while cn + len(x_str) > limit:
-            x_str = x_str[1:]
-            cn = len(re.findall(cn_re, x_str))
-        return x_str
-    
-    elif len(string) + cn_length > limit:
-        x_str = string[-(limit - 4):]
-        cn = len(re.findall(cn_re, x_str))
-        while cn + len(x_str) > limit - 4:
-            x_str = x_str[1:]
-            cn = len(re.findall(cn_re, x_str))
-        return '... ' + x_str
+    cn_length = len(cn_re.findall(string))
+
+    if limit <= 5 or len(string) + cn_length > limit:
+
+        # the longest tail of the string fitting in the room, in one pass.
+        room = limit if limit <= 5 else limit - 4
+        width = 0
+        start = len(string)
+        while start > 0:
+            char = 2 if cn_re.match(string[start - 1]) else 1
+            if width + char > room: break
+            width += char
+            start -= 1
+        
+        return string[start:] if limit <= 5 else '... ' + string[start:]
         
     else: return ('{:<' + str(limit - cn_length) + '}').format(string)
 
@@ -137,7 +139,7 @@ def error(text: str) -> None:
     ansi_reset()
     print(text)
 
-    exit()
+    sys.exit(1)
 
 def warning(text: str) -> None:
     fore_yellow()
@@ -149,10 +151,53 @@ def info(text: str) -> None:
     print(text)
     ansi_reset()
 
+# whether there is someone at a terminal to answer the prompts. the prompts
+# take their defaults otherwise, for example in the concurrent runs.
+def interactive() -> bool:
+    return sys.stdin is not None and sys.stdin.isatty()
+
+# ask a yes or no question. assume_yes (the -y option) answers yes, and no
+# one at the terminal answers no.
+def confirm(text: str, assume_yes = False) -> bool:
+    if assume_yes: return True
+    if not interactive(): return False
+    return input(text) == 'y'
+
 def clear():
     # for windows
     if os.name == 'nt':
         os.system('cls')
 
     # for mac and linux(here, os.name is 'posix')
-    else: os.system('clear')
\ No newline at end of file
+    else: os.system('clear')
+
+# output routing --------------------------------------------------------------
+
+# the standard output, with the output of some threads written elsewhere than 
+# the terminal (e.g. the pushes to mirrors running besides the main one).
+class routed_output():
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.routes = {}
+
+    def target(self):
+        return self.routes.get(threading.get_ident(), self.stream)
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+# write the output of the current thread into fp, or back to the terminal if
+# fp is none.
+def route_output(fp) -> None:
+    if not isinstance(sys.stdout, routed_output):
+        sys.stdout = routed_output(sys.stdout)
+    
+    if fp is None: sys.stdout.routes.pop(threading.get_ident(), None)
+    else: sys.stdout.routes[threading.get_ident()] = fp
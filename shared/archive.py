@@ -0,0 +1,91 @@
+# ./shared/archive.py
+#   packs the whole tree of a task into a few large archives, so that a fresh
+#   machine can be set up with some long sequential reads, instead of one
+#   request (and one subprocess) per file.
+#
+#   an archive set is uploaded under /.archives/<utc time>/, as the plain tar
+#   archives 0000.tar, 0001.tar, ... of roughly the target size each, and the
+#   manifest.tsv listing the catalog lines of the archived files, with the
+#   attribute 'archive=<index>' added. the members are named after the paths
+#   in the catalog, without the leading slash.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import os
+import tarfile
+import time
+
+archive_dir = '/.archives'
+
+def set_name(stamp: float) -> str:
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(stamp))
+
+def archive_object(name: str, index: int) -> str:
+    return '{0}/{1}/{2:04d}.tar'.format(archive_dir, name, index)
+
+def manifest_object(name: str) -> str:
+    return '{0}/{1}/manifest.tsv'.format(archive_dir, name)
+
+def member_name(path: str) -> str:
+    return path.lstrip('/')
+
+# write files into local temporary archives, and upload each of them once it
+# grows beyond the target size.
+
+class writer():
+
+    def __init__(self, temp: str, name: str, target_size: int, upload_abs):
+        self.temp = temp
+        self.name = name
+        self.target_size = target_size
+        self.upload_abs = upload_abs
+
+        self.index = 0
+        self.tar = None
+        self.fp = None
+
+    # add the file under the catalog path, returns the index of the archive
+    # holding it.
+    def add_file(self, path: str, file: str, mtime: float) -> int:
+        if self.tar is None:
+            self.fp = open(self.temp, 'wb')
+            self.tar = tarfile.open(fileobj = self.fp, mode = 'w|',
+                                    format = tarfile.PAX_FORMAT)
+
+        info = tarfile.TarInfo(member_name(path))
+        info.size = os.path.getsize(file)
+        info.mtime = mtime
+        info.mode = os.stat(file).st_mode & 0o777
+        with open(file, 'rb') as src:
+            self.tar.addfile(info, src)
+
+        index = self.index
+        if self.fp.tell() >= self.target_size:
+            self.seal()
+        return index
+
+    def seal(self):
+        if self.tar is None: return
+
+        self.tar.close()
+        self.fp.close()
+        self.upload_abs(self.temp, archive_object(self.name, self.index))
+        os.remove(self.temp)
+
+        self.index += 1
+        self.tar = None
+        self.fp = None
+
+    # upload the last partial archive, and returns the number of archives.
+    def close(self) -> int:
+        self.seal()
+        return self.index
+
+# read through a local archive in one pass, calling extract with the member
+# name and a readable file object of its content for each regular file.
+def read_members(file: str, extract):
+    with tarfile.open(file, mode = 'r|') as tar:
+        for info in tar:
+            if not info.isfile(): continue
+            extract(info.name, tar.extractfile(info))
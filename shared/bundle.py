@@ -0,0 +1,95 @@
+# ./shared/bundle.py
+#   packs many small files into larger bundle objects, so that pushing a tree
+#   of tiny files costs one request per bundle instead of one per file.
+#
+#   a bundle is the plain concatenation of its members. it is named after the
+#   md5 and the length of its content as '<md5>-<length>', uploaded once to
+#   /.bundles/<md5>-<length>.pack and never modified afterwards. the catalog
+#   records the location 'bundle=<md5>-<length>:<offset>:<length>' for each of
+#   the members, which fetch reads with ranged downloads.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import hashlib
+import os
+
+bundle_dir = '/.bundles'
+
+def bundle_object(name: str) -> str:
+    return '{0}/{1}.pack'.format(bundle_dir, name)
+
+def bundle_length(name: str) -> int:
+    return int(name.split('-')[-1])
+
+def format_location(name: str, offset: int, length: int) -> str:
+    return '{0}:{1}:{2}'.format(name, offset, length)
+
+# returns (bundle name, offset, length) of a 'bundle' catalog attribute.
+def parse_location(location: str):
+    name, offset, length = location.rsplit(':', 2)
+    return name, int(offset), int(length)
+
+# write members into a local temporary bundle, and upload it when it grows
+# beyond the target size. the locations of the members are only known after
+# the bundles holding them have been uploaded, that is, after close(). if
+# sealed is given, it is called with the dictionary of member locations each 
+# time a bundle has been uploaded.
+
+class packer():
+
+    def __init__(self, temp: str, target_size: int, upload_abs, sealed = None):
+        self.temp = temp
+        self.target_size = target_size
+        self.upload_abs = upload_abs
+        self.sealed = sealed
+
+        self.locations = {}
+        self.bundles = []
+        self.members = []
+        self.fp = None
+        self.md5 = None
+        self.offset = 0
+
+    def add(self, key: str, data: bytes):
+        if self.fp is None:
+            self.fp = open(self.temp, 'wb')
+            self.md5 = hashlib.md5()
+            self.offset = 0
+
+        self.fp.write(data)
+        self.md5.update(data)
+        self.members += [(key, self.offset, len(data))]
+        self.offset += len(data)
+
+        if self.offset >= self.target_size:
+            self.seal()
+
+    def add_file(self, key: str, path: str):
+        with open(path, 'rb') as fp:
+            self.add(key, fp.read())
+
+    def seal(self):
+        if self.fp is None: return
+
+        self.fp.close()
+        name = '{0}-{1}'.format(self.md5.hexdigest(), self.offset)
+        self.upload_abs(self.temp, bundle_object(name))
+        self.bundles += [name]
+
+        locations = {}
+        for key, offset, length in self.members:
+            locations[key] = format_location(name, offset, length)
+
+        self.locations.update(locations)
+        if self.sealed is not None: self.sealed(locations)
+
+        os.remove(self.temp)
+        self.fp = None
+        self.members = []
+
+    # upload the last partial bundle, and returns the dictionary of member
+    # keys to their 'bundle' attributes.
+    def close(self) -> dict:
+        self.seal()
+        return self.locations
@@ -0,0 +1,167 @@
+# ./shared/cache.py
+#   a local content-addressed blob cache. fetch looks up the cache before it
+#   downloads a file, and keeps what it has downloaded. so the same contents
+#   fetched by another task, or by a sibling machine when the cache directory
+#   is on a shared mount, do not go through the network again.
+#
+#   blobs are stored as <cache-dir>/<hash[:2]>/<hash>.<size>. the time each
+#   blob is last used is kept in <cache-dir>/lru.tsv, and the least recently
+#   used blobs are evicted once the total size exceeds 'cache-size'.
+#
+#   the cache is disabled unless 'cache-size' is given. 'cache-link' selects
+#   how blobs are placed into the destination:
+#
+#     reflink   (default) copy-on-write clone, falls back to a plain copy.
+#     hardlink  share the blob itself. costs no space at all, but a file that
+#               is later edited in place also modifies the cached blob, so use
+#               it only for trees whose files are replaced, not edited.
+#     copy      always copy the data.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import os
+import threading
+import time
+
+from shared.configuration import parse_file_size
+from shared.local import copy_local, hardlink_local
+from shared.ansi import error, info, format_file_size
+import shared.metrics
+
+optional_args = [
+    'cache-dir',    # the cache directory, defaults to <app>/cache
+    'cache-size',   # size limit of the cache (e.g. 20G), 0 to disable
+    'cache-link',   # one of hardlink, reflink or copy
+]
+
+def init(app, kwargs) -> dict:
+
+    cache_dir = kwargs.get('cache-dir', '<not-set>')
+    if cache_dir == '<not-set>': cache_dir = app + '/cache'
+    cache_dir = cache_dir.replace('\\', '/')
+
+    limit = parse_file_size(kwargs.get('cache-size', '<not-set>'), 0)
+    link = kwargs.get('cache-link', '<not-set>')
+    if link == '<not-set>': link = 'reflink'
+
+    if not link in ['hardlink', 'reflink', 'copy']:
+        error('invalid cache-link `{0}`, should be one of hardlink, reflink or copy.'
+              .format(link))
+
+    index_file = cache_dir + '/lru.tsv'
+    used = {}
+    stats = { 'hit': 0, 'miss': 0, 'hit-bytes': 0 }
+
+    def blob_name(hash: str, size: int) -> str:
+        return '{0}.{1}'.format(hash, size)
+
+    def blob_path(hash: str, size: int) -> str:
+        return '{0}/{1}/{2}'.format(cache_dir, hash[:2], blob_name(hash, size))
+
+    def place(blob: str, dest: str):
+        if link == 'hardlink' and hardlink_local(blob, dest): return
+        copy_local(blob, dest, reflink = link != 'copy')
+
+    # place the cached content of (hash, size) at dest. returns false if the
+    # blob is not in the cache, and the caller should download it instead.
+    def restore(hash: str, size: int, dest: str) -> bool:
+        if limit <= 0: return False
+
+        blob = blob_path(hash, size)
+        if not os.path.exists(blob) or os.path.getsize(blob) != size:
+            stats['miss'] += 1
+            shared.metrics.count('cache_misses')
+            return False
+
+        if os.path.exists(dest):
+            os.remove(dest)
+
+        place(blob, dest)
+        used[blob_name(hash, size)] = time.time()
+        stats['hit'] += 1
+        stats['hit-bytes'] += size
+        shared.metrics.count('cache_hits')
+        shared.metrics.count('cache_hit_bytes', size)
+        return True
+
+    # keep a copy of a downloaded file in the cache.
+    def store(file: str, hash: str, size: int):
+        if limit <= 0 or size > limit: return
+
+        blob = blob_path(hash, size)
+        used[blob_name(hash, size)] = time.time()
+        if os.path.exists(blob): return
+
+        # place into a temporary name first, so that concurrent fetches never
+        # see a partially written blob.
+        temp = '{0}.{1}.{2}.part'.format(blob, os.getpid(), threading.get_ident())
+        if os.path.exists(temp): os.remove(temp)
+        place(file, temp)
+        os.replace(temp, blob)
+
+    def read_index() -> dict:
+        stamps = {}
+        if not os.path.exists(index_file): return stamps
+
+        for line in open(index_file, 'r', encoding = 'utf-8'):
+            splits = line.replace('\n', '').split('\t')
+            if len(splits) != 2: continue
+            stamps[splits[0]] = float(splits[1])
+
+        return stamps
+
+    # merge the usage of this run into the index, and evict the least recently
+    # used blobs until the cache fits in its size limit.
+    def flush():
+        if limit <= 0 or not os.path.exists(cache_dir): return
+
+        stamps = read_index()
+        for key in used.keys():
+            stamps[key] = max(stamps.get(key, 0.0), used[key])
+
+        blobs = []
+        total = 0
+        for sub in os.listdir(cache_dir):
+            subdir = cache_dir + '/' + sub
+            if len(sub) != 2 or not os.path.isdir(subdir): continue
+
+            for name in os.listdir(subdir):
+                file_stat = os.stat(subdir + '/' + name)
+
+                # leftovers of an interrupted store.
+                if name.endswith('.part'):
+                    if file_stat.st_mtime < time.time() - 86400:
+                        os.remove(subdir + '/' + name)
+                    continue
+
+                blobs += [(stamps.get(name, file_stat.st_mtime), name,
+                           file_stat.st_size, subdir + '/' + name)]
+                total += file_stat.st_size
+
+        blobs.sort()
+        evicted = 0
+        while total > limit and len(blobs) > 0:
+            _, name, size, path = blobs.pop(0)
+            os.remove(path)
+            total -= size
+            evicted += 1
+
+        temp = '{0}.{1}.part'.format(index_file, os.getpid())
+        with open(temp, 'w', encoding = 'utf-8') as fp:
+            fp.writelines(['{0}\t{1:.3f}\n'.format(name, stamp)
+                           for stamp, name, _, _ in blobs])
+        os.replace(temp, index_file)
+
+        if stats['hit'] + stats['miss'] > 0:
+            info('Blob cache: {0} hits ({1}), {2} misses, {3} evicted, {4} in use.'.format(
+                stats['hit'], format_file_size(stats['hit-bytes']), stats['miss'],
+                evicted, format_file_size(total)))
+
+        used.clear()
+
+    return {
+        'restore': restore,
+        'store': store,
+        'flush': flush
+    }
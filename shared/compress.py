@@ -0,0 +1,169 @@
+# ./shared/compress.py
+#   parallel block compression of files before they are uploaded.
+#
+#   the data is split into blocks of 1 MiB that are compressed independently
+#   by a pool of threads (zlib, bz2 and lzma all release the interpreter lock
+#   while they work, so the blocks are really compressed on several cores).
+#   the compressed file is laid out as
+#
+#     'SYNCZ' <codec: 1 byte> <block size: u32>
+#     <raw length: u32> <packed length: u32> <packed data>    ... per block
+#
+#   files that are already compressed (judged by the extension or the magic
+#   bytes at the head of the file) are not worth compressing again.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import bz2
+import lzma
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.ansi import error
+
+magic = b'SYNCZ'
+block_size = 1024 * 1024
+
+# codec name: (header id, default level, compress, decompress)
+codecs = {
+    'zlib': (1, 6, lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'bz2':  (2, 9, lambda data, level: bz2.compress(data, level), bz2.decompress),
+    'lzma': (3, 6, lambda data, level: lzma.compress(data, preset = level), lzma.decompress),
+}
+
+compressed_extensions = [
+    '.gz', '.tgz', '.bz2', '.tbz', '.xz', '.txz', '.zst', '.lz4', '.lzma', '.z',
+    '.zip', '.7z', '.rar', '.jar', '.war', '.apk', '.whl', '.cab', '.deb', '.rpm',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.heic', '.avif', '.jxl',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac',
+    '.mp4', '.m4v', '.mkv', '.webm', '.mov', '.avi', '.wmv'
+]
+
+compressed_magics = [
+    b'\x1f\x8b',                  # gzip
+    b'BZh',                       # bzip2
+    b'\xfd7zXZ\x00',              # xz
+    b'\x28\xb5\x2f\xfd',          # zstd
+    b'\x04\x22\x4d\x18',          # lz4
+    b'PK\x03\x04',                # zip and its derivatives
+    b'7z\xbc\xaf\x27\x1c',        # 7z
+    b'Rar!\x1a\x07',              # rar
+    b'\x89PNG',                   # png
+    b'\xff\xd8\xff',              # jpeg
+    b'GIF8',                      # gif
+    b'OggS',                      # ogg
+    b'fLaC',                      # flac
+    b'ID3',                       # mp3
+    magic                         # compressed by ourselves
+]
+
+# parse the 'compress' setting, like 'zlib' or 'lzma:9'. returns (codec, level)
+# or (None, 0) if compression is off.
+def parse_setting(setting: str):
+    if setting is None or setting == '<not-set>' or setting == 'none':
+        return None, 0
+
+    codec, _, level = setting.partition(':')
+    if not codec in codecs.keys():
+        error('unknown compression codec `{0}`, should be one of {1}.'
+              .format(codec, ', '.join(codecs.keys())))
+
+    if level == '': return codec, codecs[codec][1]
+    return codec, int(level)
+
+# whether a file looks worth compressing.
+def should_compress(path: str) -> bool:
+    if os.path.splitext(path)[1].lower() in compressed_extensions:
+        return False
+
+    with open(path, 'rb') as fp:
+        head = fp.read(16)
+
+    for mark in compressed_magics:
+        if head.startswith(mark): return False
+
+    # the mp4 family has 'ftyp' after the box length, and webp 'WEBP' after
+    # the riff length.
+    if head[4:8] == b'ftyp' or (head[:4] == b'RIFF' and head[8:12] == b'WEBP'):
+        return False
+
+    return True
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+# read the next (up to) n blocks of the source.
+def read_blocks(fp, n: int, size: int) -> list:
+    blocks = []
+    for _ in range(n):
+        data = fp.read(size)
+        if len(data) == 0: break
+        blocks += [data]
+    return blocks
+
+# compress src into dest, returns the length of dest.
+def compress_file(src: str, dest: str, codec: str = 'zlib', level: int = -1,
+                  workers: int = 0) -> int:
+
+    header_id, default_level, compress, _ = codecs[codec]
+    if level < 0: level = default_level
+    if workers <= 0: workers = default_workers()
+
+    with open(src, 'rb') as fin, open(dest, 'wb') as fout, \
+         ThreadPoolExecutor(max_workers = workers) as pool:
+
+        fout.write(magic + struct.pack('<BI', header_id, block_size))
+
+        # at most two rounds of blocks are kept in memory for each worker.
+        while True:
+            blocks = read_blocks(fin, workers * 2, block_size)
+            if len(blocks) == 0: break
+
+            packed = pool.map(lambda data: compress(data, level), blocks)
+            for raw, data in zip(blocks, packed):
+                fout.write(struct.pack('<II', len(raw), len(data)))
+                fout.write(data)
+
+    return os.path.getsize(dest)
+
+# decompress src into dest, returns the length of dest. sink, if given, is
+# called with each decompressed block in order.
+def decompress_file(src: str, dest: str, workers: int = 0, sink = None) -> int:
+
+    if workers <= 0: workers = default_workers()
+    length = 0
+
+    with open(src, 'rb') as fin, open(dest, 'wb') as fout, \
+         ThreadPoolExecutor(max_workers = workers) as pool:
+
+        header = fin.read(len(magic) + 5)
+        if header[:len(magic)] != magic:
+            error('{0} is not a compressed file.'.format(src))
+
+        header_id, _ = struct.unpack('<BI', header[len(magic):])
+        decompress = [x[3] for x in codecs.values() if x[0] == header_id][0]
+
+        while True:
+            frames = []
+            for _ in range(workers * 2):
+                frame = fin.read(8)
+                if len(frame) < 8: break
+                raw_length, packed_length = struct.unpack('<II', frame)
+                frames += [(raw_length, fin.read(packed_length))]
+
+            if len(frames) == 0: break
+
+            blocks = pool.map(lambda frame: decompress(frame[1]), frames)
+            for (raw_length, _), data in zip(frames, blocks):
+                if len(data) != raw_length:
+                    error('{0} is corrupted.'.format(src))
+                
+                fout.write(data)
+                if sink is not None: sink(data)
+                length += len(data)
+
+    return length
@@ -5,12 +5,20 @@
 # license: gplv3. <https://www.gnu.org/licenses>
 # contact: yang-z <xornent at outlook dot com>
 
+import os
+import sys
+import copy
+import calendar
+import time
 import importlib
 import importlib.machinery
 import importlib.util
 import types
 from shared.ansi import error, warning, info
 
+# the modules found, and the configuration files parsed in this process.
+registry = { 'specs': {}, 'confs': {} }
+
 def import_spec(spec: importlib.machinery.ModuleSpec) -> types.ModuleType:
     mod = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(mod)
@@ -24,128 +32,260 @@ def remove_empty(ls_str: list) -> list:
 def remove_duplicate(ls_str: list) -> list:
     return list(set(ls_str))
 
-# return the list of providers (strings) for the specified interface.
-# meanwhile, this method checks the interface is available.
-def get_providers(appdir: str, interface:str) -> list:
+# the directory keeping the local records of a task, <app>/conf/<task name>,
+# with the characters not allowed in file names replaced.
+def get_conf_dir(appdir: str, name: str) -> str:
+    task_name = name.replace('/', "_").replace('\\', "_") \
+                    .replace(':', "_").replace('*', "_") \
+                    .replace('?', "_").replace('|', "_") \
+                    .replace('<', "_").replace('>', "_") \
+                    .replace('"', "_")
+    return appdir + '/conf/{0}'.format(task_name)
 
-    provs = []
+# parse a human-readable size like '512', '64K', '1.5M' or '4G' (binary units)
+# into bytes. an unset value or empty string gives the default.
+def parse_file_size(size: str, default: int = 0) -> int:
+    if size is None or size == '' or size == '<not-set>':
+        return default
 
-    for line in open(appdir + '/conf/providers', 'r'):
-        line = line.replace('\r', '').replace('\n', '')
-        if line == '': continue
-        if line.startswith('#'): continue
+    size = size.strip().upper().replace('IB', '').replace('B', '')
+    units = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4 }
 
-        if not ('\t' in line):
-            error('invalid /conf/providers format: `{0}`. each line of valid ' +
-                  'providers should be tab-limited. (interface \\t impl'.format(line))
-            exit(1)
-        
-        splits = remove_empty(line.split('\t'))
-        if len(splits) != 2:
-            error('invalid /conf/providers format: `{0}` should be two elements, ' +
-                  'interface and implementation names.'.format(line))
-            exit(1)
-        
-        spec = importlib.util.find_spec('shared.{0}'.format(splits[0]))
-        if spec is None:
-            error('cannot find interface module {0}'.format(
-                'shared.{0}'.format(splits[0])
-            ))
-            exit(1)
-        
-        if splits[0] == interface:
-            provs += [splits[1]]
+    try:
+        if size[-1] in units.keys():
+            return int(float(size[:-1]) * units[size[-1]])
+        return int(float(size))
     
-    return provs
+    except ValueError:
+        error('invalid size `{0}`. use a number with optional K, M, G or T suffix.'
+              .format(size))
 
-def load_provider(appdir: str, interface: str, impl: str) -> types.ModuleType:
-    spec = importlib.util.find_spec('shared.{0}_{1}'.format(interface, impl))
-    if spec is None:
-        error('cannot find implementation module {0}'.format(
-            'shared.{0}_{1}'.format(interface, impl)
-        ))
-        exit(1)
+# read the configured tasks from <app>/conf/targets, as a dictionary of task
+# name to its settings. the interfaces are keyed as '<interface>-provider'.
+#
+#   name    task
+#       key     value
+#       interface   intf    provider
+def read_targets(appdir: str) -> dict:
     
-    else: return import_spec(spec)
+    confs = {}
+    if not os.path.exists(appdir + '/conf/targets'): return confs
 
-# return the list of interfaces (strings) for the specified task.
-# meanwhile, this method checks the task is available.
-def get_interfaces(appdir: str, task:str) -> list:
+    # parsed once for each modification, the callers get a copy to change.
+    path = appdir + '/conf/targets'
+    mtime = os.stat(path).st_mtime
+    if path in registry['confs'].keys() and registry['confs'][path][0] == mtime:
+        return copy.deepcopy(registry['confs'][path][1])
 
-    provs = []
-
-    for line in open(appdir + '/conf/tasks', 'r'):
+    current_name = ''
+    for line in open(appdir + '/conf/targets', 'r'):
         line = line.replace('\r', '').replace('\n', '')
         if line == '': continue
         if line.startswith('#'): continue
 
-        if not ('\t' in line):
-            error(('invalid /conf/tasks format: `{0}`. each line of valid ' +
-                  'providers should be tab-limited.').format(line))
-            exit(1)
-        
-        splits = remove_empty(line.split('\t'))
-        if len(splits) < 2:
-            error('invalid /conf/tasks format: `{0}` should have at least 2 elements.'.format(line))
-            exit(1)
-        
-        spec = importlib.util.find_spec('tasks.{0}'.format(splits[0]))
-        if spec is None:
-            error('cannot find task module {0}'.format(
-                'tasks.{0}'.format(splits[0])
-            ))
-            exit(1)
-        
-        if splits[0] == task:
-            provs += splits[1:]
+        if line.startswith('\t'):
+            splits = remove_empty(line.split('\t'))
+            key = splits[0]; val = splits[1]
+            if key == 'interface':
+                confs[current_name][val + '-provider'] = splits[2]
+            else: confs[current_name][key] = val
+            
+        else:
+            splits = remove_empty(line.split('\t'))
+            name = splits[0]
+            task = splits[1]
+            current_name = name
+            confs[name] = {
+                'app': appdir,
+                '_task': task
+            }
+
+    registry['confs'][path] = (mtime, confs)
+    return copy.deepcopy(confs)
+
+# parse a duration like '90', '30m', '12h', '7d' or '2w' into seconds. an unset
+# value or empty string gives the default.
+def parse_duration(duration: str, default: float = 0) -> float:
+    if duration is None or duration == '' or duration == '<not-set>':
+        return default
+
+    duration = duration.strip().lower()
+    units = { 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800 }
+
+    try:
+        if duration[-1] in units.keys():
+            return float(duration[:-1]) * units[duration[-1]]
+        return float(duration)
     
-    return provs
+    except ValueError:
+        error('invalid duration `{0}`. use a number with optional s, m, h, d or w suffix.'
+              .format(duration))
 
-def load_interface(appdir: str, interface: str) -> types.ModuleType:
-    spec = importlib.util.find_spec('shared.{0}'.format(interface))
+# parse a point of time like '2024-05-08', '2024-05-08 15:30[:00]' (or with a
+# 'T' in between) in the local time, '20240508T073000Z' in utc, or seconds 
+# since the epoch, into seconds since the epoch.
+def parse_time(moment: str) -> float:
+    moment = moment.strip()
+
+    try: return float(moment)
+    except ValueError: pass
+
+    if moment.endswith('Z'):
+        try: return float(calendar.timegm(time.strptime(moment, '%Y%m%dT%H%M%SZ')))
+        except ValueError: pass
+
+    for form in ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', 
+                 '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S']:
+        try: return time.mktime(time.strptime(moment, form))
+        except ValueError: pass
+
+    error('invalid time `{0}`. use like `2024-05-08 15:30` or `20240508T073000Z`.'
+          .format(moment))
+
+# the plugins (tasks, interfaces and providers) and the two files registering
+# them are loaded once for each process. the modules are kept in sys.modules
+# under their names, and the parsed lines of conf/tasks and conf/providers
+# are kept along with the modification time of the files they were read from.
+
+def find_module(name: str, kind: str) -> importlib.machinery.ModuleSpec:
+    if not name in registry['specs'].keys():
+        registry['specs'][name] = importlib.util.find_spec(name)
+    
+    spec = registry['specs'][name]
     if spec is None:
-        error('cannot find interface module {0}'.format(
-            'shared.{0}'.format(interface)
-        ))
-        exit(1)
+        error('cannot find {0} module {1}'.format(kind, name))
+    return spec
+
+def load_module(name: str, kind: str) -> types.ModuleType:
+    if name in sys.modules.keys(): return sys.modules[name]
     
-    else: return import_spec(spec)
+    mod = import_spec(find_module(name, kind))
+    sys.modules[name] = mod
+    return mod
 
-def get_tasks(appdir: str) -> list:
+# returns the tab-delimited lines of conf/tasks or conf/providers, each checked
+# to name an existing module, as lists of the columns.
+def read_conf(appdir: str, conf: str) -> list:
+    path = appdir + '/conf/' + conf
+    mtime = os.stat(path).st_mtime
+    if path in registry['confs'].keys() and registry['confs'][path][0] == mtime:
+        return registry['confs'][path][1]
     
-    tasks = []
-    for line in open(appdir + '/conf/tasks', 'r'):
+    lines = []
+    for line in open(path, 'r'):
         line = line.replace('\r', '').replace('\n', '')
         if line == '': continue
         if line.startswith('#'): continue
 
         if not ('\t' in line):
-            error(('invalid /conf/tasks format: `{0}`. each line of valid ' +
-                  'providers should be tab-limited.').format(line))
-            exit(1)
+            error(('invalid /conf/{0} format: `{1}`. each line of valid ' +
+                  'providers should be tab-limited.').format(conf, line))
         
         splits = remove_empty(line.split('\t'))
-        if len(splits) < 2:
-            error('invalid /conf/tasks format: `{0}` should have at least 2 elements.'.format(line))
-            exit(1)
+        if conf == 'providers' and len(splits) != 2:
+            error(('invalid /conf/providers format: `{0}` should be two elements, ' +
+                  'interface and implementation names.').format(line))
         
-        spec = importlib.util.find_spec('tasks.{0}'.format(splits[0]))
-        if spec is None:
-            error('cannot find task module {0}'.format(
-                'tasks.{0}'.format(splits[0])
-            ))
-            exit(1)
+        if conf == 'tasks' and len(splits) < 2:
+            error('invalid /conf/tasks format: `{0}` should have at least 2 elements.'.format(line))
         
-        tasks += [splits[0]]
+        if conf == 'tasks': find_module('tasks.{0}'.format(splits[0]), 'task')
+        else: find_module('shared.{0}'.format(splits[0]), 'interface')
+        lines += [splits]
     
-    return tasks
+    registry['confs'][path] = (mtime, lines)
+    return lines
+
+# return the list of providers (strings) for the specified interface.
+# meanwhile, this method checks the interface is available.
+def get_providers(appdir: str, interface:str) -> list:
+    return [x[1] for x in read_conf(appdir, 'providers') if x[0] == interface]
+
+def load_provider(appdir: str, interface: str, impl: str) -> types.ModuleType:
+    return load_module('shared.{0}_{1}'.format(interface, impl), 'implementation')
+
+# return the list of interfaces (strings) for the specified task.
+# meanwhile, this method checks the task is available.
+def get_interfaces(appdir: str, task:str) -> list:
+    provs = []
+    for splits in read_conf(appdir, 'tasks'):
+        if splits[0] == task: provs += splits[1:]
+    return provs
+
+def load_interface(appdir: str, interface: str) -> types.ModuleType:
+    return load_module('shared.{0}'.format(interface), 'interface')
+
+def get_tasks(appdir: str) -> list:
+    return [x[0] for x in read_conf(appdir, 'tasks')]
 
 def load_task(appdir: str, task: str) -> types.ModuleType:
-    spec = importlib.util.find_spec('tasks.{0}'.format(task))
-    if spec is None:
-        error('cannot find interface module {0}'.format(
-            'tasks.{0}'.format(task)
-        ))
-        exit(1)
+    return load_module('tasks.{0}'.format(task), 'task')
+
+# the settings the plugins add to `add` and `config`, as a list of (name, help)
+# in the order they are registered. collecting them takes loading every plugin,
+# so they are cached in conf/plugins.cache, along with the modification times
+# of the registering files and the plugin sources, and collected again only if
+# any of them has changed since.
+#
+#   stamp   <path>  <mtime>
+#   arg     <name>  <help>
+
+def plugin_stamps(appdir: str) -> list:
+    paths = [appdir + '/conf/tasks', appdir + '/conf/providers']
+    for folder in ['/tasks', '/shared']:
+        paths += sorted([appdir + folder + '/' + x for x in os.listdir(appdir + folder)
+                         if x.endswith('.py')])
+    return [(x, repr(os.stat(x).st_mtime)) for x in paths]
+
+def collect_arguments(appdir: str) -> list:
+    arguments = []
+    registered = []
+    for task in get_tasks(appdir):
+        task_m = load_task(appdir, task)
+
+        # optional arguments of the task. these are left out of the target
+        # configuration unless specified explicitly.
+        for oarg in task_m.optional_args:
+            if oarg in registered: continue
+            arguments += [(oarg, '[optional/{0}]'.format(task))]
+            registered += [oarg]
+
+        for intf in task_m.get_required_interfaces(appdir):
+            if intf in registered: continue
+            arguments += [(intf, 'provider for the interface ' + 
+                           intf.replace('-provider', '') + ' [{0}]'.format(task))]
+            registered += [intf]
+
+        for intf in get_interfaces(appdir, task):
+            intf_m = load_interface(appdir, intf)
+            
+            for prov in get_providers(appdir, intf):
+                for parg in sorted(intf_m.get_required_args(appdir, prov)):
+                    if parg in registered: continue
+                    arguments += [(parg, '[{0}/{1}]'.format(intf, prov))]
+                    registered += [parg]
+    
+    return arguments
+
+def get_arguments(appdir: str) -> list:
+    cache = appdir + '/conf/plugins.cache'
+    stamps = plugin_stamps(appdir)
+    
+    try:
+        with open(cache, 'r', encoding = 'utf-8') as fp:
+            lines = [x.split('\t') for x in fp.read().splitlines()]
+        if [tuple(x[1:]) for x in lines if x[0] == 'stamp'] == stamps:
+            return [tuple(x[1:]) for x in lines if x[0] == 'arg']
+    except (OSError, IndexError): pass
+
+    arguments = collect_arguments(appdir)
+
+    # the cache is only a shortcut. a read-only installation goes without it.
+    try:
+        with open(cache + '.part', 'w', encoding = 'utf-8') as fp:
+            for path, mtime in stamps: fp.write('stamp\t{0}\t{1}\n'.format(path, mtime))
+            for name, hint in arguments: fp.write('arg\t{0}\t{1}\n'.format(name, hint))
+        os.replace(cache + '.part', cache)
+    except OSError: pass
     
-    else: return import_spec(spec)
\ No newline at end of file
+    return arguments
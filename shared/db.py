@@ -11,6 +11,7 @@ import copy
 
 from shared.configuration import get_providers, load_provider, remove_duplicate
 from shared.ansi import error
+from shared.trace import traced
 
 required_args = [
     'dbname',     # the database to import/export.
@@ -72,4 +73,7 @@ def init(app, provider, kwargs):
     func_dict['dump'] = dump_database
     func_dict['import'] = import_database
 
+    for key in func_dict.keys():
+        func_dict[key] = traced('db.' + key)(func_dict[key])
+
     return func_dict
\ No newline at end of file
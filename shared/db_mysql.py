@@ -8,6 +8,9 @@
 import os
 import subprocess
 
+import shared.governor
+import shared.metrics
+
 required_args = [
     'mysql',      # the mysql commandline executable
     'mysqladmin', # the mysqladmin commandline executable
@@ -16,15 +19,19 @@ required_args = [
     'mysql-user'  # the database user
 ]
 
-# dump the local database
+# dump the local database. the output is copied through a pipe, so that the
+# dump is held back by the disk read limit of the task.
 def dump_database(dump: str, kwargs: dict):
     
     if os.path.exists(dump):
         os.remove(dump)
 
+    governor = shared.governor.get(kwargs['app'], kwargs)
+
     with open(dump, 'wb') as file:
         # mysqldump -u_ -p_ --databases _ > _.sql
-        outs = subprocess.run([kwargs['mysqldump'], 
+        shared.metrics.count('subprocesses', program = 'mysqldump')
+        proc = subprocess.Popen([kwargs['mysqldump'], 
                                '-u{0}'.format(kwargs['mysql-user']),
                                '-p{0}'.format(kwargs['mysql-pwd']),
                                '--databases', kwargs['dbname'],
@@ -39,12 +46,21 @@ def dump_database(dump: str, kwargs: dict):
                                # identical ... you will have different md5 and
                                # upload the same database over and over again ...
                                
-                               ], stdout = file)
+                               ], stdout = subprocess.PIPE)
+        
+        while True:
+            chunk = proc.stdout.read(1024 * 1024)
+            if len(chunk) == 0: break
+            governor.disk(len(chunk))
+            file.write(chunk)
+        
+        proc.wait()
 
 # drop and update database.
 def import_database(dump: str, kwargs: dict):
 
     # mysqladmin -u_ -p_ --databases _ > _.sql
+    shared.metrics.count('subprocesses', 2, program = 'mysqladmin')
     subprocess.run([kwargs['mysqladmin'], 
                     '-u{0}'.format(kwargs['mysql-user']),
                     '-p{0}'.format(kwargs['mysql-pwd']),
@@ -55,6 +71,7 @@ def import_database(dump: str, kwargs: dict):
                     '-p{0}'.format(kwargs['mysql-pwd']),
                     'create', kwargs['dbname']])
     
+    shared.metrics.count('subprocesses', program = 'mysql')
     with open(dump, 'rb') as fp: 
         outs = subprocess.run([kwargs['mysql'], 
                                '-u{0}'.format(kwargs['mysql-user']),
@@ -0,0 +1,64 @@
+# ./shared/digest.py
+#   the content checksum used by the filesystem task, computed incrementally
+#   so that it can be taken while the data streams by.
+#
+#   files smaller than 10 MiB are identified by the md5 of their content. for
+#   larger ones, the md5 of each 1 MiB block (the last one partial, or even
+#   empty) is taken, and the checksum is the md5 of these hex digests joined.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import hashlib
+
+block_size = 1024 * 1024
+whole_limit = 10 * 1024 * 1024
+
+class hasher():
+
+    # the length of the content must be known beforehand, since it decides
+    # how the checksum is taken.
+    def __init__(self, length: int):
+        self.whole = length < whole_limit
+        self.md5 = hashlib.md5()
+        self.filled = 0
+        self.digests = ''
+
+    def update(self, data: bytes):
+        if self.whole:
+            self.md5.update(data)
+            return
+
+        view = memoryview(data)
+        while len(view) > 0:
+            take = min(block_size - self.filled, len(view))
+            self.md5.update(view[:take])
+            self.filled += take
+            view = view[take:]
+
+            if self.filled == block_size:
+                self.digests += self.md5.hexdigest()
+                self.md5 = hashlib.md5()
+                self.filled = 0
+
+    def hexdigest(self) -> str:
+        if self.whole: return self.md5.hexdigest()
+        return hashlib.md5((self.digests + self.md5.hexdigest()).encode('utf-8')).hexdigest()
+
+# the checksum of a file of the given length. reads are charged to governor,
+# if it is given.
+def hash_file(path: str, length: int, governor = None) -> str:
+    digest = hasher(length)
+    with open(path, 'rb') as fp:
+        while True:
+            content = fp.read(block_size)
+            if len(content) == 0: break
+            if governor is not None: governor.disk(len(content))
+            digest.update(content)
+
+    return digest.hexdigest()
+
+# the plain md5 of a file whatever its length, which is what the remote
+# reports as the etag of an object uploaded in one piece.
+def md5_file(path: str, governor = None) -> str:
+    return hash_file(path, 0, governor)
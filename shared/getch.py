@@ -25,7 +25,9 @@ class getch():
             ch = sys.stdin.read(1)
         finally:
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
+        
+        # as bytes, the same as msvcrt.getch gives.
+        return ch.encode()
 
     def getch_windows(self):
         import msvcrt
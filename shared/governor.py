@@ -0,0 +1,209 @@
+# ./shared/governor.py
+#   per-task limits of network bandwidth, disk read rate and cpu workers, so
+#   that a sync running on a busy host does not starve the services on it.
+#
+#   the network and disk rates are token buckets (bytes per second, with one
+#   second of burst). the transfer and reading paths call net() and disk()
+#   with the number of bytes they have moved, chunk by chunk as they stream,
+#   and sleep, outside the lock, as long as the bucket is in debt. the transfers run
+#   by other programs (like ossutil) cannot be metered so, and get their share
+#   of the network rate from net_begin() to pass as their own speed limit.
+#   'limit-cpu' caps the number of worker threads.
+#
+#   the limits are taken from the task settings, and can be changed while the
+#   task runs by writing 'limit-net', 'limit-disk' or 'limit-cpu' lines (like
+#   'limit-net 5M', 0 for no limit) into <app>/conf/<task>/governor. the file
+#   is checked every second, or at once on SIGHUP. a mistyped line there is
+#   reported, and the limit it sets is kept as it was.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import os
+import re
+import signal
+import threading
+import time
+
+from shared.configuration import parse_file_size, get_conf_dir
+from shared.ansi import error, warning, info, format_file_size
+
+optional_args = [
+    'limit-net',    # network bytes per second, e.g. 10M
+    'limit-disk',   # disk read bytes per second
+    'limit-cpu',    # the maximum number of worker threads
+]
+
+class bucket():
+
+    def __init__(self, rate: int, poll = None):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.poll = poll
+
+        self.total = 0
+        self.waited = 0.0
+
+    # count the bytes moved without metering them, by a transfer limited by
+    # itself to its share of the rate.
+    def record(self, n: int):
+        with self.lock:
+            self.total += n
+
+    def set_rate(self, rate: int):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate) if rate > 0 else 0
+
+    # take n bytes out of the bucket, and sleep off the debt if any. the debt
+    # of each waiter includes those of the waiters before it, so they are
+    # served in turn without holding the lock while sleeping. they sleep a
+    # second at most at a time, and read the limits again in between, so that
+    # a change of the rate takes effect on the waits already begun.
+    def consume(self, n: int):
+        with self.lock:
+            self.total += n
+            if self.rate <= 0: return
+
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            debt = -self.tokens
+
+        if debt <= 0: return
+        begin = time.monotonic()
+        while debt > 0:
+            with self.lock: rate = self.rate
+            if rate <= 0: break
+
+            last = time.monotonic()
+            time.sleep(min(debt / rate, 1.0))
+            if self.poll is not None: self.poll()
+            with self.lock: debt -= (time.monotonic() - last) * self.rate
+
+        with self.lock: self.waited += time.monotonic() - begin
+
+class governor():
+
+    def __init__(self, app: str, kwargs: dict):
+        self.control = get_conf_dir(app, kwargs['_name']) + '/governor'
+        self.control_mtime = None
+        self.checked = 0.0
+        self.reload = False
+        self.start = time.time()
+
+        self.network = bucket(parse_file_size(kwargs.get('limit-net', '<not-set>'), 0), self.poll)
+        self.storage = bucket(parse_file_size(kwargs.get('limit-disk', '<not-set>'), 0), self.poll)
+
+        cpu = kwargs.get('limit-cpu', '<not-set>')
+        if cpu != '<not-set>' and parse_limit('limit-cpu', cpu) is None:
+            error('invalid limit-cpu `{0}`, should be a number of threads.'.format(cpu))
+        self.cpu = 0 if cpu == '<not-set>' else int(cpu)
+
+        # the transfers running with their share of the network rate.
+        self.lock = threading.Lock()
+        self.transfers = 0
+
+    # read the control file if it has changed since the last check.
+    def poll(self):
+        now = time.monotonic()
+        if not self.reload and now - self.checked < 1.0: return
+        self.checked = now
+        self.reload = False
+
+        if not os.path.exists(self.control): return
+        mtime = os.stat(self.control).st_mtime
+        if mtime == self.control_mtime: return
+        self.control_mtime = mtime
+
+        for line in open(self.control, 'r'):
+            splits = line.split()
+            if len(splits) != 2 or splits[0].startswith('#'): continue
+            if not splits[0] in optional_args: continue
+
+            limit = parse_limit(splits[0], splits[1])
+            if limit is None:
+                warning('invalid `{0}` in {1}, the limit is kept as it was.'
+                        .format(line.strip(), self.control))
+            elif splits[0] == 'limit-net': self.network.set_rate(limit)
+            elif splits[0] == 'limit-disk': self.storage.set_rate(limit)
+            else: self.cpu = limit
+
+    def net(self, n: int):
+        self.poll()
+        self.network.consume(n)
+
+    def disk(self, n: int):
+        self.poll()
+        self.storage.consume(n)
+
+    def net_limited(self) -> bool:
+        self.poll()
+        return self.network.rate > 0
+
+    # begin a transfer limiting its speed by itself. returns its share of the
+    # network rate in bytes per second, or 0 if there is no limit. the rate is
+    # split by the transfers running now, this one included, so that a single
+    # transfer gets all of it, and the parallel ones do not exceed it together.
+    def net_begin(self) -> int:
+        self.poll()
+        with self.lock:
+            self.transfers += 1
+            transfers = self.transfers
+
+        if self.network.rate <= 0: return 0
+        return max(1, self.network.rate // transfers)
+
+    # end the transfer begun by net_begin, having moved n bytes.
+    def net_end(self, n: int):
+        with self.lock: self.transfers -= 1
+        self.network.record(n)
+
+    # the number of worker threads to use, out of the wanted number.
+    def workers(self, wanted: int = 0) -> int:
+        self.poll()
+        if wanted <= 0: wanted = os.cpu_count() or 1
+        if self.cpu > 0: return max(1, min(wanted, self.cpu))
+        return max(1, wanted)
+
+    def report(self):
+        elapsed = max(time.time() - self.start, 0.001)
+
+        for title, lim in [('Network', self.network), ('Disk read', self.storage)]:
+            if lim.total == 0: continue
+            info('{0}: {1} in {2:.1f}s, {3}/s effective{4}.'.format(
+                title, format_file_size(lim.total), elapsed,
+                format_file_size(lim.total / elapsed),
+                '' if lim.rate <= 0 else ' (limit {0}/s, throttled {1:.1f}s)'.format(
+                    format_file_size(lim.rate), lim.waited)))
+
+# parse the value of a limit, a size for the rates and a number of threads for
+# limit-cpu. returns none if it is invalid.
+def parse_limit(key: str, value: str):
+    if key == 'limit-cpu':
+        return int(value) if re.fullmatch(r'[0-9]+', value) else None
+    if re.fullmatch(r'([0-9]+(\.[0-9]*)?|\.[0-9]+)([KMGT](I?B)?|B)?', value.strip(), re.I) is None:
+        return None
+    return parse_file_size(value, 0)
+
+# the governors of the tasks in this process, keyed by task name. the task
+# and the interfaces it uses share the same governor.
+
+governors = {}
+
+def reload_all(signum, frame):
+    for gov in governors.values():
+        gov.reload = True
+
+def get(app: str, kwargs: dict) -> governor:
+    if not kwargs['_name'] in governors.keys():
+        governors[kwargs['_name']] = governor(app, kwargs)
+
+        if hasattr(signal, 'SIGHUP') and \
+           threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, reload_all)
+
+    return governors[kwargs['_name']]
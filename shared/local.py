@@ -1,4 +1,3 @@
-
 # ./shared/local.py:
 #   local file manipulations.
 # 
@@ -8,17 +7,87 @@
 import os
 import shutil
 
-# move local. 
-def copy_local(file, dest):
+from shared.ansi import info, format_file_size
+
+FICLONE = 0x40049409   # linux ioctl to share the extents of two files.
+
+# the mechanisms of the local copies in this run, to (files, bytes). they are
+# tried from the cheapest: a copy-on-write clone shares the extents and costs
+# nothing, copy_file_range and sendfile keep the data in the kernel (and may be
+# offloaded to the storage by network filesystems), and a buffered copy in the
+# user space works everywhere.
+copy_stats = {}
+
+def count_copy(mechanism, length):
+    files, total = copy_stats.get(mechanism, (0, 0))
+    copy_stats[mechanism] = (files + 1, total + length)
+
+def copy_range(src, dst, length) -> int:
+    copied = 0
+    while copied < length:
+        sent = os.copy_file_range(src, dst, length - copied)
+        if sent == 0: break
+        copied += sent
+    return copied
+
+def send_file(src, dst, length) -> int:
+    copied = 0
+    while copied < length:
+        sent = os.sendfile(dst, src, copied, length - copied)
+        if sent == 0: break
+        copied += sent
+    return copied
+
+kernel_copies = [
+    ('copy_file_range', copy_range),
+    ('sendfile', send_file)
+]
+
+# copy the content and the permission bits of file to dest.
+def copy_content(file, dest, reflink = True):
+
+    length = os.path.getsize(file)
+    if reflink and reflink_local(file, dest):
+        shutil.copymode(file, dest)
+        count_copy('reflink', length)
+        return dest
+
+    with open(file, 'rb') as src, open(dest, 'wb') as dst:
+        for name, func in kernel_copies:
+            if not hasattr(os, name): continue
+            
+            try:
+                if func(src.fileno(), dst.fileno(), length) == length:
+                    count_copy(name, length)
+                    break
+            except OSError: pass
+
+            # not supported between the two files. start over.
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+        
+        else:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            count_copy('buffered', length)
+
+    shutil.copymode(file, dest)
+    return dest
+
+# copy local. reflink is false when dest must not share its extents with the
+# file, even though the filesystem could.
+def copy_local(file, dest, reflink = True):
 
     if not os.path.exists(os.path.dirname(dest)):
         os.makedirs(os.path.dirname(dest))
     
     if os.name == 'nt':
         shutil.copy(file.replace('/', '\\'), dest.replace('/','\\'))
-    else: shutil.copy(file, dest)
+        count_copy('buffered', os.path.getsize(file))
+    else: copy_content(file, dest, reflink)
 
-# copy local.
+# move local. a rename if both are on the same filesystem, otherwise a copy
+# (with the cheapest mechanism as copy_local) and a removal.
 def move_local(file, dest):
 
     if not os.path.exists(os.path.dirname(dest)):
@@ -26,4 +95,45 @@ def move_local(file, dest):
     
     if os.name == 'nt':
         shutil.move(file.replace('/', '\\'), dest.replace('/', '\\'))
-    else: shutil.move(file, dest)
\ No newline at end of file
+    else: shutil.move(file, dest, copy_function = copy_content)
+
+def report_copies():
+    if len(copy_stats) == 0: return
+    info('Local copies: {0}.'.format(', '.join([
+        '{0} by {1} ({2})'.format(files, mechanism, format_file_size(total))
+        for mechanism, (files, total) in copy_stats.items()])))
+    copy_stats.clear()
+
+# make dest a copy-on-write clone of file (btrfs, xfs and others supporting 
+# FICLONE). returns false without leaving anything at dest if the filesystem
+# cannot do it, the caller should then fall back to an ordinary copy.
+def reflink_local(file, dest) -> bool:
+
+    if os.name == 'nt': return False
+    try: import fcntl
+    except ImportError: return False
+
+    if not os.path.exists(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+
+    try:
+        with open(file, 'rb') as src, open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    
+    except OSError:
+        if os.path.exists(dest): os.remove(dest)
+        return False
+
+# make dest another name of the same file. the two names share the content, so
+# editing one of them in place also changes the other.
+def hardlink_local(file, dest) -> bool:
+
+    if not os.path.exists(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    
+    try:
+        os.link(file, dest)
+        return True
+    except (OSError, NotImplementedError):
+        return False
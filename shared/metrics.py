@@ -0,0 +1,155 @@
+# ./shared/metrics.py
+#   the figures of a task run, for the monitoring to alert on regressions: the
+#   time of each phase, the files scanned and the bytes hashed, the hits of the
+#   blob cache, the files and bytes transferred, the subprocesses spawned and
+#   the latency of the calls into the interfaces.
+#
+#   at the end of each task run, they are written as an openmetrics textfile
+#   to conf/<task>/<command>.metrics.prom, and as a json summary to
+#   conf/<task>/<command>.metrics.json. with the 'metrics-dir' setting, the
+#   textfile is also written (atomically, as the textfile collector of the node
+#   exporter expects) to <metrics-dir>/sync_<task>_<command>.prom.
+#
+#   all the values are of the last run, so they are exported as gauges, and
+#   the latencies as summaries with their 0.5, 0.9 and 0.99 quantiles.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import json
+import os
+import threading
+import time
+
+from shared.configuration import get_conf_dir
+
+optional_args = [
+    'metrics-dir',  # the directory of the node exporter textfile collector
+]
+
+# the metric families, by their name without the 'sync_' prefix.
+families = {
+    'run_success': ('gauge', 'Whether the last run succeeded.'),
+    'run_timestamp_seconds': ('gauge', 'When the last run started.'),
+    'run_duration_seconds': ('gauge', 'The time the last run took.'),
+    'phase_seconds': ('gauge', 'The time spent in each phase of the last run.'),
+    'hashed_files': ('gauge', 'The files hashed by the scan, rather than taken from the last catalog.'),
+    'files': ('gauge', 'The files through each stage, the files scanned for hashing.'),
+    'bytes': ('gauge', 'The bytes through each stage, the bytes read for hashing.'),
+    'cache_hits': ('gauge', 'The files restored from the blob cache.'),
+    'cache_misses': ('gauge', 'The files looked up in the blob cache and not found.'),
+    'cache_hit_bytes': ('gauge', 'The bytes restored from the blob cache.'),
+    'changes': ('gauge', 'The files changed by the last run (or found by diff), by kind.'),
+    'subprocesses': ('gauge', 'The subprocesses spawned by the providers, by program.'),
+    'call_seconds': ('summary', 'The latency of the calls traced, those into the interfaces as oss.*.'),
+}
+
+quantiles = [0.5, 0.9, 0.99]
+
+state = {
+    'values': None,   # (name, labels) to the value, none if not collecting
+    'samples': None,  # (name, labels) to the list of observations
+    'start': 0.0,
+    'lock': threading.Lock()
+}
+
+def collecting() -> bool:
+    return state['values'] is not None
+
+def start():
+    state['values'] = {}
+    state['samples'] = {}
+    state['start'] = time.time()
+
+# add to the value of the metric, as `count('files', 3, stage = 'uploading')`.
+def count(name: str, value = 1, **labels):
+    if state['values'] is None: return
+    key = (name, tuple(sorted(labels.items())))
+    with state['lock']:
+        state['values'][key] = state['values'].get(key, 0) + value
+
+def observe(name: str, value: float, **labels):
+    if state['samples'] is None: return
+    key = (name, tuple(sorted(labels.items())))
+    with state['lock']:
+        if not key in state['samples'].keys(): state['samples'][key] = []
+        state['samples'][key] += [value]
+
+def quantile(samples: list, q: float) -> float:
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels) -> str:
+    return '{' + ','.join(['{0}="{1}"'.format(key, escape(value))
+                           for key, value in labels]) + '}'
+
+def format_textfile(values: dict, samples: dict, labels: tuple) -> str:
+    lines = []
+    for family, (kind, help) in families.items():
+        name = 'sync_' + family
+        family_values = [(key[1], values[key]) for key in sorted(values.keys())
+                         if key[0] == family]
+        family_samples = [(key[1], samples[key]) for key in sorted(samples.keys())
+                          if key[0] == family]
+        if len(family_values) + len(family_samples) == 0: continue
+
+        lines += ['# TYPE {0} {1}'.format(name, kind), '# HELP {0} {1}'.format(name, help)]
+        for keys, value in family_values:
+            lines += ['{0}{1} {2}'.format(name, format_labels(labels + keys), value)]
+        for keys, observed in family_samples:
+            for q in quantiles:
+                lines += ['{0}{1} {2}'.format(name, format_labels(
+                          labels + keys + (('quantile', q),)), quantile(observed, q))]
+            lines += ['{0}_sum{1} {2}'.format(name, format_labels(labels + keys), sum(observed))]
+            lines += ['{0}_count{1} {2}'.format(name, format_labels(labels + keys), len(observed))]
+
+    return '\n'.join(lines + ['# EOF']) + '\n'
+
+def format_summary(values: dict, samples: dict, name: str, command: str) -> dict:
+    summary = { 'task': name, 'command': command, 'metrics': [], 'summaries': [] }
+    for key in sorted(values.keys()):
+        summary['metrics'] += [{ 'name': 'sync_' + key[0], 'labels': dict(key[1]),
+                                 'value': values[key] }]
+    for key in sorted(samples.keys()):
+        observed = samples[key]
+        summary['summaries'] += [{ 'name': 'sync_' + key[0], 'labels': dict(key[1]),
+            'count': len(observed), 'sum': sum(observed),
+            'quantiles': dict([(str(q), quantile(observed, q)) for q in quantiles]) }]
+    return summary
+
+def write_atomic(path: str, content: str):
+    temp = '{0}.{1}.part'.format(path, os.getpid())
+    with open(temp, 'w', encoding = 'utf-8') as fp: fp.write(content)
+    os.replace(temp, path)
+
+# write the metrics of the task run down, and stop collecting them.
+def finish(app: str, name: str, command: str, kwargs: dict, success: bool):
+    if state['values'] is None: return
+
+    count('run_success', 1 if success else 0)
+    count('run_timestamp_seconds', state['start'])
+    count('run_duration_seconds', time.time() - state['start'])
+
+    with state['lock']:
+        values, samples = state['values'], state['samples']
+        state['values'] = None
+        state['samples'] = None
+    for key in samples.keys(): samples[key].sort()
+
+    labels = (('command', command), ('task', name))
+    textfile = format_textfile(values, samples, labels)
+    summary = format_summary(values, samples, name, command)
+
+    conf_dir = get_conf_dir(app, name)
+    if not os.path.exists(conf_dir): os.makedirs(conf_dir)
+    write_atomic('{0}/{1}.metrics.prom'.format(conf_dir, command), textfile)
+    write_atomic('{0}/{1}.metrics.json'.format(conf_dir, command),
+                 json.dumps(summary, indent = 2) + '\n')
+
+    metrics_dir = kwargs.get('metrics-dir', '<not-set>')
+    if metrics_dir != '<not-set>':
+        if not os.path.exists(metrics_dir): os.makedirs(metrics_dir)
+        write_atomic('{0}/sync_{1}_{2}.prom'.format(metrics_dir,
+                     os.path.basename(conf_dir), command), textfile)
@@ -12,6 +12,7 @@ import copy
 
 from shared.configuration import get_providers, load_provider, remove_duplicate
 from shared.ansi import error
+from shared.trace import traced
 
 required_args = [
     'dest'      # the local destination folder (the one to sync)
@@ -38,9 +39,25 @@ def get_required_args(app, provider) -> list:
 #
 #   download-abs: (str, str) -> str
 #   download-rel: (str, str) -> str
+#   download-range: (str, str, int, int) -> str
+#   download-stream: (str, str, callable) -> str, downloads like download-abs,
+#         passing the chunks of the object to the callable as they are written
+#         (e.g. to take its checksum without reading the file back).
 #   upload-abs: (str, str) -> int
 #   upload-rel: (str, str) -> int
 #   move-remote: (str, str) -> int
+#   list: (str) -> dict, of the remote objects under a prefix to (size, etag, 
+#         last modified time). the etag is empty if the provider cannot tell it
+#         cheaply.
+#   delete: (list) -> int, removes a batch of remote objects and returns the
+#         number of them removed.
+#   create: (str, str) -> bool, uploads like upload-abs, but only if the remote
+#         object does not exist yet, as a single atomic step. returns whether
+#         the object has been created.
+#
+# the providers hold their transfers to the network limit of the task, got by
+# shared.governor.get(kwargs['app'], kwargs): metering the bytes as they stream
+# with net(), or passing net_begin() as the speed limit of another program.
 
 def init(app, provider, kwargs):
 
@@ -75,6 +92,12 @@ def init(app, provider, kwargs):
     def download_file(remote: str, local: str) -> str:
         return prov.download_file(remote, local, kwargs)
     
+    def download_stream(remote: str, local: str, consume) -> str:
+        return prov.download_stream(remote, local, consume, kwargs)
+    
+    def download_range(remote: str, local: str, start: int, end: int) -> str:
+        return prov.download_range(remote, local, start, end, kwargs)
+    
     def upload_file(local: str, remote: str) -> int:
         return prov.upload_file(local, remote, kwargs)
     
@@ -91,11 +114,30 @@ def init(app, provider, kwargs):
     def remote_copy(src: str, dest: str) -> int:
         return prov.copy_file(src, dest, kwargs)
     
+    def list_files(prefix: str) -> dict:
+        return prov.list_files(prefix, kwargs)
+    
+    def delete_files(remotes: list) -> int:
+        return prov.delete_files(remotes, kwargs)
+    
+    def create_file(local: str, remote: str) -> bool:
+        return prov.create_file(local, remote, kwargs)
+    
     func_dict['download-abs'] = download_file
     func_dict['download-rel'] = download_relative
+    func_dict['download-range'] = download_range
+    func_dict['download-stream'] = download_stream
     func_dict['upload-abs'] = upload_file
     func_dict['upload-rel'] = upload_relative
     func_dict['remote-move'] = remote_move
     func_dict['remote-copy'] = remote_copy
+    func_dict['list'] = list_files
+    func_dict['delete'] = delete_files
+    func_dict['create'] = create_file
+
+    # the calls into the provider (the ossutil processes and the like) are
+    # traced as spans of their own with --trace.
+    for key in func_dict.keys():
+        func_dict[key] = traced('oss.' + key)(func_dict[key])
 
     return func_dict
\ No newline at end of file
@@ -9,6 +9,12 @@
 
 import os
 import subprocess
+import time
+from datetime import datetime
+
+from shared.ansi import error, warning
+import shared.governor
+import shared.metrics
 
 VERBOSE = False   # debug use only
 
@@ -20,6 +26,36 @@ required_args = [
     'endpoint',   # the remote endpoint
 ]
 
+# run the ossutil command, counted to the metrics of the run.
+def spawn(params: list, **options) -> subprocess.CompletedProcess:
+    shared.metrics.count('subprocesses', program = 'ossutil')
+    return subprocess.run(params, **options)
+
+# run the ossutil copy between the local file and the bucket, with its share
+# of the network limit of the task as its own speed limit (in KB/s, direction
+# 'up' or 'down'). ossutil streams the file by itself, so the bytes are only
+# counted to the governor once it ends.
+def transfer(params: list, direction: str, local: str, kwargs: dict) -> subprocess.CompletedProcess:
+    governor = shared.governor.get(kwargs['app'], kwargs)
+    rate = governor.net_begin()
+    if rate > 0: params = params + ['--max{0}speed'.format(direction), str(max(1, rate // 1024))]
+
+    try: return spawn(params, capture_output = not VERBOSE)
+    finally: governor.net_end(os.path.getsize(local) if os.path.exists(local) else 0)
+
+# the oss2 python sdk, or None if it is not installed. it is optional, and
+# used only where ossutil has no counterpart.
+def import_sdk():
+    try: import oss2
+    except ImportError: return None
+    return oss2
+
+def sdk_bucket(oss2, kwargs: dict):
+    endpoint = kwargs['endpoint']
+    if not '://' in endpoint: endpoint = 'https://' + endpoint
+    return oss2.Bucket(oss2.Auth(kwargs['id'], kwargs['credential']), endpoint,
+                       kwargs['bucket'])
+
 # download from server into the local (absolute) corresponding path.
 # requires kwargs 'bucket' and 'oss'.
 def download_file(remote: str, local: str, kwargs: dict) -> str:
@@ -30,40 +66,197 @@ def download_file(remote: str, local: str, kwargs: dict) -> str:
         'cp', 'oss://{0}{1}'.format(kwargs['bucket'], remote),
         local.replace('\\', '/'),
         '-c', kwargs['config-file']]
-    subprocess.run(params, capture_output = not VERBOSE)
+    transfer(params, 'down', local, kwargs)
+    return '{0}'.format(remote)
+
+# download the object like download_file, passing the chunks to consume as
+# they are written. the sdk streams the object through us, so the bytes are
+# metered by the governor as they come. without oss2, ossutil downloads it,
+# and the file is read back for consume.
+def download_stream(remote: str, local: str, consume, kwargs: dict) -> str:
+    oss2 = import_sdk()
+    if oss2 is None:
+        download_file(remote, local, kwargs)
+        if not os.path.exists(local): return '{0}'.format(remote)
+        with open(local, 'rb') as fp:
+            while True:
+                content = fp.read(256 * 1024)
+                if len(content) == 0: break
+                consume(content)
+        return '{0}'.format(remote)
+
+    if os.path.exists(local):
+        os.remove(local)
+
+    governor = shared.governor.get(kwargs['app'], kwargs)
+    try:
+        stream = sdk_bucket(oss2, kwargs).get_object(remote.replace('\\', '/').lstrip('/'))
+        with open(local, 'wb') as fp:
+            while True:
+                content = stream.read(256 * 1024)
+                if len(content) == 0: break
+                governor.net(len(content))
+                consume(content)
+                fp.write(content)
+    
+    # nothing is left at local if the object cannot be read, as with ossutil.
+    except oss2.exceptions.OssError:
+        if os.path.exists(local): os.remove(local)
+    
+    return '{0}'.format(remote)
+
+# download the bytes [start, end] (both inclusive) of the remote file.
+def download_range(remote: str, local: str, start: int, end: int, kwargs: dict) -> str:
+    if os.path.exists(local):
+        os.remove(local)
+
+    params = [kwargs['oss'],
+        'cp', 'oss://{0}{1}'.format(kwargs['bucket'], remote),
+        local.replace('\\', '/'),
+        '--range={0}-{1}'.format(start, end),
+        '-c', kwargs['config-file']]
+    transfer(params, 'down', local, kwargs)
     return '{0}'.format(remote)
 
 # upload to server using absolute file to the remote destfile.
 def upload_file(file: str, destfile: str, kwargs: dict) -> int:
-    subprocess.run([kwargs['oss'], 'rm', 
+    spawn([kwargs['oss'], 'rm', 
                     'oss://{0}{1}'.format(kwargs['bucket'], 
                                           destfile.replace('\\', '/')),
                     '-c', kwargs['config-file']], capture_output = not VERBOSE)
     
-    return subprocess.run([kwargs['oss'],
+    return transfer([kwargs['oss'],
         'cp', file.replace('\\', '/'),
         'oss://{0}{1}'.format(kwargs['bucket'], destfile.replace('\\', '/')),
-        '-c', kwargs['config-file']], capture_output = not VERBOSE)
+        '-c', kwargs['config-file']], 'up', file, kwargs)
+
+# upload only if the object does not exist. by default, the object is looked
+# up, and uploaded if it is not there. this is not atomic: another writer may
+# create the object in between, and then one of the two is overwritten. with
+# -conditional-put oss2, see create_conditional.
+def create_file(file: str, destfile: str, kwargs: dict) -> bool:
+    mode = kwargs.get('conditional-put', '<not-set>')
+    if mode == 'oss2': return create_conditional(file, destfile, kwargs)
+    if mode != '<not-set>' and mode != 'check':
+        error('invalid conditional-put `{0}`, should be check or oss2.'.format(mode))
+
+    if destfile.replace('\\', '/') in list_files(destfile, kwargs).keys(): return False
+    outs = transfer([kwargs['oss'],
+        'cp', file.replace('\\', '/'),
+        'oss://{0}{1}'.format(kwargs['bucket'], destfile.replace('\\', '/')),
+        '-f', '-c', kwargs['config-file']], 'up', file, kwargs)
+    if outs.returncode != 0:
+        error('cannot create oss://{0}{1}.'.format(kwargs['bucket'], destfile))
+    return True
+
+# oss rejects a put carrying the 'x-oss-forbid-overwrite: true' request header
+# with 409 (FileAlreadyExists) when the object is there, so the check and the
+# write cannot be interleaved by another writer. ossutil has no way to send
+# that header (its --meta only sets the object metadata), so the put is made
+# with the oss2 sdk, which sends the headers given to put_object as they are.
+# any failure other than the object existing stops the run, rather than being
+# taken as another writer having won.
+def create_conditional(file: str, destfile: str, kwargs: dict) -> bool:
+    oss2 = import_sdk()
+    if oss2 is None:
+        error('-conditional-put oss2 needs the oss2 package, install it by `pip install oss2`.')
+    bucket = sdk_bucket(oss2, kwargs)
+
+    # the bytes are metered by the governor as the sdk sends them.
+    governor = shared.governor.get(kwargs['app'], kwargs)
+    sent = [0]
+    def progress(consumed, total):
+        governor.net(consumed - sent[0])
+        sent[0] = consumed
+
+    try:
+        bucket.put_object_from_file(destfile.replace('\\', '/').lstrip('/'), file,
+                                    headers = { 'x-oss-forbid-overwrite': 'true' },
+                                    progress_callback = progress)
+        return True
+    except oss2.exceptions.OssError as e:
+        if getattr(e, 'status', 0) == 409 and getattr(e, 'code', '') == 'FileAlreadyExists':
+            return False
+        error('cannot create oss://{0}{1}: {2}'.format(kwargs['bucket'], destfile, e))
+
+# list the objects whose names start with the prefix, as a dictionary of
+# remote path to (size, etag, last modified time). the etag of a simple upload
+# is the md5 of the content in upper case, and that of a multipart one ends
+# with '-<parts>'.
+#
+#   LastModifiedTime                   Size(B)  StorageClass   ETAG   ObjectName
+#   2024-05-08 15:06:37 +0800 CST         1024      Standard   61DE...   oss://b/x
+def list_files(prefix: str, kwargs: dict) -> dict:
+    outs = spawn([kwargs['oss'],
+        'ls', 'oss://{0}{1}'.format(kwargs['bucket'], prefix.replace('\\', '/')),
+        '-c', kwargs['config-file']], capture_output = True, text = True)
+    
+    objects = {}
+    root = 'oss://{0}'.format(kwargs['bucket'])
+    for line in outs.stdout.splitlines():
+        head, _, name = line.partition(' ' + root + '/')
+        if head == '': continue
+        fields = head.split()
+        if len(fields) < 7: continue
+
+        try: mtime = datetime.strptime(' '.join(fields[:3]), '%Y-%m-%d %H:%M:%S %z').timestamp()
+        # an object of unknown age is taken as just modified, so that it is
+        # never old enough to be collected or taken over.
+        except ValueError: mtime = time.time()
+        objects['/' + name] = (int(fields[-3]), fields[-1].strip('"'), mtime)
+    
+    return objects
+
+# remove the remote objects, returns the number of them removed. with oss2
+# installed, they are removed by batches of 1000 (the most a request takes),
+# and counted by the keys the server reports deleted. otherwise ossutil takes
+# one object for each call, the caller runs several batches at the same time.
+def delete_files(remotes: list, kwargs: dict) -> int:
+    oss2 = import_sdk()
+    if oss2 is not None: return delete_batches(oss2, remotes, kwargs)
+
+    removed = 0
+    for remote in remotes:
+        outs = spawn([kwargs['oss'], 'rm', 
+            'oss://{0}{1}'.format(kwargs['bucket'], remote.replace('\\', '/')),
+            '-f', '-c', kwargs['config-file']], capture_output = not VERBOSE)
+        if outs.returncode == 0: removed += 1
+    
+    return removed
+
+def delete_batches(oss2, remotes: list, kwargs: dict) -> int:
+    bucket = sdk_bucket(oss2, kwargs)
+    keys = [x.replace('\\', '/').lstrip('/') for x in remotes]
+    
+    removed = 0
+    for start in range(0, len(keys), 1000):
+        batch = keys[start : start + 1000]
+        try: removed += len(bucket.batch_delete_objects(batch).deleted_keys)
+        except oss2.exceptions.OssError as e:
+            warning('cannot remove {0} objects from oss://{1}: {2}'
+                    .format(len(batch), kwargs['bucket'], e))
+    
+    return removed
 
 # this is not actually move, since i do not want to actually delete the file
 # in the original location. i think this is safer, this makes the move method
 # completely identical to copy. but you can implement the move_file in another way.
 def move_file(src: str, dest: str, kwargs: dict) -> int:
-    subprocess.run([kwargs['oss'], 'rm', 
+    spawn([kwargs['oss'], 'rm', 
                     'oss://{0}{1}'.format(kwargs['bucket'], dest.replace('\\', '/')),
                     '-c', kwargs['config-file']], capture_output = not VERBOSE)
     
-    return subprocess.run([kwargs['oss'],
+    return spawn([kwargs['oss'],
         'cp', 'oss://{0}{1}'.format(kwargs['bucket'], src.replace('\\', '/')),
         'oss://{0}{1}'.format(kwargs['bucket'], dest.replace('\\', '/')),
         '-c', kwargs['config-file']], capture_output = not VERBOSE)
 
 def copy_file(src: str, dest: str, kwargs: dict) -> int:
-    subprocess.run([kwargs['oss'], 'rm', 
+    spawn([kwargs['oss'], 'rm', 
                     'oss://{0}{1}'.format(kwargs['bucket'], dest.replace('\\', '/')),
                     '-c', kwargs['config-file']], capture_output = not VERBOSE)
     
-    return subprocess.run([kwargs['oss'],
+    return spawn([kwargs['oss'],
         'cp', 'oss://{0}{1}'.format(kwargs['bucket'], src.replace('\\', '/')),
         'oss://{0}{1}'.format(kwargs['bucket'], dest.replace('\\', '/')),
         '-c', kwargs['config-file']], capture_output = not VERBOSE)
@@ -0,0 +1,188 @@
+# ./shared/oss_local.py
+#   a local directory, or a mounted nas, as the bucket of the oss interface.
+#   the remote paths are taken relative to the 'root' directory. see interface
+#   definition in oss.py remarks.
+#
+#   the objects are never modified in place. uploads write a temporary file
+#   next to the object and rename it into place, so that a reader never sees
+#   a partial object, and the objects can safely share their content with
+#   hardlinks. copies are hardlinks (or reflinks, or kernel-side copies if the
+#   root does not support links), and so are moves.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import os
+
+from shared.ansi import error
+from shared.local import copy_local, hardlink_local
+import shared.governor
+
+required_args = [
+    'root'        # the directory taken as the bucket
+]
+
+part_suffix = '.oss-part'
+
+def object_path(remote: str, kwargs: dict) -> str:
+    return kwargs['root'].replace('\\', '/').rstrip('/') + remote.replace('\\', '/')
+
+def part_path(path: str) -> str:
+    return '{0}.{1}{2}'.format(path, os.getpid(), part_suffix)
+
+# copy the bytes [start, start + length) of the file to dest (all of it if the
+# length is negative), as a transfer held to the network limit of the task:
+# in chunks metered by the governor when there is a limit, or by the cheapest
+# local copy otherwise. with consume, the chunks are also passed to it as they
+# are written.
+def copy_metered(file: str, dest: str, kwargs: dict, start: int = 0, length: int = -1,
+                 consume = None):
+    governor = shared.governor.get(kwargs['app'], kwargs)
+    if start == 0 and length < 0 and consume is None and not governor.net_limited():
+        copy_local(file, dest)
+        governor.net(os.path.getsize(dest))
+        return
+
+    if not os.path.exists(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+
+    with open(file, 'rb') as src, open(dest, 'wb') as dst:
+        src.seek(start)
+        remains = length if length >= 0 else os.path.getsize(file) - start
+        while remains > 0:
+            content = src.read(min(remains, 256 * 1024))
+            if len(content) == 0: break
+            governor.net(len(content))
+            if consume is not None: consume(content)
+            dst.write(content)
+            remains -= len(content)
+
+# download from the root into the local (absolute) corresponding path. nothing
+# is left at local if the object does not exist.
+def download_file(remote: str, local: str, kwargs: dict) -> str:
+    if os.path.exists(local):
+        os.remove(local)
+
+    path = object_path(remote, kwargs)
+    if os.path.isfile(path): copy_metered(path, local, kwargs)
+    return '{0}'.format(remote)
+
+# download the object like download_file, passing the chunks to consume as
+# they are written.
+def download_stream(remote: str, local: str, consume, kwargs: dict) -> str:
+    if os.path.exists(local):
+        os.remove(local)
+
+    path = object_path(remote, kwargs)
+    if os.path.isfile(path): copy_metered(path, local, kwargs, consume = consume)
+    return '{0}'.format(remote)
+
+# download the bytes [start, end] (both inclusive) of the remote file.
+def download_range(remote: str, local: str, start: int, end: int, kwargs: dict) -> str:
+    if os.path.exists(local):
+        os.remove(local)
+
+    path = object_path(remote, kwargs)
+    if not os.path.isfile(path): return '{0}'.format(remote)
+
+    copy_metered(path, local, kwargs, start, end - start + 1)
+    return '{0}'.format(remote)
+
+# upload the absolute file to the remote destfile, through a temporary file
+# renamed into place.
+def upload_file(file: str, destfile: str, kwargs: dict) -> int:
+    path = object_path(destfile, kwargs)
+    temp = part_path(path)
+
+    copy_metered(file, temp, kwargs)
+    os.replace(temp, path)
+    return 0
+
+# upload only if the object does not exist. the link of the temporary file
+# fails if the name is taken, atomically even on most network filesystems.
+def create_file(file: str, destfile: str, kwargs: dict) -> bool:
+    path = object_path(destfile, kwargs)
+    temp = part_path(path)
+
+    copy_metered(file, temp, kwargs)
+    try: 
+        os.link(temp, path)
+        return True
+    except FileExistsError: return False
+    finally: os.remove(temp)
+
+# as with the aliyun provider, the source is left where it is. a push moves
+# the objects before the catalog naming them at their new paths is published,
+# and an interrupted push would otherwise lose the objects the published 
+# catalog still refers to. the sources are collected by gc once unreferenced.
+def move_file(src: str, dest: str, kwargs: dict) -> int:
+    return copy_file(src, dest, kwargs)
+
+def copy_file(src: str, dest: str, kwargs: dict) -> int:
+    path = object_path(src, kwargs)
+    if not os.path.isfile(path): return 1
+
+    target = object_path(dest, kwargs)
+    if not os.path.exists(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+
+    temp = part_path(target)
+    if not hardlink_local(path, temp): copy_local(path, temp)
+    os.replace(temp, target)
+    return 0
+
+# list the objects whose names start with the prefix, as a dictionary of
+# remote path to (size, etag, last modified time). the etag is left empty, 
+# since it would take a full read of the objects.
+def list_files(prefix: str, kwargs: dict) -> dict:
+    objects = {}
+    root = object_path('', kwargs)
+    path = object_path(prefix, kwargs)
+
+    # the directory holding the prefix, and its entries the prefix matches.
+    base = os.path.dirname(path) if not path.endswith('/') else path.rstrip('/')
+    if not os.path.isdir(base): return objects
+
+    for entry in os.scandir(base):
+        full = base + '/' + entry.name
+        if not full.startswith(path) and not (full + '/').startswith(path): continue
+
+        if entry.is_file():
+            if entry.name.endswith(part_suffix): continue
+            file_stat = entry.stat()
+            objects[full[len(root):]] = (file_stat.st_size, '', file_stat.st_mtime)
+            continue
+
+        for dirpath, _, files in os.walk(full):
+            for file in files:
+                if file.endswith(part_suffix): continue
+                name = dirpath.replace('\\', '/') + '/' + file
+                file_stat = os.stat(name)
+                objects[name[len(root):]] = (file_stat.st_size, '', file_stat.st_mtime)
+
+    return objects
+
+# remove the remote objects, returns the number of them removed. directories
+# left empty are removed as well.
+def delete_files(remotes: list, kwargs: dict) -> int:
+    removed = 0
+    root = object_path('', kwargs)
+    
+    for remote in remotes:
+        path = object_path(remote, kwargs)
+        if not os.path.isfile(path): continue
+        os.remove(path)
+        removed += 1
+
+        parent = os.path.dirname(path)
+        while parent != root and parent.startswith(root) and len(os.listdir(parent)) == 0:
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+    
+    return removed
+
+def init(kwargs: dict):
+
+    if not os.path.isdir(kwargs['root']):
+        error('the root directory {0} of the local oss does not exist.'
+              .format(kwargs['root']))
@@ -0,0 +1,75 @@
+# ./shared/plan.py
+#   the plan files written by `sync plan` and run by `sync apply`. a plan is a
+#   tab-delimited text file, one record on each line, the first column telling
+#   its kind:
+#
+#     task      <name>                    the task the plan is made for
+#     command   <push|fetch>              the command the plan runs
+#     created   <unix time>
+#     option    <key>   <value>           the command line settings of the run
+#     input     <key>   <value>           what apply checks to be unchanged
+#     local     <catalog line>            the local checksum of the planned run
+#     decide    <kind>  <0|1>  <path>     the answers to the confirmations
+#     op        <op>    <path>  [<from>]  the operations to be made, for review
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import time
+
+from shared.ansi import error
+
+def write_plan(path: str, task: str, command: str, options: list, inputs: dict,
+               local: list, decisions: list, ops: list):
+
+    with open(path, 'w', encoding = 'utf-8') as fp:
+        fp.write('# sync plan, run it with `sync apply {0}`.\n'.format(path))
+        fp.write('task\t{0}\n'.format(task))
+        fp.write('command\t{0}\n'.format(command))
+        fp.write('created\t{0}\n'.format(time.time()))
+
+        for key, value in options: fp.write('option\t{0}\t{1}\n'.format(key, value))
+        for key in inputs.keys(): fp.write('input\t{0}\t{1}\n'.format(key, inputs[key]))
+        for line in local: fp.write('local\t{0}'.format(line))
+        for kind, answer, target in decisions:
+            fp.write('decide\t{0}\t{1}\t{2}\n'.format(kind, 1 if answer else 0, target))
+        for op in ops: fp.write('op\t{0}\n'.format('\t'.join(op)))
+
+# returns the plan as a dictionary of 'task', 'command', 'created', 'options'
+# (key to the list of values), 'inputs', 'local' (catalog lines), 'decisions'
+# (kind to the dictionary of path to answer) and 'ops'.
+def read_plan(path: str) -> dict:
+
+    plan = { 'task': None, 'command': None, 'created': 0.0, 'options': {},
+             'inputs': {}, 'local': [], 'decisions': {}, 'ops': [] }
+
+    try:
+        with open(path, 'r', encoding = 'utf-8') as fp:
+            content = fp.read().splitlines()
+    except OSError:
+        error('cannot read the plan {0}.'.format(path))
+
+    for line in content:
+        if line.startswith('#') or line.strip() == '': continue
+        kind, _, rest = line.partition('\t')
+
+        if kind in ['task', 'command']: plan[kind] = rest
+        elif kind == 'created': plan['created'] = float(rest)
+        elif kind == 'option':
+            key, _, value = rest.partition('\t')
+            if not key in plan['options'].keys(): plan['options'][key] = []
+            plan['options'][key] += [value]
+        elif kind == 'input':
+            key, _, value = rest.partition('\t')
+            plan['inputs'][key] = value
+        elif kind == 'local': plan['local'] += [rest + '\n']
+        elif kind == 'decide':
+            dkind, answer, target = rest.split('\t', 2)
+            if not dkind in plan['decisions'].keys(): plan['decisions'][dkind] = {}
+            plan['decisions'][dkind][target] = answer == '1'
+        elif kind == 'op': plan['ops'] += [tuple(rest.split('\t'))]
+
+    if plan['task'] is None or plan['command'] is None:
+        error('{0} is not a sync plan.'.format(path))
+
+    return plan
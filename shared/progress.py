@@ -0,0 +1,115 @@
+# ./shared/progress.py
+#   the progress line of the long loops (hashing, uploads and downloads), and
+#   the per-file results of push and fetch.
+#
+#   the progress line is drawn at most every 'interval' seconds however fast
+#   the files go, with the files and bytes per second, and the time left when
+#   the totals are known. the per-file results are written to a log file as
+#   they come, with only their counts and the first few of each kind kept to
+#   be shown at the end.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import threading
+import time
+
+from shared.ansi import common_length, format_file_size, line_start
+import shared.metrics
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '{0:02d}:{1:02d}'.format(seconds // 60, seconds % 60)
+
+class progress():
+
+    def __init__(self, title: str, total_files: int = 0, total_bytes: int = 0,
+                 interval: float = 0.2):
+        self.title = title
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+
+        self.files = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.drawn = self.start
+        self.lock = threading.Lock()
+
+    # count a file done, of size bytes, and redraw the line if it is time.
+    def advance(self, path: str, size: int = 0):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+            now = time.monotonic()
+            if now - self.drawn < self.interval: return
+            self.drawn = now
+            self.draw(path, now)
+
+    def draw(self, path: str, now: float):
+        elapsed = max(now - self.start, 1e-6)
+        status = '{0} {1}{2} files'.format(self.title, self.files,
+            '/' + str(self.total_files) if self.total_files > 0 else '')
+        status += ', {0:.0f} files/s'.format(self.files / elapsed)
+        if self.bytes > 0:
+            status += ', {0}/s'.format(format_file_size(self.bytes / elapsed))
+
+        # the time left, by the bytes when they are known, or by the files.
+        left = None
+        if self.total_bytes > 0 and self.bytes > 0:
+            left = (self.total_bytes - self.bytes) * elapsed / self.bytes
+        elif self.total_files > 0:
+            left = (self.total_files - self.files) * elapsed / self.files
+        if left is not None: status += ', eta ' + format_duration(max(left, 0))
+
+        line_start()
+        print(status, common_length(path, max(100 - len(status) - 1, 10)), end = '', flush = True)
+
+    # clear the progress line, and count the files and bytes to the metrics.
+    def close(self):
+        with self.lock:
+            line_start()
+            print(' ' * 110, end = '\r', flush = True)
+
+        stage = self.title.lower()
+        shared.metrics.count('files', self.files, stage = stage)
+        shared.metrics.count('bytes', self.bytes, stage = stage)
+
+# the per-file results, written as '<mark>\t<path>' lines to the log.
+
+class results():
+
+    def __init__(self, log: str, shown: int = 20):
+        self.log = log
+        self.fp = open(log, 'w', encoding = 'utf-8')
+        self.shown = shown
+        self.counts = {}
+        self.first = {}
+        self.lock = threading.Lock()
+
+    def add(self, kind: str, color: str, mark: str, path: str):
+        with self.lock:
+            self.fp.write('{0}\t{1}\n'.format(mark, path))
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+            if not kind in self.first.keys(): self.first[kind] = []
+            if len(self.first[kind]) < self.shown:
+                self.first[kind] += ['{0}[{1}]\033[0m {2}'.format(color, mark,
+                                     common_length(path, 70))]
+
+    def count(self, kind: str) -> int:
+        return self.counts.get(kind, 0)
+
+    # print the count of the kind, and the first of its files.
+    def report(self, kind: str, color: str, text: str):
+        print('{0}{1} {2}\033[0m'.format(color, self.count(kind), text))
+        for line in self.first.get(kind, []): print(line)
+        if self.count(kind) > self.shown:
+            print('... and {0} more, see {1}'.format(self.count(kind) - self.shown, self.log))
+
+    def close(self):
+        self.fp.close()
+        for kind in self.counts.keys():
+            shared.metrics.count('changes', self.counts[kind], kind = kind)
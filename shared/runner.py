@@ -0,0 +1,70 @@
+# ./shared/runner.py
+#   runs the tasks of one sync command at the same time. each task runs in a
+#   sync process of its own (as `sync --run-task <task> ...` with the same
+#   arguments), without a terminal, so that its prompts take the defaults.
+#   its output goes to conf/<task>/<command>.run.log, and a summary of all
+#   the tasks is printed when the slowest one finishes.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.configuration import get_conf_dir
+from shared.ansi import print_message, info, fill_blank
+
+def run_task(app: str, name: str, command: str, argv: list, lock) -> tuple:
+
+    conf_dir = get_conf_dir(app, name)
+    if not os.path.exists(conf_dir): os.makedirs(conf_dir)
+    log = '{0}/{1}.run.log'.format(conf_dir, command)
+
+    start = time.time()
+    with open(log, 'w', encoding = 'utf-8') as fp:
+        try:
+            code = subprocess.run(
+                [sys.executable, app + '/sync', '--run-task', name] + argv,
+                stdin = subprocess.DEVNULL, stdout = fp, stderr = subprocess.STDOUT
+            ).returncode
+        except OSError as e:
+            fp.write('[failed] {0}\n'.format(e))
+            code = -1
+
+    elapsed = time.time() - start
+    with lock:
+        if code == 0: print_message('\033[1;32m', 'v', name, False)
+        else: print_message('\033[1;31m', '!', '{0} (exit {1})'.format(name, code), False)
+
+    return name, code, elapsed, log
+
+# returns the exit status of the whole run, 0 only if all the tasks succeeded.
+def run_tasks(app: str, tasks: list, command: str, argv: list, jobs: int) -> int:
+
+    info('Running {0} tasks, {1} at a time ...\n'.format(len(tasks), jobs))
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers = jobs) as pool:
+        results = list(pool.map(lambda name: run_task(app, name, command, argv, lock),
+                                tasks))
+
+    print('')
+    failed = 0
+    for name, code, elapsed, log in results:
+        fill_blank(30, name)
+        if code == 0: print('\033[1;32m{:<8}\033[0m'.format('ok'), end = '')
+        else:
+            print('\033[1;31m{:<8}\033[0m'.format('exit ' + str(code)), end = '')
+            failed += 1
+        print('{:>10}  {}'.format('{:.1f}s'.format(elapsed), log))
+
+    print('')
+    if failed > 0:
+        print('\033[1;31m{0} of {1} tasks failed.\033[0m'.format(failed, len(tasks)))
+        return 1
+
+    print('\033[1;32m{0}\033[0m'.format('All tasks finished.'))
+    return 0
@@ -0,0 +1,158 @@
+# ./shared/trace.py
+#   named spans around the phases of a run (the walk and hashing, the catalog
+#   downloads, the reconciliation, the transfers, ...) and the calls into the
+#   interfaces, to tell where the time of a slow sync goes.
+#
+#   with --trace <file>, the spans are written as a json trace of the chrome
+#   trace event format, to open in ui.perfetto.dev or chrome://tracing. with
+#   --profile <dir>, each phase is also run under cprofile, and the profile of
+#   every phase is dumped to <dir>/<phase>.prof (see `python -m pstats`).
+#
+#   the time of the phases and the calls also goes to the metrics of the run
+#   (see shared/metrics.py). the functions are wrapped by traced when they are
+#   defined, that is, when the tasks and interfaces are initialized. as every
+#   task run collects its metrics, the phases and the calls are wrapped (and
+#   timed) in every run, and only the spans of the files hashed, taken by
+#   trace() for each file, are left out without --trace.
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import cProfile
+import json
+import os
+import threading
+import time
+
+from shared.ansi import info
+import shared.metrics
+
+state = {
+    'events': None,      # the trace events, none if not tracing
+    'file': None,
+    'profiles': None,    # the profiles by phase, none if not profiling
+    'dir': None,
+    'profiling': False,  # cprofile allows only one profiler running at a time
+    'threads': {},
+    'lock': threading.Lock()
+}
+
+def enabled() -> bool:
+    return state['events'] is not None or state['profiles'] is not None or \
+           shared.metrics.collecting()
+
+def start(trace_file = None, profile_dir = None):
+    if trace_file is not None:
+        state['events'] = []
+        state['file'] = trace_file
+    if profile_dir is not None:
+        state['profiles'] = {}
+        state['dir'] = profile_dir
+    state['start'] = time.perf_counter()
+    state['threads'] = {}
+    state['profiling'] = False
+
+# write down the trace and the profiles, and stop collecting them. nothing is
+# written by a run having traced nothing (e.g. the one starting the -j runs).
+def finish():
+    if state['events']:
+        pid = os.getpid()
+        events = [{ 'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                    'args': { 'name': name } } for tid, name in state['threads'].items()]
+
+        with open(state['file'], 'w', encoding = 'utf-8') as fp:
+            json.dump({ 'traceEvents': events + state['events'],
+                        'displayTimeUnit': 'ms' }, fp)
+        info('The trace is written to {0}.'.format(state['file']))
+
+    if state['profiles']:
+        if not os.path.exists(state['dir']): os.makedirs(state['dir'])
+        for phase, profile in state['profiles'].items():
+            profile.disable() # left running by a phase ended with an error
+            profile.dump_stats('{0}/{1}.prof'.format(state['dir'], phase.replace(' ', '-')))
+        info('The profiles of {0} phases are written to {1}.'.format(
+             len(state['profiles']), state['dir']))
+
+    state['events'] = None
+    state['profiles'] = None
+
+class span():
+
+    def __init__(self, name: str, phase: bool, args: dict):
+        self.name = name
+        self.phase = phase
+        self.args = args
+        self.profile = None
+
+    def __enter__(self):
+
+        # the phases of the main thread are profiled, unless nested in another.
+        if self.phase and state['profiles'] is not None and \
+           threading.current_thread() is threading.main_thread() and \
+           not state['profiling']:
+            if not self.name in state['profiles'].keys():
+                state['profiles'][self.name] = cProfile.Profile()
+            self.profile = state['profiles'][self.name]
+            state['profiling'] = True
+            self.profile.enable()
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        if self.profile is not None:
+            self.profile.disable()
+            state['profiling'] = False
+
+        if self.phase: shared.metrics.count('phase_seconds', end - self.start, phase = self.name)
+        else: shared.metrics.observe('call_seconds', end - self.start, call = self.name)
+
+        if state['events'] is None: return False
+        thread = threading.current_thread()
+        with state['lock']:
+            state['threads'][thread.ident] = thread.name
+            state['events'].append({
+                'name': self.name, 'cat': 'phase' if self.phase else 'call', 'ph': 'X',
+                'ts': (self.start - state['start']) * 1e6, 'dur': (end - self.start) * 1e6,
+                'pid': os.getpid(), 'tid': thread.ident, 'args': self.args })
+        return False
+
+    # for the spans not fitting in a with block.
+    def end(self):
+        self.__exit__(None, None, None)
+
+class nothing():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def end(self):
+        pass
+
+idle = nothing()
+
+# a span of the block, as `with trace('name', path = ...):`.
+def trace(name: str, **args):
+    if state['events'] is None: return idle
+    return span(name, False, args)
+
+# a span of the phase, profiled with --profile. begin and end it by hand as
+# `phase = begin('name')` ... `phase.end()`.
+def begin(name: str, **args):
+    if not enabled(): return idle
+    return span(name, True, args).__enter__()
+
+# wrap the function in a span (of a phase if it is one), or leave it as it is
+# when neither tracing, profiling nor collecting the metrics.
+def traced(name: str, phase: bool = False):
+    def wrap(func):
+        if not enabled(): return func
+
+        def call(*args, **kwargs):
+            with span(name, phase, {}): return func(*args, **kwargs)
+        return call
+    return wrap
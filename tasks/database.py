@@ -13,15 +13,26 @@ import hashlib
 from shared.configuration import get_interfaces, load_interface, remove_duplicate
 from shared.ansi import error, print_message, warning, info, line_start, fill_blank, \
                         common_length, fore_green, fore_red, ansi_reset, \
-                        ansi_move_cursor, format_file_size, fore_yellow
-from shared.local import move_local, copy_local
+                        ansi_move_cursor, format_file_size, fore_yellow, confirm
+from shared.local import move_local, copy_local, report_copies
 from shared.getch import getch
+from shared.trace import traced
+import shared.agent
+import shared.cache
+import shared.compress
+import shared.governor
+import shared.metrics
 
 required_args = [
     'dbname',
     'y'
 ]
 
+optional_args = shared.cache.optional_args + shared.governor.optional_args + \
+                shared.agent.optional_args + shared.metrics.optional_args + [
+    'compress',   # compress the dumps with zlib, bz2 or lzma[:level]
+]
+
 def get_required_interfaces(app):
     # for every registered interface, there need to be one provider selected.
     interfaces = get_interfaces(app, 'database')
@@ -59,6 +70,7 @@ def init(app, providers: dict, kwargs: dict):
     record_remote = conf_dir + '/database.remote'
     record_backup = conf_dir + '/database.backup'
     temp_db_backup = conf_dir + '/database.backup.sql'
+    temp_db_packed = conf_dir + '/database.sql.packed'
 
     remote_checksum = '/database.{}.checksum.tsv'.format(kwargs['dbname'])
     remote_file = '/database.{}.sql'.format(kwargs['dbname'])
@@ -72,8 +84,13 @@ def init(app, providers: dict, kwargs: dict):
     upload_rel = intfs['oss']['upload-rel']
     move_remote = intfs['oss']['remote-move']
     copy_remote = intfs['oss']['remote-copy']
-    dump_db = intfs['db']['dump']
-    import_db = intfs['db']['import']
+    list_remote = intfs['oss']['list']
+    dump_db = traced('dump', phase = True)(intfs['db']['dump'])
+    import_db = traced('import', phase = True)(intfs['db']['import'])
+
+    cache = shared.cache.init(app, kwargs)
+    governor = shared.governor.get(app, kwargs)
+    codec, codec_level = shared.compress.parse_setting(kwargs.get('compress', '<not-set>'))
 
     def read_checksums(path: str):
         cont = ''
@@ -81,8 +98,9 @@ def init(app, providers: dict, kwargs: dict):
         with open(path, 'r') as f:
             cont = f.read().replace('\n', '').replace('\r', '')
         
+        # the optional fifth column is the codec of the remote dump.
         arr = cont.split('\t')
-        if len(arr) != 4: return False
+        if len(arr) != 4 and len(arr) != 5: return False
         return (
             arr[0],          # hash summary
             int(arr[1]),     # size
@@ -90,7 +108,15 @@ def init(app, providers: dict, kwargs: dict):
             float(arr[3])    # last sync time
         )
     
-    def write_checksums(dump: str, to_file: str):
+    def read_codec(path: str):
+        with open(path, 'r') as f:
+            arr = f.read().replace('\n', '').replace('\r', '').split('\t')
+        
+        if len(arr) == 5 and arr[4] != 'none': return arr[4]
+        return None
+
+    @traced('checksum', phase = True)
+    def write_checksums(dump: str, to_file: str, dump_codec = None):
         
         outs = False
         if os.path.exists(to_file): os.remove(to_file)
@@ -100,8 +126,14 @@ def init(app, providers: dict, kwargs: dict):
             md5 = hashlib.md5(b'').hexdigest()
 
             with open(dump, 'rb') as dumpfb:
-                content = dumpfb.read()
-                md5 = hashlib.md5(content).hexdigest()
+                digest = hashlib.md5()
+                while True:
+                    content = dumpfb.read(1024 * 1024)
+                    if len(content) == 0: break
+                    governor.disk(len(content))
+                    digest.update(content)
+                
+                md5 = digest.hexdigest()
             
             outs = [
                 md5,
@@ -113,9 +145,49 @@ def init(app, providers: dict, kwargs: dict):
             f.write('{}\t{}\t{:.3f}\t{:.3f}'.format(
                 md5, outs[1], outs[2], outs[3]
             ))
+            shared.metrics.count('files', 1, stage = 'hashing')
+            shared.metrics.count('bytes', outs[1], stage = 'hashing')
+
+            if dump_codec is not None:
+                f.write('\t{}'.format(dump_codec))
 
         return outs
 
+    # upload the dump, compressed if it is enabled. the codec has already been
+    # written into the checksum by write_checksums.
+    @traced('upload', phase = True)
+    def upload_dump():
+
+        shared.metrics.count('files', 1, stage = 'uploading')
+        if codec is None:
+            shared.metrics.count('bytes', os.path.getsize(temp_db_dump), stage = 'uploading')
+            upload_abs(temp_db_dump, remote_file)
+            return
+        
+        shared.compress.compress_file(temp_db_dump, temp_db_packed, codec, codec_level,
+                                      governor.workers())
+        shared.metrics.count('bytes', os.path.getsize(temp_db_packed), stage = 'uploading')
+        upload_abs(temp_db_packed, remote_file)
+        os.remove(temp_db_packed)
+
+    # download the remote dump into the temporary dump, decompressing it if
+    # the remote checksum says it is compressed.
+    @traced('download', phase = True)
+    def download_dump():
+
+        remote_codec = read_codec(record_remote)
+        downloaded = temp_db_dump if remote_codec is None else temp_db_packed
+        download_abs(remote_file, downloaded)
+        if os.path.exists(downloaded):
+            shared.metrics.count('files', 1, stage = 'downloading')
+            shared.metrics.count('bytes', os.path.getsize(downloaded), stage = 'downloading')
+        if remote_codec is None: return
+        
+        if os.path.exists(temp_db_packed):
+            shared.compress.decompress_file(temp_db_packed, temp_db_dump,
+                                            governor.workers())
+            os.remove(temp_db_packed)
+
     def push():
 
         dump_db(temp_db_dump)
@@ -123,7 +195,7 @@ def init(app, providers: dict, kwargs: dict):
         if not os.path.exists(temp_db_dump):
             error('the dump task failed. for {}'.format(temp_db_dump))
 
-        c_current = write_checksums(temp_db_dump, record_current)
+        c_current = write_checksums(temp_db_dump, record_current, codec)
         if c_current == False:
             error('cannot generate local checksum.')
         
@@ -133,7 +205,7 @@ def init(app, providers: dict, kwargs: dict):
         if not os.path.exists(record_remote):
             
             # there is no remote checksum, the initial commit.
-            upload_abs(temp_db_dump, remote_file)
+            upload_dump()
             upload_abs(record_current, remote_checksum)
 
             if os.path.exists(record_lastlocal):
@@ -176,7 +248,7 @@ def init(app, providers: dict, kwargs: dict):
                     else:
 
                         # push
-                        upload_abs(temp_db_dump, remote_file)
+                        upload_dump()
                         upload_abs(record_current, remote_checksum)
 
                         if os.path.exists(record_lastlocal):
@@ -187,12 +259,11 @@ def init(app, providers: dict, kwargs: dict):
                 if not os.path.exists(record_lastlocal):
                     warning('You have never pushed once on the local machine, yet the remote file')
                     warning('has already existed. You must ensure you\'d like to overwrite the remote.')
-                    answ = input('Are you sure to overwrite remote database? [y/n] > ')
-
-                    if answ == 'y':
+                    if confirm('Are you sure to overwrite remote database? [y/n] > ',
+                               kwargs.get('y', False)):
 
                         # push
-                        upload_abs(temp_db_dump, remote_file)
+                        upload_dump()
                         upload_abs(record_current, remote_checksum)
 
                         if os.path.exists(record_lastlocal):
@@ -237,12 +308,11 @@ def init(app, providers: dict, kwargs: dict):
                         time.strftime('%Y-%m-%d %H:%M', time.localtime(ll_mtime))
                     ))
 
-                    answ = input('Are you sure to overwrite remote database? [y/n] > ')
-
-                    if answ == 'y':
+                    if confirm('Are you sure to overwrite remote database? [y/n] > ',
+                               kwargs.get('y', False)):
 
                         # push
-                        upload_abs(temp_db_dump, remote_file)
+                        upload_dump()
                         upload_abs(record_current, remote_checksum)
 
                         if os.path.exists(record_lastlocal):
@@ -255,10 +325,14 @@ def init(app, providers: dict, kwargs: dict):
 
         if os.path.exists(temp_db_dump):
             os.remove(temp_db_dump)
-        pass
+        governor.report()
 
     def fetch():
         
+        if kwargs.get('at', '<not-set>') != '<not-set>':
+            warning('the database task keeps no snapshots, --at is not supported.')
+            return
+
         download_abs(remote_checksum, record_remote)
         
         if not os.path.exists(record_remote):
@@ -341,9 +415,8 @@ def init(app, providers: dict, kwargs: dict):
                 time.strftime('%Y-%m-%d %H:%M', time.localtime(r_mtime))
             ))
 
-            answ = input('\nAre you sure to drop and overwrite local database? [y/n] > ')
-
-            if answ == 'y':
+            if confirm('\nAre you sure to drop and overwrite local database? [y/n] > ',
+                       kwargs.get('y', False)):
                 
                 if os.path.exists(record_lastlocal):
                     os.remove(record_lastlocal)
@@ -353,8 +426,16 @@ def init(app, providers: dict, kwargs: dict):
                     os.remove(temp_db_backup)
                 copy_local(temp_db_dump, temp_db_backup)
 
-                download_abs(remote_file, temp_db_dump)
+                # the dump may have been fetched already by another task or
+                # an earlier fetch on this machine.
+                if not cache['restore'](r_hash, r_size, temp_db_dump):
+                    download_dump()
+                    if os.path.exists(temp_db_dump):
+                        cache['store'](temp_db_dump, r_hash, r_size)
+                
                 import_db(temp_db_dump)
+                cache['flush']()
+                report_copies()
 
                 info('You have overwritten the local database.')
                     
@@ -362,7 +443,7 @@ def init(app, providers: dict, kwargs: dict):
 
         if os.path.exists(temp_db_dump):
             os.remove(temp_db_dump)
-        pass
+        governor.report()
 
     def diff():
         
@@ -469,10 +550,66 @@ def init(app, providers: dict, kwargs: dict):
 
         if os.path.exists(temp_db_dump):
             os.remove(temp_db_dump)
-        pass
+        governor.report()
+
+    # audit the remote dump against the remote checksum without downloading 
+    # it. the length and md5 of an uncompressed dump are known from the 
+    # checksum, while a compressed one can only be checked for existence. with
+    # 'repair', the dump is uploaded again if the local database still dumps
+    # to the same content.
+    def verify():
+
+        download_abs(remote_checksum, record_remote)
+        if not os.path.exists(record_remote):
+            error('the remote is not initialized. you should push your initial commit first')
+        c_remote = read_checksums(record_remote)
+        if c_remote == False:
+            error('invalid format for {}'.format(record_remote))
+        r_hash, r_size, r_mtime, r_sync = c_remote
+        remote_codec = read_codec(record_remote)
+
+        listed = list_remote(remote_file)
+        problem = None
+        if not remote_file in listed.keys(): problem = 'missing'
+        elif remote_codec is None:
+            osize, etag, _ = listed[remote_file]
+            if osize < r_size: problem = 'truncated'
+            elif osize != r_size: problem = 'mismatched'
+            elif etag != '' and not '-' in etag and etag.lower() != r_hash.lower(): 
+                problem = 'mismatched'
+
+        if problem is None:
+            info('The remote dump is intact.')
+            governor.report()
+            return
+        
+        warning('The remote dump {} is {}.'.format(remote_file, problem))
+        if not kwargs.get('repair', False):
+            info('Run `verify --repair` to upload the dump again.')
+            governor.report()
+            return
+        
+        dump_db(temp_db_dump)
+        c_current = write_checksums(temp_db_dump, record_current)
+        if c_current == False:
+            error('cannot generate local checksum.')
+        
+        # the dump is uploaded in the form the remote checksum tells.
+        if c_current[0] != r_hash or remote_codec != codec:
+            warning('The local database has changed since, or the compression setting differs.')
+            warning('Push to upload a new dump instead.')
+        
+        else:
+            upload_dump()
+            info('The dump has been uploaded again.')
+
+        if os.path.exists(temp_db_dump):
+            os.remove(temp_db_dump)
+        governor.report()
 
     return {
         'fetch': fetch,
         'push': push,
-        'diff': diff
+        'diff': diff,
+        'verify': verify
     }
\ No newline at end of file
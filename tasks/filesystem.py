@@ -16,20 +16,52 @@
 import copy
 import os
 import time
-import hashlib
-
-from shared.configuration import get_interfaces, load_interface, remove_duplicate
+import threading
+import fnmatch
+import calendar
+import zlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from shared.configuration import get_interfaces, load_interface, remove_duplicate, \
+                                 parse_file_size, parse_duration, parse_time, \
+                                 get_conf_dir, read_targets
 from shared.ansi import error, print_message, warning, info, line_start, fill_blank, \
                         common_length, fore_green, fore_red, ansi_reset, \
-                        ansi_move_cursor
-from shared.local import move_local, copy_local
+                        ansi_move_cursor, route_output, format_file_size, \
+                        interactive, confirm
+from shared.local import move_local, copy_local, report_copies
 from shared.getch import getch
+from shared.trace import trace, traced, begin
+import shared.agent
+import shared.cache
+import shared.archive
+import shared.bundle
+import shared.compress
+import shared.digest
+import shared.governor
+import shared.metrics
+import shared.plan
+import shared.progress
 
 required_args = [
     'dest',
     'y'
 ]
 
+optional_args = shared.cache.optional_args + shared.governor.optional_args + \
+                shared.agent.optional_args + shared.metrics.optional_args + [
+    'bundle-threshold',   # files smaller than this are packed into bundles
+    'bundle-size',        # the target size of the bundles, 16M by default
+    'compress',           # compress uploads with zlib, bz2 or lzma[:level]
+    'mirrors',            # other filesystem tasks to push to at the same time
+    'gc-retention',       # unreferenced objects younger than this are kept, 7d by default
+    'gc-keep',            # comma-separated patterns of objects gc never removes
+    'snapshot-keep',      # gc keeps the snapshots of this long, 30d by default
+    'archive-size',       # the target size of the bootstrap archives, 1G by default
+    'conditional-put',    # how aliyun oss creates the catalog generations, check or oss2
+]
+
 def get_required_interfaces(app):
     # for every registered interface, there need to be one provider selected.
     interfaces = get_interfaces(app, 'filesystem')
@@ -46,6 +78,10 @@ def get_required_args(app, providers: dict):
     
     return remove_duplicate(args)
 
+# the remote catalogs read last in this process, as (generation, content) keyed
+# by the settings locating the remote. see read_remote_checksum.
+catalogs = {}
+
 def init(app, providers: dict, kwargs: dict):
 
     intfs = {}
@@ -74,16 +110,106 @@ def init(app, providers: dict, kwargs: dict):
     remote_chksum = conf_dir + '/filesystem.remote'
     current_chksum = conf_dir + '/filesystem.current'
     last_local_chksum = conf_dir + '/filesystem.last-local'
+    journal_file = conf_dir + '/filesystem.journal'
 
     download_abs = intfs['oss']['download-abs']
     download_rel = intfs['oss']['download-rel']
+    download_range = intfs['oss']['download-range']
+    download_stream = intfs['oss']['download-stream']
     upload_abs = intfs['oss']['upload-abs']
     upload_rel = intfs['oss']['upload-rel']
     move_remote = intfs['oss']['remote-move']
     copy_remote = intfs['oss']['remote-copy']
+    list_remote = intfs['oss']['list']
+    delete_remote = intfs['oss']['delete']
+    create_remote = intfs['oss']['create']
+
+    cache = shared.cache.init(app, kwargs)
+    governor = shared.governor.get(app, kwargs)
+
+    bundle_threshold = parse_file_size(kwargs.get('bundle-threshold', '<not-set>'), 0)
+    bundle_size = parse_file_size(kwargs.get('bundle-size', '<not-set>'), 16 * 1024 * 1024)
+    codec, codec_level = shared.compress.parse_setting(kwargs.get('compress', '<not-set>'))
+    compress_temp = conf_dir + '/compress.part'
+
+    # downloads are written next to their destination under this suffix, and
+    # renamed into place once verified.
+    part_suffix = '.sync-part'
+
+    gc_retention = parse_duration(kwargs.get('gc-retention', '<not-set>'), 7 * 86400)
+    gc_keep = kwargs.get('gc-keep', '<not-set>')
+    gc_keep = ['/database.*'] if gc_keep == '<not-set>' else \
+              [x.strip() for x in gc_keep.split(',') if x.strip() != '']
+    gc_batch = 100
+
+    snapshot_dir = '/.snapshots'
+    version_dir = '/.versions'
+    snapshot_keep = parse_duration(kwargs.get('snapshot-keep', '<not-set>'), 30 * 86400)
+    snapshot_full_every = 32
+
+    archive_size = parse_file_size(kwargs.get('archive-size', '<not-set>'), 1024 ** 3)
 
     manual_zero_md5 = 'd41d8cd98f00b204e9800998ecf8427e'
 
+    # the remote entries a lazy fetch has not downloaded yet, see get.
+    lazy_file = conf_dir + '/filesystem.lazy'
+
+    # the published generations of the remote catalog, see publish_catalog.
+    catalog_dir = '/.catalogs'
+    catalog_file = '/filesystem.checksum.tsv'
+    publish_retries = 16
+
+    # the path prefixes or globs (relative to dest, starting with '/') that push,
+    # fetch and diff are limited to. see in_selection.
+    selection = kwargs.get('paths', '<not-set>')
+    if selection == '<not-set>' or not selection: selection = None
+    else: selection = ['/' + x.replace('\\', '/').lstrip('/') for x in selection]
+
+    # the part of the tree this push is responsible for, 'k/n' as the k-th of
+    # n partitions by the hash of the paths. see publish_partition.
+    partition = kwargs.get('partition', '<not-set>')
+    partition_dir = '/.partitions'
+    merge_timeout = 600
+    if partition == '<not-set>': partition = None
+    else:
+        try: partition = tuple([int(x) for x in partition.split('/')])
+        except ValueError: partition = ()
+        if len(partition) != 2 or not 1 <= partition[0] <= partition[1]:
+            error('invalid partition `{0}`. use like `2/4` for the second of four.'
+                  .format(kwargs['partition']))
+
+    # how the confirmations are answered without asking: 'ask' prompts (or
+    # takes the defaults without a terminal), the others answer all of them.
+    policies = {
+        'on-conflict': ['ask', 'local', 'remote'],
+        'on-move': ['ask', 'reuse', 'transfer'],
+        'on-remove': ['ask', 'delete', 'keep']
+    }
+
+    for key in policies.keys():
+        value = kwargs.get(key, '<not-set>')
+        if value == '<not-set>': value = 'ask'
+        if not value in policies[key]:
+            error('invalid --{0} `{1}`. choose from {2}.'.format(
+                  key, value, ', '.join(policies[key])))
+        policies[key] = value
+
+    # the answer to each kind of confirmation, when the policy decides it. the
+    # overwrites are answered from which side wins the conflict.
+    policy_answers = {
+        'overwrite-remote': ('on-conflict', {'local': True, 'remote': False}),
+        'overwrite-local': ('on-conflict', {'remote': True, 'local': False}),
+        'move': ('on-move', {'reuse': True, 'transfer': False}),
+        'copy': ('on-move', {'reuse': True, 'transfer': False}),
+        'remove': ('on-remove', {'delete': True, 'keep': False})
+    }
+
+    # a plan run ('plan') stops before any change and records the answers to
+    # the confirmations; an apply run ('apply') takes them from the plan. see
+    # plan and apply.
+    planning = { 'mode': None, 'decisions': [], 'answers': {} }
+    plan_file = kwargs.get('plan', '<not-set>')
+
     # try to get the remote checksum file. and returns a list of recorded columns
     # in the parsed checksum.
     #
@@ -91,64 +217,273 @@ def init(app, providers: dict, kwargs: dict):
     # initialized, or any other reason that the download failed. we assume that
     # the remote is empty and returns an empty but valid parse result.
 
+    @traced('remote catalog', phase = True)
     def read_remote_checksum():
 
         if (os.path.exists(remote_chksum)):
             os.remove(remote_chksum)
 
-        tsv = download_abs('/filesystem.checksum.tsv', remote_chksum)
-
-        if not os.path.exists(remote_chksum):
-            return [], [], [], [], []
+        # the latest generation, or the plain catalog of a bucket having none.
+        # a generation never changes once published, so the one read last by
+        # this process (e.g. the agent) is not downloaded again.
+        generation = latest_generation()
+        catalog['generation'] = generation
+        if generation > 0 and catalogs.get(catalog_source, (0, ''))[0] == generation:
+            with open(remote_chksum, 'w', encoding = 'utf-8') as fp:
+                fp.write(catalogs[catalog_source][1])
+        
+        elif generation > 0:
+            download_abs(catalog_object(generation), remote_chksum)
+            if os.path.exists(remote_chksum):
+                with open(remote_chksum, 'r', encoding = 'utf-8') as fp:
+                    catalogs[catalog_source] = (generation, fp.read())
+        
+        else: download_abs(catalog_file, remote_chksum)
+        
+        return read_checksum(remote_chksum)
+
+    # the remote catalog is published in generations, /.catalogs/<generation>.tsv,
+    # each created only if it does not exist yet. a push reads the latest one 
+    # as its base, and publishes the next one. if another push has published it
+    # in the meantime, the creation fails, and the changes made against the base
+    # are merged into the newer catalog and published again as the following
+    # generation. the latest catalog is also copied to /filesystem.checksum.tsv
+    # for the readers unaware of generations.
+
+    catalog = { 'generation': 0 }
+    catalog_source = repr([(x, kwargs.get(x)) for x in 
+                           sorted(get_required_args(app, kwargs))])
+
+    def catalog_object(generation):
+        return '{0}/{1:010d}.tsv'.format(catalog_dir, generation)
+
+    def latest_generation():
+        generations = [0]
+        for obj in list_remote(catalog_dir + '/').keys():
+            name = obj[len(catalog_dir) + 1:]
+            if name.endswith('.tsv') and name[:-4].isdigit():
+                generations += [int(name[:-4])]
+        return max(generations)
+
+    # publish the catalog lines as the next generation of the one read by 
+    # read_remote_checksum, merging them into the catalogs published by others
+    # in the meantime. returns the lines published.
+    @traced('publish', phase = True)
+    def publish_catalog(lines):
+
+        temp = conf_dir + '/catalog.part'
+        for _ in range(publish_retries):
+            generation = catalog['generation']
+            with open(temp, 'w', encoding = 'utf-8') as fp:
+                fp.writelines(lines)
+
+            if create_remote(temp, catalog_object(generation + 1)):
+                upload_abs(temp, catalog_file)
+                os.remove(temp)
+                catalog['generation'] = generation + 1
+                catalogs[catalog_source] = (generation + 1, ''.join(lines))
+                return lines
+            
+            base = read_checksum_lines(remote_chksum)
+            read_remote_checksum()
+            if catalog['generation'] <= generation: break
+
+            info('Generation {0} of the remote catalog has been published by another push, '
+                 'merging ...'.format(catalog['generation']))
+            merged, conflicts = merge_catalog(base, lines, read_checksum_lines(remote_chksum))
+            settle_conflicts(merged, conflicts)
+            lines = list(merged.values())
+
+        if os.path.exists(temp): os.remove(temp)
+        error('cannot publish the remote catalog after generation {0}.'
+              .format(catalog['generation']))
+
+    # apply the changes from the base to ours onto theirs. returns the merged
+    # lines by path, and the lines of theirs by path where both sides changed
+    # the same file differently (ours is taken there, see settle_conflicts).
+    def merge_catalog(base, ours, theirs):
+
+        base_map = {}
+        our_map = {}
+        merged = {}
+        for line in base: base_map[parse_line(line)[4]] = line
+        for line in ours: our_map[parse_line(line)[4]] = line
+        for line in theirs: merged[parse_line(line)[4]] = line
+
+        conflicts = {}
+        for path in our_map.keys():
+            if path in base_map.keys() and same_content(base_map[path], our_map[path]): 
+                continue
 
-        fp = open(remote_chksum, 'r', encoding = 'utf-8')
-        content = fp.read().splitlines()
+            if path in merged.keys() and not same_content(merged[path], our_map[path]) and \
+               not (path in base_map.keys() and same_content(base_map[path], merged[path])):
+                conflicts[path] = merged[path]
+            merged[path] = our_map[path]
+
+        # removed by us, unless they have changed it since.
+        for path in base_map.keys():
+            if path in our_map.keys() or not path in merged.keys(): continue
+            if same_content(base_map[path], merged[path]): merged.pop(path)
+
+        return merged, conflicts
+
+    # the files pushed by another machine at the same time as ours. the objects
+    # not bundled are stored under their paths, so the object of such a file
+    # may hold the content of either push, whichever was uploaded last. ours is
+    # uploaded again before the merged catalog is published, so that the object
+    # matches it. if the local file has changed since (or this node does not
+    # hold it), theirs is taken instead.
+    def settle_conflicts(merged, conflicts):
+
+        taken = []
+        kept = []
+        for path in conflicts.keys():
+            ihash, ilen, _, _, _, attrs = parse_line(merged[path])
+            if 'bundle' in attrs.keys():
+                taken += [path]
+                continue
 
-        hash_num = []
-        file_length = []
-        last_modified = []
-        last_sync = []
-        file_path = []
+            local = kwargs['dest'] + path
+            if os.path.isfile(local) and os.path.getsize(local) == ilen and \
+               shared.digest.hash_file(local, ilen, governor) == ihash:
+                stored = upload_compressed(path)
+                if stored is None: upload_rel(path, path)
+                merged[path] = with_attrs(merged[path], stored)
+                taken += [path]
+            
+            else:
+                merged[path] = conflicts[path]
+                kept += [path]
 
-        for line in content:
-            ihash, ilen, mtime, stime, ipath = line.split('\t')
-            hash_num += [ihash]
-            file_length += [int(ilen)]
-            last_modified += [float(mtime)]
-            last_sync += [float(stime)]
-            file_path += [ipath]
+        if len(taken) > 0:
+            warning('{0} files are pushed by another machine at the same time, the '
+                    'versions from here are taken and uploaded again:'.format(len(taken)))
+            for path in taken: print_message('\033[1;33m', '!', path, False)
 
-        return hash_num, file_length, last_modified, last_sync, file_path
+        if len(kept) > 0:
+            warning('{0} files are pushed by another machine at the same time, and have '
+                    'changed here since. the versions of the other machine are kept:'
+                    .format(len(kept)))
+            for path in kept: print_message('\033[1;33m', '!', path, False)
 
     # get the current checksum. if there is not any, returns an empty set.
     # this method SHOULD ONLY BE CALLED from build_local_checksum()
 
     # read from 'filesystem.last-local'
 
+    @traced('last local catalog')
     def read_local_last_checksum():
 
-        if not os.path.exists(last_local_chksum):
-            return [], [], [], [], []
+        hash_num, file_length, last_modified, last_sync, file_path, _ = \
+            read_checksum(last_local_chksum)
+        return hash_num, file_length, last_modified, last_sync, file_path
+
+    # each line of the checksum catalogs is tab-delimited as (hash, length, 
+    # last modified, last sync, path), and optionally followed by 'key=value'
+    # columns telling how the remote stores the file. e.g. 'bundle=...' if
+    # the file is packed into a bundle object rather than stored at its path.
+    # the attributes are returned as a dictionary of path to their dictionary.
+
+    def read_checksum(path):
 
-        fp = open(last_local_chksum, 'r', encoding = 'utf-8')
+        if not os.path.exists(path):
+            return [], [], [], [], [], {}
+
+        fp = open(path, 'r', encoding = 'utf-8')
         content = fp.read().splitlines()
+        fp.close()
 
         hash_num = []
         file_length = []
         last_modified = []
         last_sync = []
         file_path = []
+        attributes = {}
 
         for line in content:
-            ihash, ilen, mtime, stime, ipath = line.split('\t')
+            ihash, ilen, mtime, stime, ipath, attrs = parse_line(line)
             hash_num += [ihash]
-            file_length += [int(ilen)]
-            last_modified += [float(mtime)]
-            last_sync += [float(stime)]
+            file_length += [ilen]
+            last_modified += [mtime]
+            last_sync += [stime]
             file_path += [ipath]
+            if len(attrs) > 0: attributes[ipath] = attrs
 
-        return hash_num, file_length, last_modified, last_sync, file_path
+        return hash_num, file_length, last_modified, last_sync, file_path, attributes
+
+    def parse_line(line):
+        splits = line.replace('\n', '').split('\t')
+        attrs = {}
+        for attr in splits[5:]:
+            key, val = attr.split('=', 1)
+            attrs[key] = val
+        
+        return splits[0], int(splits[1]), float(splits[2]), float(splits[3]), \
+               splits[4], attrs
+
+    def format_line(ihash, ilen, mtime, stime, ipath, attrs = None):
+        line = '{0}\t{1}\t{2}\t{3}\t{4}'.format(ihash, ilen, mtime, stime, ipath)
+        if attrs:
+            line += ''.join(['\t{0}={1}'.format(k, attrs[k]) for k in attrs.keys()])
+        return line + '\n'
+
+    # replace the attributes of a catalog line.
+    def with_attrs(line, attrs):
+        ihash, ilen, mtime, stime, ipath, _ = parse_line(line)
+        return format_line(ihash, ilen, mtime, stime, ipath, attrs)
     
+    # the transfer journal. every upload or download is recorded right after it
+    # completes, as 'U' or 'D' followed by the catalog line of the file. it is
+    # removed once the catalog has been written, so a journal left behind means
+    # the last push or fetch was interrupted. the next run skips the uploads
+    # already recorded, and reuses the recorded hashes instead of rehashing.
+
+    journal = { 'fp': None, 'lock': threading.Lock() }
+
+    def read_journal():
+
+        entries = {}
+        if not os.path.exists(journal_file): return entries
+
+        with open(journal_file, 'r', encoding = 'utf-8') as fp:
+            content = fp.read()
+
+        # the last record may be torn if the process died while writing it.
+        lines = content.splitlines()
+        if not content.endswith('\n'): lines = lines[:-1]
+
+        for line in lines:
+            kind, _, cline = line.partition('\t')
+            entries[parse_line(cline)[4]] = (kind, cline + '\n')
+
+        return entries
+
+    def record_journal(kind, line):
+        with journal['lock']:
+            if journal['fp'] is None:
+                journal['fp'] = open(journal_file, 'a', encoding = 'utf-8')
+            
+            journal['fp'].write('{0}\t{1}'.format(kind, line))
+            journal['fp'].flush()
+
+    def clear_journal():
+        if journal['fp'] is not None:
+            journal['fp'].close()
+            journal['fp'] = None
+
+        if os.path.exists(journal_file):
+            os.remove(journal_file)
+
+    # the catalog line recorded in the journal by an interrupted upload of the
+    # same content, or none.
+    def journaled_upload(journaled, local_file, lline):
+        if not local_file in journaled.keys(): return None
+
+        kind, jline = journaled[local_file]
+        if kind == 'U' and parse_line(jline)[:2] == parse_line(lline)[:2]:
+            return jline
+        return None
+
     # build the local file index dictionary and calculate the hash numbers
     # it do not require there is a local checksum already, it tries to read the
     # local checksum first simply because it want to detect which files are
@@ -157,9 +492,26 @@ def init(app, providers: dict, kwargs: dict):
     # build to 'filesystem.current'. this file should be copied to '.last-local'
     # only after a success push.
 
+    @traced('scan', phase = True)
     def build_local_checksum():
 
         local_h, local_l, local_t, local_st, local_p = read_local_last_checksum()
+
+        # the files transferred by an interrupted run are known as well.
+        journaled = read_journal()
+        for path in journaled.keys():
+            ihash, ilen, mtime, stime, _, _ = parse_line(journaled[path][1])
+            if path in local_p:
+                index = local_p.index(path)
+                local_h[index] = ihash; local_l[index] = ilen
+                local_t[index] = mtime; local_st[index] = stime
+            else:
+                local_h += [ihash]; local_l += [ilen]
+                local_t += [mtime]; local_st += [stime]; local_p += [path]
+
+        if len(journaled) > 0:
+            info('Resuming the interrupted transfers of {0} files.'.format(len(journaled)))
+
         info('Building local hash checksums ...')
 
         last_modified = []
@@ -173,8 +525,10 @@ def init(app, providers: dict, kwargs: dict):
 
         ignore_marks = []
         sync_dir = kwargs['dest']
+        meter = shared.progress.progress('Hashing')
+        hashed = 0
 
-        for root, _, files in os.walk(sync_dir, topdown = True):
+        for root, files in walk_selection(sync_dir):
 
             if '.ignore' in files:
                 ignore_marks += [root.replace(sync_dir, '').replace('\\', '/')]
@@ -191,8 +545,13 @@ def init(app, providers: dict, kwargs: dict):
 
             for file in files:
 
+                # left by an interrupted download.
+                if file.endswith(part_suffix): continue
+
                 absolute_path = os.path.join(root, file)
                 relative_path = absolute_path.replace(sync_dir, '').replace('\\', '/')
+                if not in_scope(relative_path): continue
+                
                 file_path += [relative_path]
                 file_name += [file]
 
@@ -205,9 +564,6 @@ def init(app, providers: dict, kwargs: dict):
                 file_length += [leng]
 
                 current_time = time.time()
-                
-                line_start()
-                fill_blank(80, relative_path)
 
                 # if exactly the same, we assume it, and skip reading the file 
                 # content for calculations of md5. since most files do not change.
@@ -229,44 +585,26 @@ def init(app, providers: dict, kwargs: dict):
                             relative_path
                         )]
 
+                        meter.advance(relative_path)
                         continue
                     
                 # calculate content md5 identifier and file content length as the
                 # unique identifier for the file
 
-                fp = open(absolute_path, 'rb')
-                md5x = ''
-                fp.seek(0)
-
-                # for files < 10M, it would be better to digest it all.
-                if leng < 1024 * 1024 * 10:
-                    content = fp.read()
-                    md5x = hashlib.md5(content).hexdigest()
-
-                else:
-                    for x in range(leng // (1024 * 1024)):
-                        fp.seek(x * 1024 * 1024)
-                        content = fp.read(1024 * 1024) # strictly by v7.
-                        md5x += hashlib.md5(content).hexdigest()
-                    
-                    # the last section smaller than 1 MiB.
-
-                    fp.seek((leng // (1024 * 1024)) * 1024 * 1024)
-                    content = fp.read()
-                    md5x += hashlib.md5(content).hexdigest()
-
-                    md5x = hashlib.md5(md5x.encode('utf-8')).hexdigest()
-
+                with trace('hash', path = relative_path):
+                    md5x = shared.digest.hash_file(absolute_path, leng, governor)
+                hashed += 1
                 hash_num += [md5x]
                 gen_time += [current_time]
-                fp.close()
 
                 lines += ['{0}\t{1}\t{2}\t{3}\t{4}\n'.format(
                     md5x, leng, tm_last, current_time, relative_path
                 )]
+                meter.advance(relative_path, leng)
 
         for ignore_dir in ignore_marks:
             
+            if not in_scope(ignore_dir + '/.ignore'): continue
             file_path += [ignore_dir + '/.ignore']
             file_name += ['.ignore']
             hash_num += [manual_zero_md5]
@@ -297,8 +635,10 @@ def init(app, providers: dict, kwargs: dict):
                 ignore_dir + '/.ignore'
             )]
 
-        print('')
-        info('Sync checksum built.')
+        meter.close()
+        shared.metrics.count('hashed_files', hashed)
+        info('Sync checksum built. {0} files, {1} hashed.'.format(
+             meter.files, format_file_size(meter.bytes)))
 
         if (os.path.exists(current_chksum)):
             os.remove(current_chksum)
@@ -309,14 +649,506 @@ def init(app, providers: dict, kwargs: dict):
 
         return hash_num, file_length, last_modified, gen_time, file_path
 
-    def push():
+    # upload the files (relative path, catalog line) collected by push, and
+    # returns their catalog lines. files smaller than the bundle threshold are
+    # packed into bundles, and their lines get the 'bundle' attribute.
 
-        l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = \
-            build_local_checksum()
+    @traced('upload', phase = True)
+    def upload_pending(pending):
+
+        lines = []
+        bundled = {}
+        packer = None
+        journaled = read_journal()
+
+        def sealed(locations):
+            for local_file in locations.keys():
+                line = with_attrs(bundled[local_file], { 'bundle': locations[local_file] })
+                record_journal('U', line)
+                lines.append(line)
+
+        if bundle_threshold > 0:
+            packer = shared.bundle.packer(conf_dir + '/bundle.part', 
+                                          bundle_size, upload_abs, sealed)
+
+        meter = shared.progress.progress('Uploading', len(pending), 
+                                         sum([parse_line(x[1])[1] for x in pending]))
+        for local_file, lline in pending:
+            meter.advance(local_file, parse_line(lline)[1])
+
+            # uploaded already by the interrupted run.
+            jline = journaled_upload(journaled, local_file, lline)
+            if jline is not None:
+                lines += [jline]
+                continue
+
+            if packer is not None and parse_line(lline)[1] < bundle_threshold:
+                packer.add_file(local_file, kwargs['dest'] + local_file)
+                bundled[local_file] = lline
+                continue
+
+            stored = upload_compressed(local_file)
+            if stored is not None: lline = with_attrs(lline, stored)
+            else: upload_rel(local_file, local_file)
+            
+            record_journal('U', lline)
+            lines += [lline]
+
+        if packer is not None: packer.close()
+        meter.close()
+
+        if len(bundled) > 0:
+            info('{0} small files packed into {1} bundles.'.format(
+                 len(bundled), len(packer.bundles)))
+
+        return lines
+
+    # upload the compressed form of a file, if compression is enabled and the
+    # file is worth it. returns the catalog attributes of the stored object, 
+    # the codec, and the length and md5 of the object for `verify`. returns
+    # none if the file should be uploaded as is.
+
+    def upload_compressed(local_file):
+
+        absolute_path = kwargs['dest'] + local_file
+        if codec is None or os.path.getsize(absolute_path) < 512 or \
+           not shared.compress.should_compress(absolute_path):
+            return None
+
+        packed = shared.compress.compress_file(absolute_path, compress_temp, 
+                                               codec, codec_level, governor.workers())
+        
+        # incompressible contents.
+        if packed >= os.path.getsize(absolute_path):
+            os.remove(compress_temp)
+            return None
+        
+        stored = { 'codec': codec, 'osize': packed, 
+                   'omd5': shared.digest.md5_file(compress_temp) }
+        upload_abs(compress_temp, local_file)
+        os.remove(compress_temp)
+        return stored
+
+    # repack the live members of the bundles that are mostly dead (less than 
+    # half of their length is still referenced by the catalog lines) into new 
+    # bundles. the replaced lines are put into repacked, keyed by their index.
+    #
+    # others are the catalog lines not pushed by this run (out of the scope of
+    # --path or --partition, or not fetched yet by a lazy fetch). they are not
+    # repacked, but their members keep the bundles alive.
+
+    @traced('repack')
+    def repack_bundles(lines, repacked, others = []):
+
+        members = {}
+        for ind in range(len(lines)):
+            attrs = parse_line(lines[ind])[5]
+            if not 'bundle' in attrs.keys(): continue
+
+            name, offset, length = shared.bundle.parse_location(attrs['bundle'])
+            if not name in members.keys(): members[name] = {}
+            if not (offset, length) in members[name].keys():
+                members[name][(offset, length)] = []
+            members[name][(offset, length)] += [ind]
+
+        elsewhere = {}
+        for line in others:
+            attrs = parse_line(line)[5]
+            if not 'bundle' in attrs.keys(): continue
+
+            name, offset, length = shared.bundle.parse_location(attrs['bundle'])
+            if not name in members.keys(): continue
+            if not name in elsewhere.keys(): elsewhere[name] = set()
+            elsewhere[name].add((offset, length))
+
+        dead = []
+        for name in members.keys():
+            live = sum([length for _, length in 
+                        set(members[name].keys()) | elsewhere.get(name, set())])
+            if live * 2 < shared.bundle.bundle_length(name):
+                dead += [name]
+
+        if len(dead) == 0: return
+
+        temp = conf_dir + '/bundle.old'
+        packer = shared.bundle.packer(conf_dir + '/bundle.repack', 
+                                      bundle_size, upload_abs)
+        
+        for name in dead:
+            download_abs(shared.bundle.bundle_object(name), temp)
+            if not os.path.exists(temp): continue
+
+            with open(temp, 'rb') as fp:
+                content = fp.read()
+            os.remove(temp)
+            if len(content) != shared.bundle.bundle_length(name): continue
+
+            for offset, length in members[name].keys():
+                packer.add((name, offset, length), content[offset : offset + length])
+
+        locations = packer.close()
+        for name, offset, length in locations.keys():
+            for ind in members[name][(offset, length)]:
+                attrs = parse_line(lines[ind])[5]
+                attrs['bundle'] = locations[(name, offset, length)]
+                repacked[ind] = with_attrs(lines[ind], attrs)
+
+    # download the remote catalog lines collected by fetch, and returns the
+    # catalog lines of the files placed, with the modified time as it is on
+    # disk. the local blob cache is looked up first, and the downloaded files
+    # are kept in the cache for later use.
+    #
+    # the content is downloaded from the 'object' attribute of the lines if it
+    # is given (by a restore, see fetch_at), and from their paths otherwise.
+    #
+    # every download is written to a temporary file next to its destination,
+    # and its checksum is taken while it streams in (by the provider, through
+    # decompression, or from full bundle reads). only the members read by
+    # ranges are read back, from the page cache right after. only a file matching the remote catalog
+    # is renamed into place. the others are left untouched and reported.
+
+    @traced('download', phase = True)
+    def download_pending(pending, meter = None):
+
+        sync_dir = kwargs['dest']
+        own_meter = meter is None
+        if own_meter:
+            meter = shared.progress.progress('Downloading', len(pending), 
+                                             sum([parse_line(x)[1] for x in pending]))
+
+        members = {}
+        remote_lines = {}
+        lines = []
+        failed = []
+
+        # the temporary files are per thread, as get downloads in parallel.
+        thread_temp = '{0}.{1}'.format(compress_temp, threading.get_ident())
+
+        for rline in pending:
+            r_hash, r_size, r_mtime, _, remote_file, attrs = parse_line(rline)
+            local = sync_dir + remote_file
+            
+            # the cached blobs had been verified when they were stored.
+            if cache['restore'](r_hash, r_size, local):
+                lines += [settle_download(rline)]
+                meter.advance(remote_file, r_size)
+                continue
+                
+            # bundle members are read after all others, grouped by bundle.
+            if 'bundle' in attrs.keys():
+                name, offset, length = shared.bundle.parse_location(attrs['bundle'])
+                if not name in members.keys(): members[name] = []
+                members[name] += [(remote_file, offset, length, r_hash, r_size)]
+                remote_lines[remote_file] = rline
+                continue
+
+            if not os.path.exists(os.path.dirname(local)):
+                os.makedirs(os.path.dirname(local))
+            
+            # compressed objects are decompressed transparently.
+            checksum = None
+            if 'codec' in attrs.keys():
+                digest = shared.digest.hasher(r_size)
+                download_abs(attrs.get('object', remote_file), thread_temp)
+                shared.compress.decompress_file(thread_temp, local + part_suffix,
+                                                governor.workers(), digest.update)
+                os.remove(thread_temp)
+                checksum = digest.hexdigest()
+            
+            else:
+                digest = shared.digest.hasher(r_size)
+                download_stream(attrs.get('object', remote_file), local + part_suffix,
+                                digest.update)
+                checksum = digest.hexdigest()
+            
+            if place_verified(rline, checksum):
+                cache['store'](local, r_hash, r_size)
+                lines += [settle_download(rline)]
+            else: failed += [remote_file]
+            meter.advance(remote_file, r_size)
+
+        temp = '{0}/bundle.fetch.{1}'.format(conf_dir, threading.get_ident())
+        for name in members.keys():
+            
+            # when most of the bundle is needed, a single full read is cheaper
+            # than a ranged read for each of the members. if it fails, the 
+            # members are still tried by ranged reads.
+            needed = sum([x[2] for x in members[name]])
+            content = None
+            if len(members[name]) > 1 and needed * 2 >= shared.bundle.bundle_length(name):
+                download_abs(shared.bundle.bundle_object(name), temp)
+                if os.path.exists(temp):
+                    with open(temp, 'rb') as fp:
+                        content = fp.read()
+                    os.remove(temp)
+                if content is not None and len(content) != shared.bundle.bundle_length(name):
+                    content = None
+
+            for remote_file, offset, length, r_hash, r_size in members[name]:
+                local = sync_dir + remote_file
+                checksum = None
+
+                if not os.path.exists(os.path.dirname(local)):
+                    os.makedirs(os.path.dirname(local))
+
+                if content is None and length > 0:
+                    download_range(shared.bundle.bundle_object(name), local + part_suffix,
+                                   offset, offset + length - 1)
+                
+                else:
+                    data = b'' if content is None else content[offset : offset + length]
+                    digest = shared.digest.hasher(r_size)
+                    digest.update(data)
+                    checksum = digest.hexdigest()
+                    with open(local + part_suffix, 'wb') as fp:
+                        fp.write(data)
+
+                if place_verified(remote_lines[remote_file], checksum):
+                    cache['store'](local, r_hash, r_size)
+                    lines += [settle_download(remote_lines[remote_file])]
+                else: failed += [remote_file]
+                meter.advance(remote_file, r_size)
+        
+        if own_meter: meter.close()
+        if len(failed) > 0:
+            warning('{0} downloaded files do not match the remote catalog, and are left '
+                    'untouched:'.format(len(failed)))
+            for remote_file in failed: print_message('\033[1;31m', '!', remote_file, False)
+            print('')
+
+        return lines
+
+    # rename the downloaded temporary file of a remote catalog line into place 
+    # if it matches the catalog. checksum is the one taken during the download,
+    # or none to read it back from the temporary file.
+
+    def place_verified(rline, checksum = None):
+        r_hash, r_size, _, _, remote_file, _ = parse_line(rline)
+        local = kwargs['dest'] + remote_file
+        part = local + part_suffix
+
+        if not os.path.exists(part): return False
+
+        # the ignore marks are listed with zero length and hash whatever their
+        # actual content is.
+        is_mark = remote_file.endswith('/.ignore') and r_hash == manual_zero_md5
+
+        if not is_mark:
+            if os.path.getsize(part) != r_size:
+                os.remove(part)
+                return False
+            
+            if checksum is None:
+                checksum = shared.digest.hash_file(part, r_size, governor)
+            
+            if checksum != r_hash:
+                os.remove(part)
+                return False
+
+        os.replace(part, local)
+        return True
+
+    # stamp a placed file with the remote modified time, journal it, and returns
+    # its catalog line with the modified time as it is on disk. the next build of
+    # the local checksum will then find the file unchanged without reading it.
+    
+    def settle_download(rline):
+        r_mtime, remote_file = parse_line(rline)[2], parse_line(rline)[4]
+        os.utime(kwargs['dest'] + remote_file, (time.time(), r_mtime))
+        line = stamped_line(rline)
+        record_journal('D', line)
+        return line
+
+    # the catalog line with the modified time of the local file.
+    def stamped_line(rline):
+        r_hash, r_size, _, r_stime, remote_file, attrs = parse_line(rline)
+        file_stat = os.stat(kwargs['dest'] + remote_file)
+        attrs.pop('object', None)
+        return format_line(r_hash, r_size, file_stat.st_mtime, 
+                           r_stime, remote_file, attrs)
+
+    # catalog snapshots. every push keeps the catalog it writes as an immutable
+    # snapshot, /.snapshots/<utc time>.full.tsv, or more cheaply, as the changes
+    # since the previous catalog in /.snapshots/<utc time>.delta.tsv: a '+' and
+    # the catalog line of each added or changed file, and a '-' and the path of
+    # each removed one. every 32nd snapshot is a full one, so that any state is
+    # rebuilt from a handful of objects. before a push overwrites a file, the
+    # object of its previous content is copied to /.versions/<hash>-<length>,
+    # where a restore finds it later.
+
+    def version_object(ihash, ilen):
+        return '{0}/{1}-{2}'.format(version_dir, ihash, ilen)
+
+    def snapshot_object(stamp, kind):
+        return '{0}/{1}.{2}.tsv'.format(
+            snapshot_dir, time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(stamp)), kind)
+
+    # the snapshots on the remote as (time, kind, object) in time order. a full
+    # snapshot written by gc in place of a delta replaces it.
+    def list_snapshots():
+
+        snapshots = []
+        for obj in list_remote(snapshot_dir + '/').keys():
+            splits = obj[len(snapshot_dir) + 1:].split('.')
+            if len(splits) != 3 or not splits[1] in ['full', 'delta']: continue
+            
+            try: stamp = calendar.timegm(time.strptime(splits[0], '%Y%m%dT%H%M%SZ'))
+            except ValueError: continue
+            snapshots += [(stamp, splits[1], obj)]
+
+        snapshots.sort(key = lambda x: (x[0], x[1] != 'full'))
+        result = []
+        for snap in snapshots:
+            if len(result) > 0 and result[-1][0] == snap[0]: continue
+            result += [snap]
+        
+        return result
+
+    def read_snapshot(obj):
+        temp = conf_dir + '/snapshot.part'
+        if os.path.exists(temp): os.remove(temp)
+
+        download_abs(obj, temp)
+        if not os.path.exists(temp):
+            error('cannot read the snapshot {0}.'.format(obj))
+
+        with open(temp, 'r', encoding = 'utf-8') as fp:
+            lines = fp.read().splitlines(keepends = True)
+        os.remove(temp)
+        return lines
+
+    # apply a snapshot to the state (path to catalog line), returns the lines
+    # it has set.
+    def apply_snapshot(state, kind, lines):
+
+        added = []
+        if kind == 'full': state.clear()
+
+        for line in lines:
+            if kind == 'full':
+                state[parse_line(line)[4]] = line
+                added += [line]
+                continue
+
+            mark, _, rest = line.partition('\t')
+            if mark == '+':
+                state[parse_line(rest)[4]] = rest
+                added += [rest]
+            elif mark == '-': state.pop(rest.rstrip('\n'), None)
+
+        return added
+
+    # the state of the index-th snapshot, from the last full one before it.
+    def snapshot_state(snapshots, index):
+
+        start = index
+        while start > 0 and snapshots[start][1] != 'full': start -= 1
+
+        state = {}
+        for _, kind, obj in snapshots[start : index + 1]:
+            apply_snapshot(state, kind, read_snapshot(obj))
+        return state
+
+    # keep the catalog lines just pushed as a snapshot, the changes since the
+    # previous remote catalog (still in remote_chksum) by default.
+    @traced('snapshot')
+    def write_snapshot(lines):
+
+        snapshots = list_snapshots()
+        stamp = int(time.time())
+        if len(snapshots) > 0 and stamp <= snapshots[-1][0]:
+            stamp = snapshots[-1][0] + 1
+
+        since_full = 0
+        for _, kind, _ in reversed(snapshots):
+            if kind == 'full': break
+            since_full += 1
+
+        kind = 'delta'
+        content = []
+        
+        if since_full == len(snapshots) or since_full + 1 >= snapshot_full_every:
+            kind = 'full'
+            content = lines
+        
+        else:
+            before = {}
+            after = {}
+            for line in read_checksum_lines(remote_chksum): before[parse_line(line)[4]] = line
+            for line in lines: after[parse_line(line)[4]] = line
+
+            for path in after.keys():
+                if not path in before.keys() or \
+                   not same_content(before[path], after[path]):
+                    content += ['+\t' + after[path]]
+
+            for path in before.keys():
+                if not path in after.keys():
+                    content += ['-\t{0}\n'.format(path)]
+
+            if len(content) == 0: return
+
+        temp = conf_dir + '/snapshot.part'
+        with open(temp, 'w', encoding = 'utf-8') as fp:
+            fp.writelines(content)
+        upload_abs(temp, snapshot_object(stamp, kind))
+        os.remove(temp)
+
+    def read_checksum_lines(path):
+        if not os.path.exists(path): return []
+        with open(path, 'r', encoding = 'utf-8') as fp:
+            return [x for x in fp.read().splitlines(keepends = True) if x.strip() != '']
+
+    # whether two catalog lines refer to the same stored content.
+    def same_content(aline, bline):
+        a = parse_line(aline)
+        b = parse_line(bline)
+        return a[0] == b[0] and a[1] == b[1] and a[5] == b[5]
+
+    # copy the remote objects about to be overwritten by pending uploads away
+    # to their versions. bundle members need not, as bundles are immutable.
+    @traced('preserve versions')
+    def preserve_versions(pending, r_file_path, r_hash_num, r_file_length, r_attrs, 
+                          journaled):
+        
+        remote_index = {}
+        for x in range(len(r_file_path)): remote_index[r_file_path[x]] = x
+
+        for local_file, lline in pending:
+            if not local_file in remote_index.keys(): continue
+            if 'bundle' in r_attrs.get(local_file, {}).keys(): continue
+
+            x = remote_index[local_file]
+            if r_hash_num[x] == parse_line(lline)[0] or r_hash_num[x] == manual_zero_md5:
+                continue
+
+            # the remote object has been overwritten by the interrupted run.
+            if journaled_upload(journaled, local_file, lline) is not None: continue
+            
+            copy_remote(local_file, version_object(r_hash_num[x], r_file_length[x]))
+
+    # push the local files. local is the local checksum if it has been built
+    # already (by the push of which this is a mirror).
+
+    def push(local = None):
+
+        if local is None: local = build_local_checksum()
+        l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = local
+        mirror_runs = start_mirrors(local) if planning['mode'] != 'plan' else []
         ll_hash_num, ll_file_length, ll_last_modified, ll_stime, ll_file_path = \
-            read_local_last_checksum()
-        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path = \
-            read_remote_checksum()
+            select_scope(read_local_last_checksum())
+        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path, r_attrs = \
+            select_scope(read_remote_checksum())
+        
+        # the entries a lazy fetch has not downloaded are not local deletions.
+        local_paths = set(l_file_path)
+        remote_paths = set(r_file_path)
+        deferred = set([x for x in read_placeholders().keys() 
+                        if not x in local_paths and x in remote_paths])
+        if len(deferred) > 0:
+            r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path, r_attrs = \
+                select_columns((r_hash_num, r_file_length, r_last_modified, r_stime, 
+                                r_file_path, r_attrs), lambda x: not x in deferred)
         
         actual_checksum = []
 
@@ -332,13 +1164,18 @@ def init(app, providers: dict, kwargs: dict):
         #   +         -         auto      copy
         #   -         +         deleted   -
 
-        overview_uploads = []
-        overview_modified = []
-        overview_removed = []
+        # the files to upload, modify and forget, listed to conf/<task>/push.files.log.
+        listing = shared.progress.results(conf_dir + '/push.files.log')
 
         confirm_synccfl = []
         confirm_remote_move = []
         confirm_remote_copy = []
+
+        # uploads are collected while reconciling and performed after all the
+        # confirmations, so that small files can be packed into bundles.
+        pending_uploads = []
+        reconcile = begin('reconcile', local = len(l_file_path), remote = len(r_file_path))
+        journaled = read_journal()
         
         num_unchanged = 0
 
@@ -352,9 +1189,9 @@ def init(app, providers: dict, kwargs: dict):
             
             if local_file in r_file_path:
                 rx = r_file_path.index(local_file)
-                remote_line = '{0}\t{1}\t{2}\t{3}\t{4}\n'.format(
+                remote_line = format_line(
                     r_hash_num[rx], r_file_length[rx], r_last_modified[rx], 
-                    r_stime[rx], local_file )
+                    r_stime[rx], local_file, r_attrs.get(local_file) )
 
                 # if the file with changed length or hash number, it is say to 
                 # be a new file. we should then compare the sync time. if the
@@ -377,10 +1214,8 @@ def init(app, providers: dict, kwargs: dict):
                 if is_updated:
 
                     if not is_newer:
-                        overview_modified += \
-                            [print_message('\033[1;33m', '~', local_file)]
-                        upload_rel(local_file, local_file)
-                        actual_checksum += [local_line]
+                        listing.add('modified', '\033[1;33m', '~', local_file)
+                        pending_uploads += [(local_file, local_line)]
 
                     else: confirm_synccfl += [(local_file, l_last_modified[x],
                                                r_last_modified[rx], local_line, 
@@ -388,7 +1223,7 @@ def init(app, providers: dict, kwargs: dict):
 
                 else: 
                     num_unchanged += 1
-                    actual_checksum += [local_line]
+                    actual_checksum += [with_attrs(local_line, r_attrs.get(local_file))]
 
             else:
 
@@ -413,18 +1248,17 @@ def init(app, providers: dict, kwargs: dict):
 
                 else: # simple upload
 
-                    overview_uploads += \
-                        [print_message('\033[1;32m', '+', local_file)]
-                    upload_rel(local_file, local_file)
-                    actual_checksum += [local_line]
+                    listing.add('uploaded', '\033[1;32m', '+', local_file)
+                    pending_uploads += [(local_file, local_line)]
 
         for x in range(len(r_file_path)):
             remote_file = r_file_path[x]
 
             if not remote_file in l_file_path:
-                overview_removed += [print_message('\033[1;31m', '-', remote_file)]
+                listing.add('removed', '\033[1;31m', '-', remote_file)
 
-        if len(overview_uploads) + len(overview_modified) + len(overview_removed) > 0:
+        reconcile.end()
+        if listing.count('uploaded') + listing.count('modified') + listing.count('removed') > 0:
             print('\n')
 
         # here, we will handle the user confirmation using cli.
@@ -432,7 +1266,7 @@ def init(app, providers: dict, kwargs: dict):
         if  len(confirm_synccfl) > 0 or \
             len(confirm_remote_copy) > 0 or \
             len(confirm_remote_move) > 0 or \
-            len(overview_removed) > 0:
+            listing.count('removed') > 0:
             info('You will manually specify behaviors for the following files:')
             info('<x> for selection, <space> for de-selection, <j>/<k> to move up and down. \n')
 
@@ -444,31 +1278,17 @@ def init(app, providers: dict, kwargs: dict):
         choice = []
         for local_file, ltime, rtime, lline, rline, deflt in confirm_synccfl:
             print('[{0}] '.format('x' if deflt else ' '), end = '')
-            local = time.strftime('%Y-%m-%d %H:%M', time.localtime(ltime))
-            remote = time.strftime('%Y-%m-%d %H:%M', time.localtime(rtime))
+            ltext = time.strftime('%Y-%m-%d %H:%M', time.localtime(ltime))
+            rtext = time.strftime('%Y-%m-%d %H:%M', time.localtime(rtime))
             fore_red()
-            print('[l]', common_length(local, 16), end = ' ')
+            print('[l]', common_length(ltext, 16), end = ' ')
             fore_green()
-            print('[r]', common_length(remote, 16), end = ' ')
+            print('[r]', common_length(rtext, 16), end = ' ')
             ansi_reset()
             print(common_length(local_file, 70))
             choice += [deflt]
         
-        choice = edit_lines(choice)
-
-        ind = 0
-        for local_file, ltime, rtime, lline, rline, _ in confirm_synccfl:
-            action = choice[ind]
-
-            if action:
-                overview_modified += \
-                    [print_message('\033[1;33m', '~', local_file)]
-                upload_rel(local_file, local_file)
-                actual_checksum += [lline]
-            
-            else: actual_checksum += [rline]
-            
-            ind += 1
+        choice = edit_lines(choice, 'overwrite-remote', [x[0] for x in confirm_synccfl])
 
         if len(confirm_remote_move) > 0:
             print('\n') # ?
@@ -491,26 +1311,8 @@ def init(app, providers: dict, kwargs: dict):
             print(common_length(local_file, 40))
             choice_move += [deflt]
 
-        choice_move = edit_lines(choice_move)
+        choice_move = edit_lines(choice_move, 'move', [x[1] for x in confirm_remote_move])
         
-        ind = 0
-        for remote_file, local_file, lline, deflt in confirm_remote_move:
-            action = choice_move[ind]
-
-            if action:
-                overview_uploads += \
-                    [print_message('\033[1;33m', 'v', local_file)]
-                move_remote(remote_file, local_file)
-                actual_checksum += [lline]
-            
-            else: 
-                overview_uploads += \
-                    [print_message('\033[1;33m', '+', local_file)]
-                upload_rel(local_file, local_file)
-                actual_checksum += [lline]
-            
-            ind += 1
-
         if len(confirm_remote_move) > 0:
             print('\n')
         
@@ -529,42 +1331,123 @@ def init(app, providers: dict, kwargs: dict):
             print(common_length(local_file, 40))
             choice_cp += [deflt]
 
-        choice_cp = edit_lines(choice_cp)
+        choice_cp = edit_lines(choice_cp, 'copy', [x[1] for x in confirm_remote_copy])
         
+        if len(confirm_remote_copy) > 0:
+            print('\n')
+
+        # a plan stops here, with all the choices made, before any change.
+        if planning['mode'] == 'plan':
+            ops = [('upload' if not x[0] in remote_paths else 'modify', x[0]) 
+                   for x in pending_uploads]
+            ops += [('overwrite' if choice[x] else 'keep', confirm_synccfl[x][0]) 
+                    for x in range(len(confirm_synccfl))]
+            ops += [('move', confirm_remote_move[x][1], confirm_remote_move[x][0]) 
+                    if choice_move[x] else ('upload', confirm_remote_move[x][1])
+                    for x in range(len(confirm_remote_move))]
+            ops += [('copy', confirm_remote_copy[x][1], confirm_remote_copy[x][0]) 
+                    if choice_cp[x] else ('upload', confirm_remote_copy[x][1])
+                    for x in range(len(confirm_remote_copy))]
+            moved = [confirm_remote_move[x][0] for x in range(len(confirm_remote_move))
+                     if choice_move[x]]
+            ops += [('forget', x) for x in r_file_path 
+                    if not x in local_paths and not x in moved]
+            listing.close()
+            return save_plan('push', local, ops)
+
+        ind = 0
+        for local_file, ltime, rtime, lline, rline, _ in confirm_synccfl:
+            action = choice[ind]
+
+            if action:
+                listing.add('modified', '\033[1;33m', '~', local_file)
+                pending_uploads += [(local_file, lline)]
+            
+            else: actual_checksum += [rline]
+            
+            ind += 1
+
+        ind = 0
+        moved = {}
+        for remote_file, local_file, lline, deflt in confirm_remote_move:
+            action = choice_move[ind]
+
+            if action:
+                listing.add('uploaded', '\033[1;33m', 'v', local_file)
+                
+                # a bundled file is moved by simply pointing to the same member.
+                # once moved away, the same remote file is copied from its new 
+                # place for the other local files of the same content.
+                lline = with_attrs(lline, r_attrs.get(remote_file))
+                if not 'bundle' in r_attrs.get(remote_file, {}).keys() and \
+                   journaled_upload(journaled, local_file, lline) is None:
+                    if remote_file in moved.keys(): 
+                        copy_remote(moved[remote_file], local_file)
+                    else: 
+                        move_remote(remote_file, local_file)
+                        moved[remote_file] = local_file
+                    record_journal('U', lline)
+                actual_checksum += [lline]
+            
+            else: 
+                listing.add('uploaded', '\033[1;33m', '+', local_file)
+                pending_uploads += [(local_file, lline)]
+            
+            ind += 1
+
         ind = 0
         for remote_file, local_file, lline, deflt in confirm_remote_copy:
             action = choice_cp[ind]
 
             if action:
-                overview_uploads += \
-                    [print_message('\033[1;33m', 'c', local_file)]
-                copy_remote(remote_file, local_file)
+                listing.add('uploaded', '\033[1;33m', 'c', local_file)
+                
+                lline = with_attrs(lline, r_attrs.get(remote_file))
+                if not 'bundle' in r_attrs.get(remote_file, {}).keys() and \
+                   journaled_upload(journaled, local_file, lline) is None:
+                    copy_remote(remote_file, local_file)
+                    record_journal('U', lline)
                 actual_checksum += [lline]
             
             else: 
-                overview_uploads += \
-                    [print_message('\033[1;33m', '+', local_file)]
-                upload_rel(local_file, local_file)
-                actual_checksum += [lline]
+                listing.add('uploaded', '\033[1;33m', '+', local_file)
+                pending_uploads += [(local_file, lline)]
             
             ind += 1
 
-        if len(confirm_remote_copy) > 0:
-            print('\n')
+        preserve_versions(pending_uploads, r_file_path, r_hash_num, r_file_length,
+                          r_attrs, journaled)
 
-        print('{:<80}'.format('Upload files finished.'))
+        # bundles that became mostly dead are repacked in the background while
+        # the uploads go on. both only touch their own entries of the catalog.
 
-        print('\n\033[1;32m{0} files uploaded.\033[0m'
-              .format(str(len(overview_uploads))))
-        for x in overview_uploads: print(x)
+        repacker = None
+        repacked = {}
+        if bundle_threshold > 0:
+            unpushed = [x for x in read_checksum_lines(remote_chksum) 
+                        if not in_scope(parse_line(x)[4]) or parse_line(x)[4] in deferred]
+            repacker = threading.Thread(target = repack_bundles, 
+                                        args = (list(actual_checksum), repacked, unpushed))
+            repacker.start()
 
-        print('\n\033[1;33m{0} files modified.\033[0m'
-              .format(str(len(overview_modified))))
-        for x in overview_modified: print(x)
+        actual_checksum += upload_pending(pending_uploads)
 
-        print('\n\033[1;31m{0} files removed compared with remote.\033[0m'
-              .format(str(len(overview_removed))))
-        for x in overview_removed: print(x)
+        if repacker is not None:
+            repacker.join()
+            for ind in repacked.keys():
+                actual_checksum[ind] = repacked[ind]
+            if len(repacked) > 0:
+                info('{0} files repacked from mostly dead bundles.'.format(len(repacked)))
+
+        print('{:<80}'.format('Upload files finished.'))
+
+        print('')
+        listing.close()
+        listing.report('uploaded', '\033[1;32m', 'files uploaded.')
+        print('')
+        listing.report('modified', '\033[1;33m', 'files modified.')
+        print('')
+        listing.report('removed', '\033[1;31m', 'files removed compared with remote.')
 
         print('\n\033[1;30m{0} files unchanged. ({1} local)\033[0m'
               .format( num_unchanged, len(l_file_path)))
@@ -573,18 +1456,423 @@ def init(app, providers: dict, kwargs: dict):
 
         print('\033[1;32m{0}\033[0m'
               .format( 'Uploading updated file catalog checksums ...' ))
+        # the files out of the scope keep their records.
+        others = [x for x in read_checksum_lines(last_local_chksum) 
+                  if not in_scope(parse_line(x)[4])]
+
         if (os.path.exists(last_local_chksum)):
             os.remove(last_local_chksum)
 
         checksum = open(last_local_chksum, 'a', encoding = 'utf-8')
-        checksum.writelines(actual_checksum)
+        checksum.writelines(others + actual_checksum)
         checksum.close()
-        upload_abs(last_local_chksum, '/filesystem.checksum.tsv')
+        # and the remote entries out of the selection are published untouched.
+        kept = [x for x in read_checksum_lines(remote_chksum) 
+                if in_partition(parse_line(x)[4]) and (
+                   not in_selection(parse_line(x)[4]) or parse_line(x)[4] in deferred)]
+        
+        if partition is None: write_snapshot(publish_catalog(kept + actual_checksum))
+        else: publish_partition(kept + actual_checksum)
+        clear_journal()
+        settle_placeholders()
+
+        governor.report()
+        join_mirrors(mirror_runs)
 
         print('\n\033[1;32m{0}\033[0m'
               .format( 'All jobs finished.' ))
 
-    def edit_lines(choice):
+    # lazy fetches. `fetch --lazy` reconciles as usual, but instead of downloading
+    # the files, records their remote catalog lines in filesystem.lazy. they are
+    # placeholders: `sync get` downloads the selected ones later, a push keeps
+    # their remote entries as they are while they are missing locally, and a
+    # full fetch downloads them as any other remote file.
+
+    def read_placeholders():
+        placeholders = {}
+        for line in read_checksum_lines(lazy_file):
+            placeholders[parse_line(line)[4]] = line
+        return placeholders
+
+    def write_placeholders(placeholders):
+        if len(placeholders) == 0:
+            if os.path.exists(lazy_file): os.remove(lazy_file)
+            return
+        
+        with open(lazy_file, 'w', encoding = 'utf-8') as fp:
+            fp.writelines(placeholders.values())
+
+    def defer_downloads(pending):
+        placeholders = read_placeholders()
+        for rline in pending: placeholders[parse_line(rline)[4]] = rline
+        write_placeholders(placeholders)
+
+    # drop the placeholders materialized since, or no longer in the remote.
+    def settle_placeholders():
+        placeholders = read_placeholders()
+        if len(placeholders) == 0: return
+        
+        remote = set(read_checksum(remote_chksum)[4])
+        write_placeholders({ k: v for k, v in placeholders.items()
+                             if k in remote and not os.path.exists(kwargs['dest'] + k) })
+
+    # download the placeholders under the given paths (prefixes or globs as with
+    # --path), in parallel. the members of a bundle are downloaded together.
+    # the placeholders are taken as they are in the current remote catalog, so
+    # a file changed since the lazy fetch is downloaded as it is now, and one
+    # removed from the remote since is dropped.
+    def get():
+
+        placeholders = read_placeholders()
+        selected = [x for x in sorted(placeholders.keys()) if in_selection(x)]
+        if len(selected) == 0:
+            info('No placeholder is left under the given paths.')
+            return
+
+        read_remote_checksum()
+        current = { parse_line(x)[4]: x for x in read_checksum_lines(remote_chksum) }
+        gone = [x for x in selected if not x in current.keys()]
+        if len(gone) > 0:
+            warning('{0} placeholders are no longer in the remote catalog, and are dropped:'
+                    .format(len(gone)))
+            for path in gone: print_message('\033[1;33m', '-', path, False)
+            placeholders = { k: v for k, v in placeholders.items() if not k in gone }
+        
+        wanted = [current[x] for x in selected if x in current.keys()]
+        if len(wanted) == 0:
+            write_placeholders(placeholders)
+            info('No placeholder is left under the given paths.')
+            return
+
+        info('Downloading {0} files ...'.format(len(wanted)))
+        groups = {}
+        for rline in wanted:
+            attrs = parse_line(rline)[5]
+            key = shared.bundle.parse_location(attrs['bundle'])[0] \
+                  if 'bundle' in attrs.keys() else parse_line(rline)[4]
+            if not key in groups.keys(): groups[key] = []
+            groups[key] += [rline]
+
+        workers = governor.workers(8)
+        batches = [[] for _ in range(workers)]
+        for x, key in enumerate(groups.keys()): batches[x % workers] += groups[key]
+        
+        # one progress line for all the batches.
+        meter = shared.progress.progress('Downloading', len(wanted), 
+                                         sum([parse_line(x)[1] for x in wanted]))
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            lines = sum(pool.map(lambda x: download_pending(x, meter), 
+                                 [x for x in batches if len(x) > 0]), [])
+        meter.close()
+
+        # the downloaded files join the local catalog.
+        fetched = set([parse_line(x)[4] for x in lines])
+        previous = [x for x in read_checksum_lines(last_local_chksum) 
+                    if not parse_line(x)[4] in fetched]
+        
+        with open(last_local_chksum, 'w', encoding = 'utf-8') as fp:
+            fp.writelines(previous + lines)
+        clear_journal()
+
+        write_placeholders({ k: v for k, v in placeholders.items() if not k in fetched })
+        
+        print('\033[1;32m{0} files downloaded, {1} placeholders left.\033[0m'.format(
+              len(lines), len(placeholders) - len(fetched)))
+        cache['flush']()
+        report_copies()
+        governor.report()
+
+    # selective runs. with `--path`, push, fetch and diff only walk the subtrees
+    # holding the selected paths, and only reconcile the entries within. a 
+    # pattern without wildcards selects the file or the directory of the path,
+    # and a glob selects the paths it matches and the contents of them. the
+    # entries out of the selection are left as they are in both catalogs.
+
+    def in_selection(path):
+        if selection is None: return True
+
+        for pattern in selection:
+            if pattern != re.split(r'[*?\[]', pattern)[0]:
+                if fnmatch.fnmatchcase(path, pattern) or \
+                   fnmatch.fnmatchcase(path, pattern.rstrip('/') + '/*'): return True
+            elif path == pattern.rstrip('/') or path.startswith(pattern.rstrip('/') + '/'):
+                return True
+        
+        return False
+
+    def in_scope(path):
+        return in_partition(path) and in_selection(path)
+
+    # the (directory, files) of the tree to walk: the whole of it, or the
+    # subtrees under the fixed heads of the selected patterns. the ignore marks
+    # in their parent directories are given first, so that they take effect.
+    def walk_selection(sync_dir):
+        if selection is None:
+            for root, _, files in os.walk(sync_dir, topdown = True):
+                yield root, files
+            return
+        
+        heads = []
+        for pattern in selection:
+            head = re.split(r'[*?\[]', pattern)[0]
+            if head != pattern: head = head[:head.rfind('/')]
+            heads += [head.rstrip('/')]
+
+        roots = []
+        for head in sorted(set(heads)):
+            if not any([head == x or head.startswith(x + '/') for x in roots]):
+                roots += [head]
+
+        marked = set()
+        for head in roots:
+            parent = os.path.dirname(head)
+            parents = []
+            while parent != '/' and parent != '':
+                parents = [parent] + parents
+                parent = os.path.dirname(parent)
+            
+            for parent in [''] + parents:
+                if parent in marked or not os.path.isfile(sync_dir + parent + '/.ignore'):
+                    continue
+                marked.add(parent)
+                yield sync_dir + parent, ['.ignore']
+
+            if os.path.isfile(sync_dir + head):
+                yield sync_dir + os.path.dirname(head), [os.path.basename(head)]
+                continue
+            
+            for root, _, files in os.walk(sync_dir + head, topdown = True):
+                yield root, files
+
+    # partitioned pushes. several nodes sharing the same tree push a partition of
+    # it each, with `push --partition k/n`, against the same generation of the
+    # remote catalog. each of them uploads the catalog of its partition as
+    # /.partitions/<generation>/<k>-of-<n>.tsv instead of publishing it. the node
+    # finding all the n partitions there claims the merge by creating the
+    # 'merged' object, publishes the union of the partitions as the next
+    # generation, and marks the run done by the 'published' object. the bucket
+    # is the only coordinator needed.
+    #
+    # a claim left for merge_timeout seconds without the 'published' mark is
+    # taken as abandoned (the node died while merging), and the next push of
+    # any partition of the run takes the merge over. the merge is the same
+    # whichever node does it, and publish_catalog keeps it from overwriting a
+    # generation.
+
+    def in_partition(path):
+        if partition is None: return True
+        return zlib.crc32(path.encode('utf-8')) % partition[1] == partition[0] - 1
+
+    # filter the parallel columns of a checksum (the path is the fifth) to the
+    # scope, keeping the trailing attribute dictionary if any.
+    def select_scope(columns):
+        if partition is None and selection is None: return columns
+        return select_columns(columns, in_scope)
+
+    def select_columns(columns, predicate):
+        keep = [x for x in range(len(columns[4])) if predicate(columns[4][x])]
+        selected = tuple([[column[x] for x in keep] for column in columns[:5]])
+        return selected + tuple(columns[5:])
+
+    def publish_partition(lines):
+
+        run = '{0}/{1:010d}'.format(partition_dir, catalog['generation'])
+        part_object = lambda k: '{0}/{1}-of-{2}.tsv'.format(run, k, partition[1])
+        warn_orphaned_partitions()
+
+        temp = conf_dir + '/catalog.part'
+        with open(temp, 'w', encoding = 'utf-8') as fp:
+            fp.writelines(lines)
+        upload_abs(temp, part_object(partition[0]))
+
+        listed = list_remote(run + '/')
+        missing = [str(k) for k in range(1, partition[1] + 1) 
+                   if not part_object(k) in listed.keys()]
+        
+        if len(missing) > 0:
+            os.remove(temp)
+            info('Partition {0}/{1} pushed. Waiting for the partitions {2} to be pushed '
+                 'by the other nodes.'.format(partition[0], partition[1], ', '.join(missing)))
+            return
+
+        # an empty object only marks the merge as claimed.
+        with open(temp, 'w', encoding = 'utf-8') as fp: pass
+        claimed = create_remote(temp, run + '/merged')
+        os.remove(temp)
+        if not claimed:
+            listed = list_remote(run + '/')
+            if run + '/published' in listed.keys():
+                info('Partition {0}/{1} pushed. The partitions are merged by another node.'
+                     .format(partition[0], partition[1]))
+                return
+
+            claim = listed.get(run + '/merged', (0, '', time.time()))
+            if time.time() - claim[2] < merge_timeout:
+                info('Partition {0}/{1} pushed. The partitions are being merged by another '
+                     'node. If it fails, push any partition again after {2} minutes to take '
+                     'the merge over.'.format(partition[0], partition[1], merge_timeout // 60))
+                return
+
+            warning('The merge of the partitions claimed {0} minutes ago is not published, '
+                    'taking it over.'.format(int(time.time() - claim[2]) // 60))
+
+        info('All the {0} partitions pushed, merging ...'.format(partition[1]))
+        merged = []
+        for k in range(1, partition[1] + 1):
+            if k == partition[0]: 
+                merged += lines
+                continue
+            
+            if os.path.exists(temp): os.remove(temp)
+            download_abs(part_object(k), temp)
+            if not os.path.exists(temp):
+                error('cannot read the partition {0}/{1}.'.format(k, partition[1]))
+            merged += read_checksum_lines(temp)
+            os.remove(temp)
+
+        write_snapshot(publish_catalog(merged))
+        with open(temp, 'w', encoding = 'utf-8') as fp: 
+            fp.write('{0}\n'.format(catalog['generation']))
+        upload_abs(temp, run + '/published')
+        os.remove(temp)
+        info('Generation {0} of the remote catalog is published.'
+             .format(catalog['generation']))
+
+    # the runs of partitions pushed on an older generation and never published.
+    # their changes are not in the remote catalog: the merge failed before the
+    # timeout was up, or another push published a generation in between, so
+    # that the pushes of the rest of the partitions started a newer run.
+    def warn_orphaned_partitions():
+
+        runs = {}
+        for obj in list_remote(partition_dir + '/').keys():
+            name, _, item = obj[len(partition_dir) + 1:].partition('/')
+            if not name.isdigit() or int(name) >= catalog['generation']: continue
+            if not name in runs.keys(): runs[name] = set()
+            runs[name].add(item)
+
+        orphaned = [x for x in sorted(runs.keys()) if not 'published' in runs[x]]
+        if len(orphaned) == 0: return
+        warning('The partitions pushed on generation {0} of the remote catalog are '
+                'not merged. Push the partitions again to have their changes recorded.'
+                .format(', '.join([str(int(x)) for x in orphaned])))
+
+    # the pushes to the mirrors: other filesystem tasks, named by 'mirrors', 
+    # whose oss settings are taken as further destinations of this task. they
+    # reuse the local checksum built here, but plan against their own remote
+    # catalogs with their own records (in their own conf directories, so that
+    # pushing a mirror by itself stays consistent). they run besides this push
+    # without asking, taking the default choices, and write their outputs to 
+    # conf/<mirror>/push.log.
+
+    def start_mirrors(local):
+
+        if kwargs.get('_mirror', False): return []
+        names = [x.strip() for x in kwargs.get('mirrors', '<not-set>').split(',')]
+        names = [x for x in names if x != '' and x != '<not-set>']
+        if len(names) == 0: return []
+
+        if partition is not None:
+            warning('The mirrors are not pushed by a partitioned push.')
+            return []
+
+        targets = read_targets(app)
+        runs = []
+
+        for name in names:
+            if not name in targets.keys() or targets[name]['_task'] != 'filesystem':
+                warning('The mirror `{0}` is not a filesystem task, skipped.'.format(name))
+                continue
+
+            mirror_kwargs = copy.deepcopy(targets[name])
+            mirror_kwargs['_name'] = name
+            mirror_kwargs['dest'] = kwargs['dest']
+            mirror_kwargs['y'] = kwargs.get('y', False)
+            mirror_kwargs['_mirror'] = True
+            mirror_kwargs.pop('mirrors', None)
+
+            status = { 'name': name, 'done': False,
+                       'log': get_conf_dir(app, name) + '/push.log' }
+            thread = threading.Thread(target = push_mirror, 
+                                      args = (mirror_kwargs, copy.deepcopy(local), status))
+            thread.start()
+            runs += [(thread, status)]
+
+        if len(runs) > 0:
+            info('Pushing to the mirrors {0} at the same time.'.format(
+                 ', '.join([status['name'] for _, status in runs])))
+        return runs
+
+    def push_mirror(mirror_kwargs, local, status):
+
+        if not os.path.exists(os.path.dirname(status['log'])):
+            os.makedirs(os.path.dirname(status['log']))
+
+        with open(status['log'], 'w', encoding = 'utf-8') as log:
+            route_output(log)
+            
+            # error() exits, which only ends this thread.
+            try:
+                mirror = init(app, mirror_kwargs, mirror_kwargs)
+                mirror['push'](local)
+                status['done'] = True
+            except BaseException as e:
+                print('\n[failed] {0}'.format(e))
+            finally:
+                route_output(None)
+
+    def join_mirrors(runs):
+
+        if len(runs) > 0: 
+            info('Waiting for the mirrors ...')
+        
+        for thread, status in runs:
+            thread.join()
+            if status['done']: 
+                print_message('\033[1;32m', 'v', '{0} (see {1})'.format(
+                              status['name'], status['log']), False)
+            else: 
+                print_message('\033[1;31m', '!', '{0} failed (see {1})'.format(
+                              status['name'], status['log']), False)
+
+    # the confirmations of one kind, each of them keyed by its path.
+    def edit_lines(choice, kind = None, keys = None):
+        
+        decided = decide_lines(choice, kind, keys)
+        if decided is not None: 
+            choice = decided
+            if interactive() and len(choice) > 0: show_lines(choice)
+
+        # mirrors, and runs without a terminal, take the defaults.
+        elif not kwargs.get('_mirror', False) and interactive(): 
+            choice = prompt_lines(choice)
+        
+        if planning['mode'] == 'plan' and kind is not None:
+            planning['decisions'] += [(kind, choice[x], keys[x]) for x in range(len(choice))]
+        return choice
+    
+    # returns the answers an apply or a policy takes, or none to prompt.
+    def decide_lines(choice, kind, keys):
+        if kind is None: return None
+
+        if planning['mode'] == 'apply':
+            answers = planning['answers'].get(kind, {})
+            return [answers.get(keys[x], choice[x]) for x in range(len(choice))]
+        
+        policy, answer = policy_answers[kind]
+        if policies[policy] == 'ask': return None
+        return [answer[policies[policy]]] * len(choice)
+
+    # redraw the marks of the confirmations already printed.
+    def show_lines(choice):
+        ansi_move_cursor(-len(choice), 1)
+        for x in choice:
+            fill_blank(1, 'x' if x else ' ')
+            ansi_move_cursor(1, -1)
+        ansi_move_cursor(0, -1)
+
+    def prompt_lines(choice):
+
         n_choices = len(choice)
         ansi_move_cursor(-n_choices, 1)
         current_line = 0
@@ -612,19 +1900,97 @@ def init(app, providers: dict, kwargs: dict):
         ansi_move_cursor(0, -1)
         return choice
 
-    def fetch():
+    # plan and apply split a push or fetch in two. the plan runs it up to the
+    # point where everything is known and every confirmation is answered, and
+    # writes it down (see shared/plan.py). the apply runs it from the planned
+    # local checksum, without walking or hashing the tree again, after checking
+    # that the files planned and the remote catalog are the same as then.
+
+    def plan():
+        command = kwargs.get('plan-command', 'push')
+        planning['mode'] = 'plan'
+        if command == 'fetch': return fetch()
+        return push()
+
+    def plan_inputs():
+        inputs = { 'generation': catalog['generation'], 'catalog': 'none', 
+                   'last-local': 'none' }
+        if os.path.exists(remote_chksum): 
+            inputs['catalog'] = shared.digest.md5_file(remote_chksum)
+        if os.path.exists(last_local_chksum): 
+            inputs['last-local'] = shared.digest.md5_file(last_local_chksum)
+        return inputs
+
+    def save_plan(command, local, ops):
+        path = plan_file
+        if path == '<not-set>': path = conf_dir + '/{0}.plan'.format(command)
+
+        options = []
+        if selection is not None: options += [('paths', x) for x in selection]
+        if partition is not None: options += [('partition', '{0}/{1}'.format(*partition))]
+        if kwargs.get('lazy', False): options += [('lazy', '1')]
+
+        l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = local
+        lines = [format_line(l_hash_num[x], l_file_length[x], l_last_modified[x],
+                             l_stime[x], l_file_path[x]) for x in range(len(l_file_path))]
+
+        shared.plan.write_plan(path, kwargs['_name'], command, options, plan_inputs(), 
+                               lines, planning['decisions'], ops)
+        
+        counts = {}
+        for op in ops: counts[op[0]] = counts.get(op[0], 0) + 1
+        info('Planned {0} ({1}).'.format(command, ', '.join(
+             ['{0} {1}'.format(counts[x], x) for x in counts.keys()]) or 'nothing to do'))
+        info('Run `sync apply {0}` to carry it out.'.format(path))
+        return path
+
+    def apply():
+        planned = shared.plan.read_plan(plan_file)
+        sync_dir = kwargs['dest']
 
-        l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = \
-            build_local_checksum()
+        # the cheap check: the planned files are unchanged by size and time.
+        local = [], [], [], [], []
+        for line in planned['local']:
+            ihash, ilen, mtime, stime, ipath, _ = parse_line(line)
+            try: file_stat = os.stat(sync_dir + ipath)
+            except OSError: file_stat = None
+
+            if file_stat is None or (not ipath.endswith('/.ignore') and \
+               (file_stat.st_size != ilen or file_stat.st_mtime != mtime)):
+                error('the plan is out of date, {0} has changed since. plan again.'
+                      .format(ipath))
+            
+            for column, value in zip(local, [ihash, ilen, mtime, stime, ipath]):
+                column += [value]
+        
+        read_remote_checksum()
+        inputs = plan_inputs()
+        for key in inputs.keys():
+            if str(inputs[key]) != planned['inputs'].get(key, str(inputs[key])):
+                error('the plan is out of date, the {0} has changed since. plan again.'
+                      .format(key))
+        
+        planning['mode'] = 'apply'
+        planning['answers'] = planned['decisions']
+        if planned['command'] == 'fetch': return fetch(local)
+        return push(local)
+
+    def fetch(local = None):
+
+        if kwargs.get('at', '<not-set>') != '<not-set>':
+            return fetch_at(parse_time(kwargs['at']))
+
+        if local is None: local = build_local_checksum()
+        l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = local
         ll_hash_num, ll_file_length, ll_last_modified, ll_stime, ll_file_path = \
-            read_local_last_checksum()
-        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path = \
-            read_remote_checksum()
+            select_scope(read_local_last_checksum())
+        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path, r_attrs = \
+            select_scope(read_remote_checksum())
         
         actual_checksum = []
 
-        overview_downloads = []
-        overview_modified = []
+        # the files to download and modify, listed to conf/<task>/fetch.files.log.
+        listing = shared.progress.results(conf_dir + '/fetch.files.log')
         overview_removed = []
         num_unchanged = 0
         sync_dir = kwargs['dest']
@@ -632,6 +1998,12 @@ def init(app, providers: dict, kwargs: dict):
         confirm_synccfl = []
         confirm_local_move = []
         confirm_local_copy = []
+
+        # downloads are performed after all the confirmations. so that the 
+        # members of the same bundle can be read together, and the local copies
+        # are made from the local files before they are overwritten.
+        pending_downloads = []
+        reconcile = begin('reconcile', local = len(l_file_path), remote = len(r_file_path))
         
         for x in range(len(l_file_path)):
             local_file = l_file_path[x]
@@ -643,9 +2015,9 @@ def init(app, providers: dict, kwargs: dict):
 
         for x in range(len(r_file_path)):
             remote_file = r_file_path[x]
-            remote_line = '{0}\t{1}\t{2}\t{3}\t{4}\n'.format(
+            remote_line = format_line(
                 r_hash_num[x], r_file_length[x], r_last_modified[x], 
-                r_stime[x], remote_file )
+                r_stime[x], remote_file, r_attrs.get(remote_file) )
             
             if remote_file in l_file_path:
                 lx = l_file_path.index(remote_file)
@@ -667,10 +2039,8 @@ def init(app, providers: dict, kwargs: dict):
                 if is_updated:
 
                     if not is_newer:
-                        overview_modified += [print_message('\033[1;33m', '~', remote_file)]
-                        download_rel(remote_file, remote_file)
-                        os.utime(kwargs['dest'] + remote_file, (time.time(), r_last_modified[x]))
-                        actual_checksum += [remote_line]
+                        listing.add('modified', '\033[1;33m', '~', remote_file)
+                        pending_downloads += [remote_line]
                     
                     else: confirm_synccfl += [(remote_file, l_last_modified[lx],
                                                r_last_modified[x], local_line, 
@@ -678,8 +2048,9 @@ def init(app, providers: dict, kwargs: dict):
 
                 else: 
                     num_unchanged += 1
-                    actual_checksum += [remote_line]
+                    if planning['mode'] == 'plan': continue
                     os.utime(kwargs['dest'] + remote_file, (time.time(), r_last_modified[x]))
+                    actual_checksum += [stamped_line(remote_line)]
 
             else:
 
@@ -697,13 +2068,11 @@ def init(app, providers: dict, kwargs: dict):
                                                 remote_line, True, r_last_modified[x])]
 
                 else: 
-                    overview_downloads += [print_message('\033[1;32m', '+', remote_file)]
-                    download_rel(remote_file, remote_file)
-                    os.utime(kwargs['dest'] + remote_file, (time.time(), r_last_modified[x]))
-                    actual_checksum += [remote_line]
+                    listing.add('downloaded', '\033[1;32m', '+', remote_file)
+                    pending_downloads += [remote_line]
 
+        reconcile.end()
         print('\r', end = '')
-        print('{:<80}'.format('Download files finished'))
         print('')
         
         # here, we will handle the user confirmation using cli. ---------------
@@ -723,32 +2092,17 @@ def init(app, providers: dict, kwargs: dict):
         choice = []
         for local_file, ltime, rtime, lline, rline, deflt in confirm_synccfl:
             print('[{0}] '.format('x' if deflt else ' '), end = '')
-            local = time.strftime('%Y-%m-%d %H:%M', time.localtime(ltime))
-            remote = time.strftime('%Y-%m-%d %H:%M', time.localtime(rtime))
+            ltext = time.strftime('%Y-%m-%d %H:%M', time.localtime(ltime))
+            rtext = time.strftime('%Y-%m-%d %H:%M', time.localtime(rtime))
             fore_red()
-            print('[l]', common_length(local, 16), end = ' ')
+            print('[l]', common_length(ltext, 16), end = ' ')
             fore_green()
-            print('[r]', common_length(remote, 16), end = ' ')
+            print('[r]', common_length(rtext, 16), end = ' ')
             ansi_reset()
             print(common_length(local_file, 70))
             choice += [deflt]
         
-        choice = edit_lines(choice)
-
-        ind = 0
-        for local_file, ltime, rtime, lline, rline, _ in confirm_synccfl:
-            action = choice[ind]
-
-            if action:
-                overview_modified += \
-                    [print_message('\033[1;33m', '~', local_file)]
-                download_rel(local_file, local_file)
-                actual_checksum += [rline]
-                os.utime(sync_dir + local_file, (time.time(), rtime))
-            
-            else: actual_checksum += [lline]
-            
-            ind += 1
+        choice = edit_lines(choice, 'overwrite-local', [x[0] for x in confirm_synccfl])
 
         if len(confirm_synccfl) > 0:
             print('\n')
@@ -773,28 +2127,8 @@ def init(app, providers: dict, kwargs: dict):
             print(common_length(new, 40))
             choice_move += [deflt]
 
-        choice_move = edit_lines(choice_move)
+        choice_move = edit_lines(choice_move, 'move', [x[1] for x in confirm_local_move])
         
-        ind = 0
-        for old, new, rline, deflt, rtime in confirm_local_move:
-            action = choice_move[ind]
-
-            if action:
-                overview_downloads += \
-                    [print_message('\033[1;33m', 'v', new)]
-                move_local(sync_dir + old, sync_dir + new)
-                actual_checksum += [rline]
-            
-            else: 
-                overview_downloads += \
-                    [print_message('\033[1;33m', '+', new)]
-                download_rel(new, new)
-                actual_checksum += [rline]
-
-            os.utime(sync_dir + new, (time.time(), rtime))
-            
-            ind += 1
-
         if len(confirm_local_move) > 0:
             print('\n')
         
@@ -813,27 +2147,8 @@ def init(app, providers: dict, kwargs: dict):
             print(common_length(new, 40))
             choice_cp += [deflt]
 
-        choice_cp = edit_lines(choice_cp)
+        choice_cp = edit_lines(choice_cp, 'copy', [x[1] for x in confirm_local_copy])
         
-        ind = 0
-        for old, new, rline, deflt, rtime in confirm_local_copy:
-            action = choice_cp[ind]
-
-            if action:
-                overview_downloads += \
-                    [print_message('\033[1;33m', 'c', new)]
-                copy_local(sync_dir + old, sync_dir + new)
-                actual_checksum += [rline]
-            
-            else: 
-                overview_downloads += \
-                    [print_message('\033[1;33m', '+', local_file)]
-                download_rel(new, new)
-                actual_checksum += [rline]
-            
-            os.utime(sync_dir + new, (time.time(), rtime))
-            ind += 1
-
         if len(confirm_local_copy) > 0:
             print('\n')
             
@@ -857,15 +2172,79 @@ def init(app, providers: dict, kwargs: dict):
             print(common_length(x, 70))
             choice_rm += [False]
         
-        choice_rm = edit_lines(choice_rm)
-        overview_removed_msg = []
+        choice_rm = edit_lines(choice_rm, 'remove', overview_removed)
+        
+        if len(overview_removed) > 0:
+            print('\n')
+
+        # a plan stops here, with all the choices made, before any change.
+        if planning['mode'] == 'plan':
+            ops = [('download' if not parse_line(x)[4] in l_file_path else 'modify', 
+                    parse_line(x)[4]) for x in pending_downloads]
+            ops += [('overwrite' if choice[x] else 'keep', confirm_synccfl[x][0]) 
+                    for x in range(len(confirm_synccfl))]
+            ops += [('move', confirm_local_move[x][1], confirm_local_move[x][0]) 
+                    if choice_move[x] else ('download', confirm_local_move[x][1])
+                    for x in range(len(confirm_local_move))]
+            ops += [('copy', confirm_local_copy[x][1], confirm_local_copy[x][0]) 
+                    if choice_cp[x] else ('download', confirm_local_copy[x][1])
+                    for x in range(len(confirm_local_copy))]
+            ops += [('delete' if choice_rm[x] else 'keep', overview_removed[x])
+                    for x in range(len(overview_removed))]
+            listing.close()
+            return save_plan('fetch', local, ops)
+
+        ind = 0
+        for local_file, ltime, rtime, lline, rline, _ in confirm_synccfl:
+            action = choice[ind]
+
+            if action:
+                listing.add('modified', '\033[1;33m', '~', local_file)
+                pending_downloads += [rline]
+            
+            else: actual_checksum += [lline]
+            
+            ind += 1
+
+        ind = 0
+        for old, new, rline, deflt, rtime in confirm_local_move:
+            action = choice_move[ind]
+
+            if action:
+                listing.add('downloaded', '\033[1;33m', 'v', new)
+                move_local(sync_dir + old, sync_dir + new)
+                os.utime(sync_dir + new, (time.time(), rtime))
+                actual_checksum += [stamped_line(rline)]
+            
+            else: 
+                listing.add('downloaded', '\033[1;33m', '+', new)
+                pending_downloads += [rline]
+            
+            ind += 1
+
+        ind = 0
+        for old, new, rline, deflt, rtime in confirm_local_copy:
+            action = choice_cp[ind]
+
+            if action:
+                listing.add('downloaded', '\033[1;33m', 'c', new)
+                copy_local(sync_dir + old, sync_dir + new)
+                os.utime(sync_dir + new, (time.time(), rtime))
+                actual_checksum += [stamped_line(rline)]
+            
+            else: 
+                listing.add('downloaded', '\033[1;33m', '+', new)
+                pending_downloads += [rline]
+            
+            ind += 1
+
         ind = 0
         for x in overview_removed:
             action = choice_rm[ind]
 
             if action:
                 os.remove(sync_dir + x)
-                overview_removed_msg += [print_message('\033[1;31m', '-', x)]
+                listing.add('removed', '\033[1;31m', '-', x)
             
             else: 
                 print('\rUser cancelled the deletion of ', end = '')
@@ -878,24 +2257,367 @@ def init(app, providers: dict, kwargs: dict):
             
             ind += 1
 
+
+        # a lazy fetch still updates the files already there.
+        absent = []
+        if kwargs.get('lazy', False):
+            absent = [x for x in pending_downloads 
+                      if not os.path.exists(sync_dir + parse_line(x)[4])]
+            pending_downloads = [x for x in pending_downloads 
+                                 if os.path.exists(sync_dir + parse_line(x)[4])]
+            defer_downloads(absent)
+
+        actual_checksum += download_pending(pending_downloads)
+        print('{:<80}'.format('Download files finished'))
+        
+        settle_placeholders()
+        print('')
+
+        listing.close()
+        if len(absent) > 0:
+            listing.report('downloaded', '\033[1;32m', 
+                           'files added, {0} of them left to `sync get`.'.format(len(absent)))
+        else: listing.report('downloaded', '\033[1;32m', 'files downloaded.')
+        print('')
+        listing.report('modified', '\033[1;33m', 'files modified.')
+
+        others = [x for x in read_checksum_lines(last_local_chksum) 
+                  if not in_scope(parse_line(x)[4])]
+
+        if (os.path.exists(last_local_chksum)):
+            os.remove(last_local_chksum)
+
+        checksum = open(last_local_chksum, 'a', encoding = 'utf-8')
+        checksum.writelines(others + actual_checksum)
+        checksum.close()
+        clear_journal()
+
+        print('')
+        cache['flush']()
+        report_copies()
+        governor.report()
+
+        print('\n\033[1;32m{0}\033[0m'.format('All jobs finished.' ))
+
+    # restore the local directory to the state of the last snapshot taken at
+    # or before the moment. the remote catalog is left as it is, so that the
+    # next push makes the restored state the current one.
+
+    def fetch_at(moment):
+
+        info('Listing the snapshots ...')
+        snapshots = list_snapshots()
+        index = len([x for x in snapshots if x[0] <= moment]) - 1
+
+        if index < 0:
+            warning('No snapshot is taken before {0}. The snapshots available are:'
+                    .format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(moment))))
+            for stamp, kind, _ in snapshots:
+                print('  {0} ({1})'.format(
+                      time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)), kind))
+            return
+
+        info('Restoring the snapshot of {0} ...'.format(
+             time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshots[index][0]))))
+        state = snapshot_state(snapshots, index)
+        state = {k: v for k, v in state.items() if in_selection(k)}
+
+        l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = \
+            build_local_checksum()
+        r_hash_num, r_file_length, _, _, r_file_path, r_attrs = read_remote_checksum()
+        versions = list_remote(version_dir + '/')
+        sync_dir = kwargs['dest']
+
+        local_index = {}
+        contents = {}
+        for x in range(len(l_file_path)):
+            local_index[l_file_path[x]] = x
+            contents[(l_hash_num[x], l_file_length[x])] = l_file_path[x]
+        
+        stored = {}
+        for x in range(len(r_file_path)):
+            stored[(r_hash_num[x], r_file_length[x])] = \
+                (r_file_path[x], r_attrs.get(r_file_path[x], {}))
+
+        actual_checksum = []
+        pending_downloads = []
+        listing = shared.progress.results(conf_dir + '/fetch.files.log')
+        num_unchanged = 0
+
+        for path in sorted(state.keys()):
+            s_hash, s_size, s_mtime, s_stime, _, s_attrs = parse_line(state[path])
+            key = (s_hash, s_size)
+
+            if path in local_index.keys() and \
+               (l_hash_num[local_index[path]], l_file_length[local_index[path]]) == key:
+                os.utime(sync_dir + path, (time.time(), s_mtime))
+                actual_checksum += [stamped_line(state[path])]
+                num_unchanged += 1
+                continue
+
+            listing.add('downloaded', '\033[1;32m', '+', path)
+
+            # the same content elsewhere in the local directory. the content
+            # this file had is no longer a source to copy from.
+            source = contents.get(key, None)
+            if path in local_index.keys():
+                lx = local_index[path]
+                if contents.get((l_hash_num[lx], l_file_length[lx]), None) == path:
+                    del contents[(l_hash_num[lx], l_file_length[lx])]
+            
+            if source is not None:
+                copy_local(sync_dir + source, sync_dir + path)
+                os.utime(sync_dir + path, (time.time(), s_mtime))
+                actual_checksum += [stamped_line(state[path])]
+                continue
+
+            # the content is the file itself if it is still in the remote catalog, 
+            # or its preserved version otherwise.
+            if key in stored.keys():
+                obj, attrs = stored[key]
+                attrs = dict(attrs)
+            elif version_object(s_hash, s_size) in versions.keys():
+                obj = version_object(s_hash, s_size)
+                attrs = {k: v for k, v in s_attrs.items() if k != 'bundle'}
+            else:
+                obj = path
+                attrs = dict(s_attrs)
+
+            if not 'bundle' in attrs.keys() and obj != path: attrs['object'] = obj
+            pending_downloads += [format_line(s_hash, s_size, s_mtime, s_stime, path, attrs)]
+        
+        # the local files not in the snapshot.
+        overview_removed = [x for x in l_file_path if not x in state.keys()]
         if len(overview_removed) > 0:
-            print('\n')
+            print('\033[1;31m{0} local files are not in the snapshot.\033[0m'
+                  .format(str(len(overview_removed))))
+            info('place <x> to delete from local machine')
+            info('place <space> to keep the local copy\n')
+
+        choice_rm = []
+        for x in overview_removed:
+            print('[ ] ', end = '')
+            fore_red()
+            print('[-]', end = ' ')
+            ansi_reset()
+            print(common_length(x, 70))
+            choice_rm += [False]
+        
+        choice_rm = edit_lines(choice_rm)
+        print('')
+        for x in range(len(overview_removed)):
+            if choice_rm[x]:
+                os.remove(sync_dir + overview_removed[x])
+                continue
+
+            lx = local_index[overview_removed[x]]
+            actual_checksum += [format_line(l_hash_num[lx], l_file_length[lx], 
+                                            l_last_modified[lx], l_stime[lx], 
+                                            overview_removed[x])]
+
+        actual_checksum += download_pending(pending_downloads)
+        print('{:<80}'.format('Download files finished'))
+        
+        print('')
+        listing.close()
+        listing.report('downloaded', '\033[1;32m', 'files restored.')
+        print('\033[1;30m{0} files unchanged.\033[0m'.format(num_unchanged))
+
+        others = [x for x in read_checksum_lines(last_local_chksum) 
+                  if not in_scope(parse_line(x)[4])]
+
+        if (os.path.exists(last_local_chksum)):
+            os.remove(last_local_chksum)
+
+        checksum = open(last_local_chksum, 'a', encoding = 'utf-8')
+        checksum.writelines(others + actual_checksum)
+        checksum.close()
+        clear_journal()
+
+        print('')
+        cache['flush']()
+        report_copies()
+        governor.report()
+
+        print('\n\033[1;32m{0}\033[0m'.format('All jobs finished.' ))
+
+    # the archive sets (see shared/archive.py) with a manifest among the listed
+    # remote objects, oldest first.
+    def archive_sets(listed):
+        names = []
+        for obj in listed.keys():
+            splits = obj[len(shared.archive.archive_dir) + 1:].split('/')
+            if obj.startswith(shared.archive.archive_dir + '/') and \
+               len(splits) == 2 and splits[1] == 'manifest.tsv':
+                names += [splits[0]]
+        return sorted(names)
+
+    def bootstrap():
+        if kwargs.get('pack', False): return pack_archives()
+        else: return unpack_archives()
+
+    # pack the local files matching the remote catalog into a new archive set.
+    def pack_archives():
+
+        l_hash_num, l_file_length, l_last_modified, _, l_file_path = \
+            build_local_checksum()
+        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path, r_attrs = \
+            select_scope(read_remote_checksum())
+
+        local_index = {}
+        for x in range(len(l_file_path)): local_index[l_file_path[x]] = x
+
+        name = shared.archive.set_name(time.time())
+        archives = shared.archive.writer(conf_dir + '/archive.part', name, 
+                                         archive_size, upload_abs)
+        manifest = []
+        skipped = []
+        
+        info('Packing the archive set {0} ...'.format(name))
+        meter = shared.progress.progress('Packing', len(r_file_path), sum(r_file_length))
+        for x in range(len(r_file_path)):
+            remote_file = r_file_path[x]
+            lx = local_index.get(remote_file, None)
+
+            # only the content the catalog refers to is packed. the ignore marks
+            # are left to fetch.
+            if lx is None or l_hash_num[lx] != r_hash_num[x] or \
+               l_file_length[lx] != r_file_length[x] or r_hash_num[x] == manual_zero_md5:
+                skipped += [remote_file]
+                continue
+
+            index = archives.add_file(remote_file, kwargs['dest'] + remote_file,
+                                      r_last_modified[x])
+            governor.disk(r_file_length[x])
+            meter.advance(remote_file, r_file_length[x])
+
+            attrs = dict(r_attrs.get(remote_file, {}))
+            attrs['archive'] = str(index)
+            manifest += [format_line(r_hash_num[x], r_file_length[x], r_last_modified[x],
+                                     r_stime[x], remote_file, attrs)]
+        
+        num_archives = archives.close()
+
+        # the manifest goes last, as it makes the set visible to bootstrap.
+        temp = conf_dir + '/manifest.part'
+        with open(temp, 'w', encoding = 'utf-8') as fp:
+            fp.writelines(manifest)
+        upload_abs(temp, shared.archive.manifest_object(name))
+        os.remove(temp)
+
+        meter.close()
+        print('\033[1;32m{0} files packed into {1} archives.\033[0m'.format(
+              len(manifest), num_archives))
+        if len(skipped) > 0:
+            info('{0} files differing from the remote catalog are left to fetch.'
+                 .format(len(skipped)))
+        
+        governor.report()
+        print('\n\033[1;32m{0}\033[0m'.format('All jobs finished.' ))
+
+    # restore the files of the latest archive set absent from the local directory,
+    # and record them in the local catalog as they are, so that they are not read
+    # again. the files changed since the set was packed are left to fetch.
+    def unpack_archives():
+
+        info('Listing the archive sets ...')
+        names = archive_sets(list_remote(shared.archive.archive_dir + '/'))
+        if len(names) == 0:
+            warning('No archive set is found. Pack one with `sync bootstrap --pack` '
+                    'on a machine holding the tree.')
+            return
+
+        name = names[-1]
+        temp = conf_dir + '/manifest.part'
+        if os.path.exists(temp): os.remove(temp)
+        download_abs(shared.archive.manifest_object(name), temp)
+        manifest = read_checksum_lines(temp)
+        if os.path.exists(temp): os.remove(temp)
+
+        sync_dir = kwargs['dest']
+        wanted = {}
+        existing = 0
+        for line in manifest:
+            ihash, ilen, mtime, stime, path, attrs = parse_line(line)
+            if os.path.exists(sync_dir + path):
+                existing += 1
+                continue
+            
+            index = int(attrs.pop('archive'))
+            if not index in wanted.keys(): wanted[index] = {}
+            wanted[index][shared.archive.member_name(path)] = \
+                format_line(ihash, ilen, mtime, stime, path, attrs)
 
-        print('\033[1;32m{0} files downloaded.\033[0m'
-              .format(str(len(overview_downloads))))
-        for x in overview_downloads: print(x)
+        info('Restoring from the archive set {0}, {1} files already exist.'
+             .format(name, existing))
 
-        print('\n\033[1;33m{0} files modified.\033[0m'
-              .format(str(len(overview_modified))))
-        for x in overview_modified: print(x)
+        lines = []
+        failed = []
+        temp = conf_dir + '/archive.part'
+        meter = shared.progress.progress('Restoring', sum([len(x) for x in wanted.values()]),
+                                         sum([parse_line(x)[1] for members in wanted.values()
+                                              for x in members.values()]))
+
+        def extract(member, content):
+            if not member in members.keys(): return
+            
+            rline = members[member]
+            r_size, remote_file = parse_line(rline)[1], parse_line(rline)[4]
+            local = sync_dir + remote_file
+
+            if not os.path.exists(os.path.dirname(local)):
+                os.makedirs(os.path.dirname(local))
+
+            digest = shared.digest.hasher(r_size)
+            with open(local + part_suffix, 'wb') as fp:
+                while True:
+                    data = content.read(shared.digest.block_size)
+                    if len(data) == 0: break
+                    digest.update(data)
+                    fp.write(data)
+
+            if place_verified(rline, digest.hexdigest()):
+                lines.append(settle_download(rline))
+            else: failed.append(remote_file)
+            meter.advance(remote_file, r_size)
+
+        for index in sorted(wanted.keys()):
+            members = wanted[index]
+            if os.path.exists(temp): os.remove(temp)
+            download_abs(shared.archive.archive_object(name, index), temp)
+            
+            if not os.path.exists(temp):
+                failed += [parse_line(x)[4] for x in members.values()]
+                continue
+            
+            shared.archive.read_members(temp, extract)
+            os.remove(temp)
+
+        meter.close()
+        if len(failed) > 0:
+            warning('{0} files cannot be restored from the archives, and are left to '
+                    'fetch:'.format(len(failed)))
+            for remote_file in failed: print_message('\033[1;31m', '!', remote_file, False)
+            print('')
+
+        # the entries already in the local catalog are kept.
+        restored = set([parse_line(x)[4] for x in lines])
+        previous = [x for x in read_checksum_lines(last_local_chksum)
+                    if not parse_line(x)[4] in restored]
 
         if (os.path.exists(last_local_chksum)):
             os.remove(last_local_chksum)
 
         checksum = open(last_local_chksum, 'a', encoding = 'utf-8')
-        checksum.writelines(actual_checksum)
+        checksum.writelines(previous + lines)
         checksum.close()
+        clear_journal()
 
+        print('\033[1;32m{0} files restored from {1} archives.\033[0m'.format(
+              len(lines), len(wanted)))
+        info('Run `sync fetch` to bring the files changed since {0} up to date.'
+             .format(name))
+        governor.report()
         print('\n\033[1;32m{0}\033[0m'.format('All jobs finished.' ))
 
     def diff():
@@ -903,11 +2625,12 @@ def init(app, providers: dict, kwargs: dict):
         l_hash_num, l_file_length, l_last_modified, l_stime, l_file_path = \
             build_local_checksum()
         ll_hash_num, ll_file_length, ll_last_modified, ll_stime, ll_file_path = \
-            read_local_last_checksum()
-        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path = \
-            read_remote_checksum()
+            select_scope(read_local_last_checksum())
+        r_hash_num, r_file_length, r_last_modified, r_stime, r_file_path, r_attrs = \
+            select_scope(read_remote_checksum())
         
         print('')
+        reconcile = begin('reconcile', local = len(l_file_path), remote = len(r_file_path))
 
         for x in range(len(l_file_path)):
             local_file = l_file_path[x]
@@ -936,6 +2659,7 @@ def init(app, providers: dict, kwargs: dict):
                         print('[l] {:<7}'.format(l_hash_num[x][:7]), end = '')
                         ansi_reset()
                         print_message(' \033[1;33m', '~', local_file, overwrite = False)
+                        shared.metrics.count('changes', kind = 'modified')
                     
                     else:
                         fore_red()
@@ -946,6 +2670,7 @@ def init(app, providers: dict, kwargs: dict):
                         print('[l] {:<7}'.format(l_hash_num[x][:7]), end = '')
                         ansi_reset()
                         print_message(' \033[1;33m', '!', local_file, overwrite = False)
+                        shared.metrics.count('changes', kind = 'modified')
                 
                 else: pass
 
@@ -963,6 +2688,7 @@ def init(app, providers: dict, kwargs: dict):
                         print('[l] {:<7}'.format('-------'), end = '')
                         ansi_reset()
                         print_message(' \033[1;33m', 'v', r_file_path[remotex], overwrite = False)
+                        shared.metrics.count('changes', kind = 'moved')
                         
                         fore_red()
                         print('[r] {:<7}'.format('-------'), end = '')
@@ -982,6 +2708,7 @@ def init(app, providers: dict, kwargs: dict):
                         print('[l] {:<7}'.format('-------'), end = '')
                         ansi_reset()
                         print_message(' \033[1;33m', 'c', r_file_path[remotex], overwrite = False)
+                        shared.metrics.count('changes', kind = 'copied')
 
                         fore_red()
                         print('[r] {:<7}'.format('-------'), end = '')
@@ -1001,6 +2728,7 @@ def init(app, providers: dict, kwargs: dict):
                     print('[l] {:<7}'.format(l_hash_num[x][:7]), end = '')
                     ansi_reset()
                     print_message(' \033[1;32m', '+', local_file, overwrite = False)
+                    shared.metrics.count('changes', kind = 'added')
 
         for x in range(len(r_file_path)):
             remote_file = r_file_path[x]
@@ -1014,9 +2742,282 @@ def init(app, providers: dict, kwargs: dict):
                 print('[l] {:<7}'.format('-------'), end = '')
                 ansi_reset()
                 print_message(' \033[1;31m', '-', remote_file, overwrite = False)
+                shared.metrics.count('changes', kind = 'removed')
+
+        reconcile.end()
+        print('')
+        governor.report()
+
+    # audit the objects the remote catalog refers to, without downloading any
+    # of them. the objects are listed by prefix in parallel, and their lengths
+    # and etags are compared with the catalog where it tells what they should 
+    # be. the etag is only comparable for objects uploaded in one piece, which
+    # includes bundles (named after their md5), compressed objects (with their
+    # md5 recorded), and files under 10 MiB (whose checksum is the plain md5).
+    # with 'repair', the files behind the broken objects are uploaded again as
+    # plain objects, if the local copies still match the catalog.
+
+    def verify():
+
+        info('Reading the remote catalog ...')
+        r_hash_num, r_file_length, _, _, r_file_path, r_attrs = read_remote_checksum()
+        
+        if len(r_file_path) == 0:
+            warning('The remote catalog is empty or missing.')
+            return
+
+        # remote object to [expected length, expected md5, catalog indices].
+        expected = {}
+
+        for x in range(len(r_file_path)):
+            remote_file = r_file_path[x]
+            attrs = r_attrs.get(remote_file, {})
+            length, md5 = r_file_length[x], r_hash_num[x]
+
+            if 'bundle' in attrs.keys():
+                name = shared.bundle.parse_location(attrs['bundle'])[0]
+                obj = shared.bundle.bundle_object(name)
+                length, md5 = shared.bundle.bundle_length(name), name.split('-')[0]
+            
+            else:
+                obj = remote_file
+                if 'codec' in attrs.keys():
+                    length = int(attrs['osize']) if 'osize' in attrs.keys() else None
+                    md5 = attrs.get('omd5')
+                elif remote_file.endswith('/.ignore') and md5 == manual_zero_md5:
+                    length, md5 = None, None
+                elif length >= shared.digest.whole_limit:
+                    md5 = None
+
+            if not obj in expected.keys(): expected[obj] = [length, md5, []]
+            expected[obj][2] += [x]
+
+        # one listing for each top level directory, and each file at the top.
+        prefixes = []
+        for obj in expected.keys():
+            parts = obj.split('/')
+            prefix = obj if len(parts) <= 2 else '/' + parts[1] + '/'
+            if not prefix in prefixes: prefixes += [prefix]
+
+        info('Listing {0} objects under {1} prefixes ...'.format(len(expected), len(prefixes)))
+        listed = {}
+        with ThreadPoolExecutor(max_workers = governor.workers(8)) as pool:
+            for objects in pool.map(list_remote, prefixes):
+                listed.update(objects)
+
+        missing = []
+        truncated = []
+        mismatched = []
+
+        for obj in expected.keys():
+            length, md5, _ = expected[obj]
+            
+            if not obj in listed.keys():
+                missing += [obj]
+                continue
+            
+            osize, etag, _ = listed[obj]
+            if length is not None and osize < length: truncated += [obj]
+            elif length is not None and osize != length: mismatched += [obj]
+            elif md5 is not None and etag != '' and not '-' in etag and \
+                 etag.lower() != md5.lower():
+                mismatched += [obj]
+
+        print('')
+        for title, color, mark, objs in [('missing', '\033[1;31m', '-', missing),
+                                         ('truncated', '\033[1;33m', '<', truncated),
+                                         ('mismatched', '\033[1;33m', '!', mismatched)]:
+            if len(objs) == 0: continue
+            print('{0}{1} objects {2}.\033[0m'.format(color, len(objs), title))
+            for obj in objs: print_message(color, mark, obj, False)
+            print('')
+
+        broken = missing + truncated + mismatched
+        if len(broken) == 0:
+            print('\033[1;32mAll {0} remote objects are intact.\033[0m'.format(len(expected)))
+            governor.report()
+            return
+        
+        if not kwargs.get('repair', False):
+            info('Run `verify --repair` to upload the affected files again.')
+            governor.report()
+            return
+
+        # the catalog lines, by index, of the files to upload again.
+        with open(remote_chksum, 'r', encoding = 'utf-8') as fp:
+            lines = fp.read().splitlines(keepends = True)
+        
+        repaired = 0
+        unrepairable = []
+
+        for obj in broken:
+            for x in expected[obj][2]:
+                remote_file = r_file_path[x]
+                local = kwargs['dest'] + remote_file
+                line_start()
+                fill_blank(80, remote_file)
+
+                if not os.path.exists(local) or (
+                   not remote_file.endswith('/.ignore') and (
+                   os.path.getsize(local) != r_file_length[x] or 
+                   shared.digest.hash_file(local, r_file_length[x], governor) != r_hash_num[x])):
+                    unrepairable += [remote_file]
+                    continue
+
+                upload_rel(remote_file, remote_file)
+                lines[x] = with_attrs(lines[x], None)
+                repaired += 1
+
+        line_start()
+        if repaired > 0:
+            publish_catalog(lines)
+            print('\033[1;32m{0} files uploaded again.\033[0m'.format(repaired))
+
+        if len(unrepairable) > 0:
+            warning('{0} files are changed or missing locally, and cannot be repaired:'
+                    .format(len(unrepairable)))
+            for remote_file in unrepairable: print_message('\033[1;31m', '-', remote_file, False)
+
+        governor.report()
+
+    # remove the remote objects that the remote catalog no longer refers to: 
+    # the files removed since (push only drops them from the catalog), the old
+    # places of the files moved by copying, and the bundles no longer used. 
+    # objects modified within 'gc-retention' are kept, since they may belong
+    # to a push still running elsewhere, and so are the objects matching the
+    # 'gc-keep' patterns (by default, the dumps of database tasks sharing the
+    # bucket). the deletes are sent in batches, several at the same time.
+
+    def gc():
+
+        info('Reading the remote catalog ...')
+        r_hash_num, r_file_length, _, _, r_file_path, r_attrs = read_remote_checksum()
+
+        # a catalog failed to download would make everything garbage.
+        if len(r_file_path) == 0:
+            warning('The remote catalog is empty or missing, nothing is collected.')
+            return
+
+        referenced = set([catalog_file, catalog_object(catalog['generation'])])
+        for remote_file in r_file_path:
+            referenced.add(stored_object(remote_file, r_attrs.get(remote_file, {})))
+
+        # and the uploads of an interrupted push, not in the catalog yet.
+        journaled = read_journal()
+        for path in journaled.keys():
+            kind, jline = journaled[path]
+            if kind == 'U': referenced.add(stored_object(path, parse_line(jline)[5]))
+
+        # the snapshots within the retention, and at least the latest one, are
+        # kept along with all the objects they refer to.
+        snapshots = list_snapshots()
+        first = len(snapshots)
+        while first > 0 and (first == len(snapshots) or 
+                             time.time() - snapshots[first - 1][0] < snapshot_keep):
+            first -= 1
+
+        squashed = []
+        state = {}
+        base = []
+        if first < len(snapshots):
+            info('Reading {0} snapshots ...'.format(len(snapshots) - first))
+            state = snapshot_state(snapshots, first)
+            base = list(state.values())
+            
+            # the oldest snapshot kept must be a full one, as its base is removed.
+            if first > 0 and snapshots[first][1] != 'full':
+                squashed = [snapshots[first][2], snapshot_object(snapshots[first][0], 'full')]
+
+        for x in range(first, len(snapshots)):
+            if x > first:
+                lines = apply_snapshot(state, snapshots[x][1], read_snapshot(snapshots[x][2]))
+            else: lines = base
+            
+            referenced.add(snapshots[x][2])
+            for line in lines:
+                ihash, ilen, _, _, path, attrs = parse_line(line)
+                referenced.add(stored_object(path, attrs))
+                referenced.add(version_object(ihash, ilen))
+        
+        if len(squashed) > 0: 
+            referenced.discard(squashed[0])
+            referenced.add(squashed[1])
+
+        info('Listing the remote objects ...')
+        listed = list_remote('/')
+
+        # the latest archive set is kept for bootstrapping new machines.
+        names = archive_sets(listed)
+        if len(names) > 0:
+            prefix = '{0}/{1}/'.format(shared.archive.archive_dir, names[-1])
+            referenced.update([x for x in listed.keys() if x.startswith(prefix)])
+        now = time.time()
+
+        garbage = []
+        num_recent = 0
+        num_kept = 0
+
+        for obj in sorted(listed.keys()):
+            if obj in referenced: continue
+            
+            if any([fnmatch.fnmatchcase(obj, pattern) for pattern in gc_keep]):
+                num_kept += 1
+            elif now - listed[obj][2] < gc_retention:
+                num_recent += 1
+            else: garbage += [obj]
+
+        reclaim = sum([listed[obj][0] for obj in garbage])
+
+        print('')
+        for obj in garbage:
+            print_message('\033[1;31m', '-', obj, False)
+
+        print('\n\033[1;31m{0} objects ({1}) are no longer referenced.\033[0m'
+              .format(len(garbage), format_file_size(reclaim)))
+        print('\033[1;30m{0} referenced, {1} unreferenced but newer than the retention, '
+              '{2} kept by patterns.\033[0m'.format(
+              len(listed) - len(garbage) - num_recent - num_kept, num_recent, num_kept))
+        print('')
+
+        if len(garbage) == 0: return
+        if kwargs.get('dry-run', False):
+            info('Dry run, nothing is removed.')
+            return
+
+        if not confirm('Remove them from the remote? This cannot be reversed! [y/n] > ',
+                       kwargs.get('y', False)):
+            info('Operation cancelled.')
+            return
+
+        if len(squashed) > 0:
+            temp = conf_dir + '/snapshot.part'
+            with open(temp, 'w', encoding = 'utf-8') as fp:
+                fp.writelines(base)
+            upload_abs(temp, squashed[1])
+            os.remove(temp)
+
+        batches = [garbage[x : x + gc_batch] for x in range(0, len(garbage), gc_batch)]
+        with ThreadPoolExecutor(max_workers = governor.workers(4)) as pool:
+            removed = sum(pool.map(delete_remote, batches))
+
+        print('\033[1;32m{0} objects removed, {1} reclaimed.\033[0m'.format(
+              removed, format_file_size(reclaim)))
+        governor.report()
+
+    # the remote object storing the file of a catalog entry.
+    def stored_object(remote_file, attrs):
+        if 'bundle' in attrs.keys():
+            return shared.bundle.bundle_object(shared.bundle.parse_location(attrs['bundle'])[0])
+        return remote_file
 
     return {
-        'fetch': fetch,
         'push': push,
-        'diff': diff
+        'fetch': fetch,
+        'diff': diff,
+        'verify': verify,
+        'gc': gc,
+        'bootstrap': bootstrap,
+        'get': get,
+        'plan': plan,
+        'apply': apply
     }
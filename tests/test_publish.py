@@ -0,0 +1,127 @@
+# ./tests/test_publish.py
+#   the publishing of the remote catalog by concurrent pushes, on a bucket of
+#   the local oss provider. two machines are simulated by two copies of the
+#   application, each with a task of its own tree. the push of the second one
+#   is run while the first one is about to publish, so that the generation
+#   the first one wants is taken, and it has to merge.
+#
+#   usage: python -m unittest discover tests
+#
+# license: gplv3. <https://www.gnu.org/licenses>
+# contact: yang-z <xornent at outlook dot com>
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.realpath(__file__))).replace('\\', '/')
+sys.path.insert(0, root)
+
+import shared.digest
+
+task = 'race'
+
+# run the push of the application, running the push of the other application
+# right before its first conditional put. argv: <app> <other app>.
+racing_push = '''
+import os, runpy, subprocess, sys
+app, other = sys.argv[1], sys.argv[2]
+sys.path.insert(0, app)
+import shared.oss_local as provider
+
+create_file = provider.create_file
+raced = []
+def racing_create(file, destfile, kwargs):
+    if len(raced) == 0:
+        raced.append(destfile)
+        subprocess.run([sys.executable, other + '/sync', '-y', '--no-agent', 'push', '{0}'],
+                       stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, check = True)
+    return create_file(file, destfile, kwargs)
+provider.create_file = racing_create
+
+sys.argv = [app + '/sync', '-y', '--no-agent', 'push', '{0}']
+runpy.run_path(app + '/sync', run_name = '__main__')
+'''.format(task)
+
+def make_app(work: str) -> str:
+    app = tempfile.mkdtemp(dir = work)
+    os.makedirs(app + '/conf')
+    shutil.copy(root + '/sync', app + '/sync')
+    for package in ['shared', 'tasks']:
+        shutil.copytree(root + '/' + package, app + '/' + package,
+                        ignore = shutil.ignore_patterns('__pycache__'))
+    for conf in ['providers', 'tasks']:
+        shutil.copy(root + '/conf/' + conf, app + '/conf/' + conf)
+    return app
+
+def run_sync(app: str, argv: list):
+    subprocess.run([sys.executable, app + '/sync', '-y', '--no-agent'] + argv,
+                   stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, check = True)
+
+def write(path: str, content: bytes):
+    with open(path, 'wb') as fp: fp.write(content)
+
+def read(path: str) -> bytes:
+    with open(path, 'rb') as fp: return fp.read()
+
+# the lines of the latest generation of the remote catalog, by path.
+def latest_catalog(bucket: str) -> dict:
+    generations = sorted(os.listdir(bucket + '/.catalogs'))
+    lines = {}
+    with open(bucket + '/.catalogs/' + generations[-1], 'r', encoding = 'utf-8') as fp:
+        for line in fp:
+            columns = line.rstrip('\n').split('\t')
+            lines[columns[4]] = columns
+    return lines
+
+class concurrent_push(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.bucket = self.work + '/bucket'
+        self.trees = [self.work + '/a', self.work + '/b']
+        self.apps = [make_app(self.work), make_app(self.work)]
+        os.makedirs(self.bucket)
+
+        for app, tree in zip(self.apps, self.trees):
+            os.makedirs(tree)
+            run_sync(app, ['add', task, 'filesystem', '-oss-provider', 'local',
+                           '-root', self.bucket, '-dest', tree])
+
+        write(self.trees[0] + '/both', b'base\n')
+        write(self.trees[0] + '/ours', b'base\n')
+        write(self.trees[0] + '/theirs', b'base\n')
+        run_sync(self.apps[0], ['push', task])
+        run_sync(self.apps[1], ['fetch', task])
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def race(self):
+        subprocess.run([sys.executable, '-c', racing_push, self.apps[0], self.apps[1]],
+                       stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, check = True)
+
+    def assert_stored(self, catalog: dict, path: str, content: bytes):
+        self.assertEqual(read(self.bucket + path), content)
+        self.assertEqual(catalog[path][0], shared.digest.hash_file(self.bucket + path, len(content)))
+        self.assertEqual(int(catalog[path][1]), len(content))
+
+    # the changes of both pushes are published, and the object of the file
+    # changed by both holds the content the catalog records for it.
+    def test_conflict_uploaded_again(self):
+        write(self.trees[0] + '/both', b'from the first machine\n')
+        write(self.trees[0] + '/ours', b'from the first machine\n')
+        write(self.trees[1] + '/both', b'from the second machine, longer\n')
+        write(self.trees[1] + '/theirs', b'from the second machine\n')
+        self.race()
+
+        catalog = latest_catalog(self.bucket)
+        self.assert_stored(catalog, '/both', b'from the first machine\n')
+        self.assert_stored(catalog, '/ours', b'from the first machine\n')
+        self.assert_stored(catalog, '/theirs', b'from the second machine\n')
+
+if __name__ == '__main__':
+    unittest.main()